@@ -0,0 +1,457 @@
+"""Asyncio dispatch engine built on aiohttp."""
+
+import argparse
+import asyncio
+import gzip
+import os
+import sys
+from collections import deque
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Deque,
+    Dict,
+    Iterable,
+    List,
+    Tuple,
+)
+
+try:
+    import aiohttp
+except ImportError:  # pragma: no cover - optional dependency
+    aiohttp = None
+
+from .balancer import EndpointBalancer, NoHealthyEndpointError
+from .cache import ResultCache, hash_stream
+from .cli2rest_bio import (
+    FAILOVER_STATUS_CODES,
+    RETRY_STATUS_CODES,
+    build_error_metadata,
+    build_form_data,
+    input_timeout,
+    is_complete_result,
+    open_input_file,
+    output_location,
+    output_opener,
+    read_input_features,
+    record_cost,
+    report_result_status,
+    uses_input_timeout,
+)
+from .costmodel import CostStore
+from .metadata import ResumedResults
+from .multipart import DEFAULT_CHUNK_SIZE, MultipartStreamParser, get_boundary
+
+
+def check_available() -> None:
+    """Exit with a helpful message if aiohttp is not installed."""
+    if aiohttp is None:
+        print(
+            "Error: --engine asyncio requires aiohttp "
+            "(install with: pip install 'cli2rest-bio[asyncio]')",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+
+
+class _RetryableStatus(Exception):
+    """The server rejected a request without running it, e.g. with HTTP 503."""
+
+
+def _connect_errors() -> Tuple[type, ...]:
+    """
+    Return the errors raised before a request reached the server.
+
+    Only these are retried: after the body was sent, the tool may already be
+    running, and sending the request again would run it twice.
+    """
+    errors: List[type] = [aiohttp.ClientConnectorError]
+    # aiohttp 3.10 and later tell connect timeouts apart from read timeouts
+    if hasattr(aiohttp, "ConnectionTimeoutError"):
+        errors.append(aiohttp.ConnectionTimeoutError)
+    return tuple(errors)
+
+
+async def _read_chunks(file_object: Any) -> AsyncIterator[bytes]:
+    loop = asyncio.get_running_loop()
+    while True:
+        chunk = await loop.run_in_executor(None, file_object.read, DEFAULT_CHUNK_SIZE)
+        if not chunk:
+            break
+        yield chunk
+
+
+def _build_form(
+    form_data: Dict[str, Any], input_file_config_path: str, file_object: Any
+) -> "aiohttp.FormData":
+    form = aiohttp.FormData()
+    for name, value in form_data.items():
+        for item in value if isinstance(value, tuple) else (value,):
+            form.add_field(name, item)
+    if isinstance(file_object, gzip.GzipFile):
+        # aiohttp would take the compressed size from fileno() as the length,
+        # so stream decompressed data with chunked transfer encoding instead
+        form.add_field(
+            "input_files",
+            _read_chunks(file_object),
+            filename=input_file_config_path,
+            content_type="application/octet-stream",
+        )
+    else:
+        # aiohttp streams plain file objects in chunks and closes them once sent
+        form.add_field("input_files", file_object, filename=input_file_config_path)
+    return form
+
+
+async def save_multipart_response_async(
+    response: "aiohttp.ClientResponse",
+    output_dir: str,
+    output_prefix: str,
+) -> Tuple[Dict[str, Any], Dict[str, str]]:
+    """
+    Asynchronous counterpart of save_multipart_response.
+
+    Only the network reads run on the event loop. Parsing and writing the
+    outputs, which open and write files and may block on slow filesystems,
+    run in the default executor, one chunk at a time while the next one is
+    being received.
+    """
+    loop = asyncio.get_running_loop()
+    saved_paths: Dict[str, str] = {}
+    try:
+        parser = MultipartStreamParser(
+            get_boundary(response.headers.get("Content-Type")),
+            output_opener(output_dir, output_prefix, saved_paths),
+        )
+    except ValueError as e:
+        print(f"Error reading multipart response: {e}", file=sys.stderr)
+        return {}, {}
+
+    feeding: "asyncio.Future[None] | None" = None
+    try:
+        async for chunk in response.content.iter_chunked(DEFAULT_CHUNK_SIZE):
+            if feeding is not None:
+                await feeding
+            feeding = loop.run_in_executor(None, parser.feed, chunk)
+        if feeding is not None:
+            await feeding
+        await loop.run_in_executor(None, parser.close)
+    except (aiohttp.ClientError, asyncio.TimeoutError, IOError, ValueError) as e:
+        if feeding is not None and not feeding.done():
+            # The parser is not thread-safe, let the last chunk finish first
+            await asyncio.wait([feeding])
+        await loop.run_in_executor(None, parser.abort)
+        print(f"Error reading multipart response: {e}", file=sys.stderr)
+        return {}, {}
+
+    for path in saved_paths.values():
+        print(f"Saved output to: {path}", file=sys.stderr)
+
+    return parser.metadata, saved_paths
+
+
+async def process_file_async(
+    input_file: str,
+    config: Dict[str, Any],
+    args: argparse.Namespace,
+    http: "aiohttp.ClientSession",
+    balancer: EndpointBalancer,
+    tool_name: str,
+    output_dir_base: str,
+    cache: ResultCache | None = None,
+    costs: CostStore | None = None,
+) -> Dict[str, Any]:
+    """Asynchronous counterpart of process_file, returning the same metadata."""
+    loop = asyncio.get_running_loop()
+    effective_output_dir, output_prefix = output_location(
+        input_file, args, tool_name, output_dir_base
+    )
+
+    print(f"Processing file: {input_file}", file=sys.stderr)
+
+    full_arguments = config.get("arguments", [])
+    output_file_names = config.get("output_files", [])
+
+    if not full_arguments:
+        message = "No arguments specified in configuration"
+        print(f"Error: {message}", file=sys.stderr)
+        return build_error_metadata(full_arguments, output_file_names, stderr=message)
+
+    input_file_config_path = config.get("input_file")
+    if not input_file_config_path:
+        message = "No input_file specified in configuration"
+        print(f"Error: {message}", file=sys.stderr)
+        return build_error_metadata(full_arguments, output_file_names, stderr=message)
+
+    def open_upload() -> Any:
+        return open_input_file(input_file, args)
+
+    def read_cached() -> Any:
+        with open_upload() as file_object:
+            key = cache.key(hash_stream(file_object))
+        return key, cache.restore(key, effective_output_dir, output_prefix)
+
+    # Hashing and copying files are blocking, keep them off the event loop
+    cache_key = None
+    try:
+        if cache is not None:
+            cache_key, cached_result = await loop.run_in_executor(None, read_cached)
+            if cached_result is not None:
+                print(f"Using cached result for {input_file}", file=sys.stderr)
+                return cached_result
+    except FileNotFoundError:
+        message = f"Input file {input_file} not found."
+        print(f"Error: {message}", file=sys.stderr)
+        return build_error_metadata(full_arguments, output_file_names, stderr=message)
+    except Exception as e:
+        message = f"Error opening input file {input_file}: {e}"
+        print(message, file=sys.stderr)
+        return build_error_metadata(full_arguments, output_file_names, stderr=message)
+
+    features = None
+    timeout = args.timeout
+    if uses_input_timeout(args):
+        try:
+            features = await loop.run_in_executor(
+                None, read_input_features, input_file, args
+            )
+            timeout = input_timeout(features, args, costs)
+        except (OSError, EOFError) as e:
+            print(
+                f"Warning: Using --timeout for {input_file}, could not measure it: {e}",
+                file=sys.stderr,
+            )
+
+    form_data = build_form_data(full_arguments, output_file_names, args, timeout)
+    attempt = 0
+
+    while True:
+        try:
+            base_url = balancer.acquire()
+        except NoHealthyEndpointError as e:
+            message = f"Error processing {input_file}: {e}"
+            print(message, file=sys.stderr)
+            return build_error_metadata(
+                full_arguments, output_file_names, stderr=str(e)
+            )
+
+        try:
+            file_object = await asyncio.to_thread(open_upload)
+        except FileNotFoundError:
+            balancer.release(base_url, 0.0)
+            message = f"Input file {input_file} not found."
+            print(f"Error: {message}", file=sys.stderr)
+            return build_error_metadata(
+                full_arguments, output_file_names, stderr=message
+            )
+        except Exception as e:
+            balancer.release(base_url, 0.0)
+            message = f"Error opening input file {input_file}: {e}"
+            print(message, file=sys.stderr)
+            return build_error_metadata(
+                full_arguments, output_file_names, stderr=message
+            )
+
+        start_time = loop.time()
+        failed = True
+        try:
+            async with http.post(
+                f"{base_url}/run-command",
+                data=_build_form(form_data, input_file_config_path, file_object),
+            ) as response:
+                if response.status in RETRY_STATUS_CODES:
+                    if attempt < args.retries:
+                        raise _RetryableStatus(f"HTTP {response.status}")
+                    if (
+                        response.status in FAILOVER_STATUS_CODES
+                        and balancer.healthy_count() > 1
+                    ):
+                        balancer.eject(base_url, f"HTTP {response.status}")
+                        attempt = 0
+                        continue
+
+                if response.status != 200:
+                    failed = False
+                    text = await response.text()
+                    print(f"Error processing {input_file}: {text}", file=sys.stderr)
+                    return build_error_metadata(
+                        full_arguments,
+                        output_file_names,
+                        stderr=text,
+                        http_code=response.status,
+                        http_message=response.reason,
+                    )
+
+                result, saved_files = await save_multipart_response_async(
+                    response, effective_output_dir, output_prefix
+                )
+                failed = False
+                break
+        except (_RetryableStatus, *_connect_errors()) as e:
+            if attempt < args.retries:
+                attempt += 1
+                await asyncio.sleep(args.retry_backoff * 2 ** (attempt - 1))
+                continue
+            if balancer.healthy_count() > 1:
+                balancer.eject(base_url, str(e) or type(e).__name__)
+                attempt = 0
+                continue
+            message = f"Error processing {input_file}: {e}"
+            print(message, file=sys.stderr)
+            return build_error_metadata(
+                full_arguments, output_file_names, stderr=str(e)
+            )
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            # The request may have reached the tool, do not send it again
+            message = f"Error processing {input_file}: {e}"
+            print(message, file=sys.stderr)
+            return build_error_metadata(
+                full_arguments, output_file_names, stderr=str(e) or type(e).__name__
+            )
+        finally:
+            file_object.close()
+            balancer.release(base_url, loop.time() - start_time, failed=failed)
+
+    if not result:
+        print(
+            f"Error: No metadata found in response for {input_file}",
+            file=sys.stderr,
+        )
+        result = build_error_metadata(
+            full_arguments,
+            output_file_names,
+            http_code=response.status,
+            http_message=response.reason,
+        )
+
+    if cache is not None and cache_key is not None:
+        if is_complete_result(result, saved_files, output_file_names):
+            await loop.run_in_executor(
+                None, cache.store, cache_key, result, saved_files
+            )
+
+    if costs is not None and result.get("status") == "COMPLETED":
+        await loop.run_in_executor(
+            None, record_cost, costs, input_file, args, result, None, features
+        )
+
+    report_result_status(result, input_file)
+
+    return result
+
+
+async def _run_files(
+    input_files: Iterable[str],
+    on_result: Callable[[str, Dict[str, Any]], None],
+    config: Dict[str, Any],
+    args: argparse.Namespace,
+    balancer: EndpointBalancer,
+    tool_name: str,
+    output_dir_base: str,
+    cache: ResultCache | None,
+    window: int,
+    ordered: bool,
+    resumed: ResumedResults,
+    costs: CostStore | None,
+) -> None:
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(args.threads or 1)
+    connector = aiohttp.TCPConnector(limit=args.threads or 1, limit_per_host=0)
+    # Tool runs may take minutes, so only bound the time to connect
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=60)
+
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as http:
+
+        async def limited(input_file: str) -> Dict[str, Any]:
+            result = resumed.get(os.path.abspath(input_file))
+            if result is not None:
+                print(
+                    f"Skipping {input_file}: completed in a previous run",
+                    file=sys.stderr,
+                )
+                return result
+            async with semaphore:
+                return await process_file_async(
+                    input_file,
+                    config,
+                    args,
+                    http,
+                    balancer,
+                    tool_name,
+                    output_dir_base,
+                    cache,
+                    costs,
+                )
+
+        iterator = iter(input_files)
+        pending: Deque[Tuple[str, asyncio.Task]] = deque()
+        exhausted = False
+
+        while True:
+            while not exhausted and len(pending) < window:
+                # Input discovery may block, so pull the next file in an executor
+                input_file = await loop.run_in_executor(None, next, iterator, None)
+                if input_file is None:
+                    exhausted = True
+                    break
+                pending.append((input_file, asyncio.create_task(limited(input_file))))
+
+            if not pending:
+                return
+
+            if ordered:
+                input_file, task = pending.popleft()
+                on_result(input_file, await task)
+                continue
+
+            # Report whichever tasks finished first
+            await asyncio.wait(
+                [task for _, task in pending], return_when=asyncio.FIRST_COMPLETED
+            )
+            for input_file, task in list(pending):
+                if task.done():
+                    pending.remove((input_file, task))
+                    on_result(input_file, task.result())
+
+
+def run_files_async(
+    input_files: Iterable[str],
+    on_result: Callable[[str, Dict[str, Any]], None],
+    config: Dict[str, Any],
+    args: argparse.Namespace,
+    balancer: EndpointBalancer,
+    tool_name: str,
+    output_dir_base: str,
+    cache: ResultCache | None = None,
+    window: int = 1,
+    ordered: bool = True,
+    resumed: ResumedResults | None = None,
+    costs: CostStore | None = None,
+) -> None:
+    """
+    Process input files concurrently on a single event loop.
+
+    Up to --threads requests are in flight at once and at most 'window' inputs
+    are pending. on_result(input_file, result) is called in input order, or in
+    completion order when 'ordered' is False. Inputs found in 'resumed' are
+    reported with their previous result without sending any request.
+    Completed runs are recorded in 'costs', if given.
+    """
+    check_available()
+    asyncio.run(
+        _run_files(
+            input_files,
+            on_result,
+            config,
+            args,
+            balancer,
+            tool_name,
+            output_dir_base,
+            cache,
+            window,
+            ordered,
+            resumed or ResumedResults("", {}),
+            costs,
+        )
+    )
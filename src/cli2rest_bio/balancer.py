@@ -0,0 +1,132 @@
+"""Client-side load balancing across cli2rest API endpoints."""
+
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+import requests
+
+from .concurrency import AdaptiveLimiter
+
+
+class NoHealthyEndpointError(RuntimeError):
+    """Raised when every API endpoint has been ejected."""
+
+
+class EndpointBalancer:
+    """
+    Least-outstanding-requests scheduling across a set of base URLs.
+
+    acquire() picks the healthy endpoint with the fewest requests in flight,
+    breaking ties by the number of requests assigned so far, so idle endpoints
+    are used in turn. Endpoints that fail are ejected and receive no more work.
+    The latency and outcome of every request is passed on to 'limiter', if set.
+    """
+
+    def __init__(self, base_urls: List[str], limiter: AdaptiveLimiter | None = None):
+        if not base_urls:
+            raise ValueError("At least one endpoint is required")
+        self.base_urls = list(base_urls)
+        self.healthy: Dict[str, bool] = {url: True for url in self.base_urls}
+        self.outstanding: Dict[str, int] = {url: 0 for url in self.base_urls}
+        self.assigned: Dict[str, int] = {url: 0 for url in self.base_urls}
+        self.completed: Dict[str, int] = {url: 0 for url in self.base_urls}
+        self.failed: Dict[str, int] = {url: 0 for url in self.base_urls}
+        self.busy_seconds: Dict[str, float] = {url: 0.0 for url in self.base_urls}
+        self.limiter = limiter
+        self._lock = threading.Lock()
+
+    def healthy_count(self) -> int:
+        """Return the number of endpoints that have not been ejected."""
+        with self._lock:
+            return sum(self.healthy.values())
+
+    def acquire(self) -> str:
+        """Reserve and return the least loaded healthy endpoint."""
+        with self._lock:
+            candidates = [url for url in self.base_urls if self.healthy[url]]
+            if not candidates:
+                raise NoHealthyEndpointError("No healthy API endpoints left")
+            base_url = min(
+                candidates,
+                key=lambda url: (self.outstanding[url], self.assigned[url]),
+            )
+            self.outstanding[base_url] += 1
+            self.assigned[base_url] += 1
+            return base_url
+
+    def release(
+        self,
+        base_url: str,
+        elapsed: float,
+        failed: bool = False,
+        overloaded: bool | None = None,
+        size: int = 0,
+    ) -> None:
+        """
+        Mark a request to the endpoint as finished after 'elapsed' seconds.
+
+        'overloaded' tells the limiter that the server shed the request; it
+        defaults to 'failed'. 'size' is the number of input bytes sent.
+        """
+        with self._lock:
+            self.outstanding[base_url] -= 1
+            self.busy_seconds[base_url] += elapsed
+            if failed:
+                self.failed[base_url] += 1
+            else:
+                self.completed[base_url] += 1
+        if self.limiter is not None:
+            self.limiter.record(
+                elapsed, failed if overloaded is None else overloaded, size
+            )
+
+    def eject(self, base_url: str, reason: str) -> None:
+        """Stop sending work to a failing endpoint."""
+        with self._lock:
+            if not self.healthy[base_url]:
+                return
+            self.healthy[base_url] = False
+        print(f"Ejecting endpoint {base_url}: {reason}", file=sys.stderr)
+
+    def probe(self, session: requests.Session, timeout: float = 5.0) -> int:
+        """
+        Check every endpoint's /health route concurrently.
+
+        Endpoints that do not answer with HTTP 200 are ejected. Returns the number
+        of healthy endpoints.
+        """
+
+        def check(base_url: str) -> str | None:
+            try:
+                response = session.get(f"{base_url}/health", timeout=timeout)
+            except requests.RequestException as e:
+                return str(e)
+            if response.status_code != 200:
+                return f"health check returned HTTP {response.status_code}"
+            return None
+
+        with ThreadPoolExecutor(max_workers=len(self.base_urls)) as executor:
+            errors = list(executor.map(check, self.base_urls))
+
+        for base_url, error in zip(self.base_urls, errors):
+            if error is not None:
+                self.eject(base_url, error)
+
+        return self.healthy_count()
+
+    def report(self, wall_seconds: float) -> None:
+        """Print per-endpoint request counts and throughput."""
+        print("Endpoint summary:", file=sys.stderr)
+        for base_url in self.base_urls:
+            completed = self.completed[base_url]
+            throughput = completed / wall_seconds if wall_seconds > 0 else 0.0
+            state = "" if self.healthy[base_url] else " (ejected)"
+            print(
+                f"  {base_url}{state}: {completed} completed, "
+                f"{self.failed[base_url]} failed, "
+                f"{throughput:.2f} requests/s, "
+                f"{self.busy_seconds[base_url]:.1f} s busy",
+                file=sys.stderr,
+            )
@@ -0,0 +1,136 @@
+"""Splitting of batch runs into chunks and merging of their results."""
+
+import json
+import os
+import shutil
+import uuid
+from typing import Any, Callable, Dict, List, Sequence, TypeVar
+
+T = TypeVar("T")
+
+_COPY_CHUNK_SIZE = 1024 * 1024
+
+
+def split_chunks(items: Sequence[T], size: int) -> List[List[T]]:
+    """Split 'items' into consecutive chunks of at most 'size' elements."""
+    return [list(items[i : i + size]) for i in range(0, len(items), size)]
+
+
+def merge_json(merged: Any, value: Any) -> Any:
+    """
+    Merge the JSON 'value' of a later chunk into the result of earlier ones.
+
+    Arrays are concatenated and objects merged key by key, recursively, so
+    per-input results come out in input order whichever chunk finished first.
+    Other values must be equal in every chunk. Raises ValueError otherwise.
+    """
+    if isinstance(merged, list) and isinstance(value, list):
+        return merged + value
+    if isinstance(merged, dict) and isinstance(value, dict):
+        result = dict(merged)
+        for key, item in value.items():
+            result[key] = merge_json(result[key], item) if key in result else item
+        return result
+    if merged == value:
+        return merged
+    raise ValueError(
+        f"cannot merge {type(merged).__name__} with {type(value).__name__}"
+    )
+
+
+def merge_output_files(paths: List[str], output_path: str) -> None:
+    """
+    Merge the chunk outputs at 'paths', in order, into 'output_path'.
+
+    JSON outputs are merged with merge_json() and written with two-space
+    indentation and sorted keys, so their layout does not depend on the number
+    of chunks. Any other outputs are concatenated. The result is written to a
+    temporary file and renamed into place. Raises ValueError for JSON outputs
+    which cannot be merged.
+    """
+    tmp_path = os.path.join(
+        os.path.dirname(output_path) or ".",
+        f".{os.path.basename(output_path)}.{uuid.uuid4().hex[:8]}.tmp",
+    )
+    try:
+        if output_path.endswith(".json"):
+            merged: Any = None
+            for index, path in enumerate(paths):
+                with open(path, "rb") as f:
+                    value = json.load(f)
+                merged = value if index == 0 else merge_json(merged, value)
+            with open(tmp_path, "w") as f:
+                json.dump(merged, f, indent=2, sort_keys=True)
+        else:
+            with open(tmp_path, "wb") as target:
+                for path in paths:
+                    with open(path, "rb") as f:
+                        shutil.copyfileobj(f, target, _COPY_CHUNK_SIZE)
+        os.replace(tmp_path, output_path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def _sum(values: List[Any]) -> Any:
+    numbers = [value for value in values if isinstance(value, (int, float))]
+    return sum(numbers) if numbers else None
+
+
+def _extreme(values: List[Any], function: Callable[[List[Any]], Any]) -> Any:
+    numbers = [value for value in values if isinstance(value, (int, float))]
+    return function(numbers) if numbers else None
+
+
+def merge_chunk_metadata(
+    chunks: List[Dict[str, Any]],
+    chunk_sizes: List[int],
+    command: List[str],
+    missing_files: List[str],
+) -> Dict[str, Any]:
+    """
+    Combine the metadata of every chunk into one record of the whole batch.
+
+    The batch completed only if every chunk did; otherwise it takes the
+    status, HTTP code and exit code of the first chunk which did not.
+    Durations and CPU times are summed over chunks and the peak memory is the
+    largest of them. Each chunk's own metadata, without its output streams,
+    is kept under 'chunks'.
+    """
+    failed = next(
+        (chunk for chunk in chunks if chunk.get("status") != "COMPLETED"), None
+    )
+    first = failed or chunks[0]
+    stats = [chunk.get("execution_stats") or {} for chunk in chunks]
+
+    def joined(key: str) -> str | None:
+        texts = [chunk[key] for chunk in chunks if chunk.get(key)]
+        return "\n".join(texts) if texts else None
+
+    return {
+        "status": first.get("status"),
+        "http_code": first.get("http_code"),
+        "http_message": first.get("http_message"),
+        "exit_code": first.get("exit_code"),
+        "missing_files": missing_files,
+        "execution_stats": {
+            "start_time": _extreme([s.get("start_time") for s in stats], min),
+            "end_time": _extreme([s.get("end_time") for s in stats], max),
+            "duration_seconds": _sum([s.get("duration_seconds") for s in stats]),
+            "max_rss_kb": _extreme([s.get("max_rss_kb") for s in stats], max),
+            "cpu_user_seconds": _sum([s.get("cpu_user_seconds") for s in stats]),
+        },
+        "stdout": joined("stdout"),
+        "stderr": joined("stderr"),
+        "command": command,
+        "chunks": [
+            dict(
+                {k: v for k, v in chunk.items() if k not in ("stdout", "stderr")},
+                input_count=size,
+            )
+            for chunk, size in zip(chunks, chunk_sizes)
+        ],
+    }
@@ -0,0 +1,292 @@
+"""Content-addressed on-disk cache of tool results."""
+
+import contextlib
+import hashlib
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+import uuid
+from typing import Any, BinaryIO, Dict, Iterator, List, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None  # type: ignore[assignment]
+
+HASH_CHUNK_SIZE = 1024 * 1024
+DEFAULT_CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "cli2rest-bio"
+)
+DEFAULT_CACHE_MAX_SIZE = 10 * 1024**3
+# Evict down to this fraction of the maximum size, so stores do not evict each time
+EVICTION_LOW_WATER = 0.9
+# The index log is compacted once it has this many lines more than live entries
+INDEX_COMPACTION_SLACK = 1024
+
+
+def parse_size(value: str) -> int:
+    """Parse a size such as '512M' or '10G' into bytes."""
+    units = {"K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+    value = value.strip().upper().removesuffix("B")
+    multiplier = 1
+    if value and value[-1] in units:
+        multiplier = units[value[-1]]
+        value = value[:-1]
+    return int(float(value) * multiplier)
+
+
+def hash_stream(file_object: BinaryIO) -> str:
+    """Return the SHA-256 hex digest of everything readable from a file object."""
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: file_object.read(HASH_CHUNK_SIZE), b""):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def config_fingerprint(config: Dict[str, Any], image_digest: str) -> str:
+    """Hash the parts of a tool configuration which influence its results."""
+    relevant = {
+        "arguments": config.get("arguments", []),
+        "input_file": config.get("input_file"),
+        "output_files": config.get("output_files", []),
+        "image": image_digest,
+    }
+    return hashlib.sha256(
+        json.dumps(relevant, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+
+@contextlib.contextmanager
+def file_lock(path: str) -> Iterator[None]:
+    """
+    Hold an exclusive lock on 'path', shared by every process using it.
+
+    The lock file itself is never replaced, so it can guard files which are.
+    Where fcntl is unavailable only threads of one process are serialized, by
+    the caller's own lock.
+    """
+    with open(path, "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        yield
+
+
+class ResultCache:
+    """
+    Size-bounded LRU cache of completed results.
+
+    Entries live in '{cache_dir}/objects/{key[:2]}/{key}/' and hold the response
+    metadata plus every output file. An entry's modification time is refreshed
+    on each hit, and the least recently used entries are evicted once the cache
+    grows beyond 'max_size' bytes, down to EVICTION_LOW_WATER of it.
+
+    The size and last use of every entry are kept in an append-only log,
+    '{cache_dir}/index', with one 'key size last-use' line per store or hit
+    and a 'key -' line per eviction. It is replayed into memory on the first
+    store, so neither restoring nor storing results ever scans the entries,
+    and compacted once it is much longer than the number of entries. Appends
+    and compaction hold '{cache_dir}/index.lock', so concurrent runs sharing
+    the cache do not lose each other's lines.
+    """
+
+    def __init__(self, cache_dir: str, max_size: int, fingerprint: str):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.fingerprint = fingerprint
+        self.objects_dir = os.path.join(cache_dir, "objects")
+        self.tmp_dir = os.path.join(cache_dir, "tmp")
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        self.index_path = os.path.join(cache_dir, "index")
+        self.index_lock_path = os.path.join(cache_dir, "index.lock")
+        self._lock = threading.Lock()
+        # Key -> (last use, size in bytes), None until first needed
+        self._entries: Dict[str, Tuple[float, int]] | None = None
+        self._size = 0
+        self._index_lines = 0
+
+    def key(self, input_digest: str) -> str:
+        """Combine an input hash with the configuration fingerprint."""
+        return hashlib.sha256(
+            f"{self.fingerprint}:{input_digest}".encode("utf-8")
+        ).hexdigest()
+
+    def _entry_dir(self, key: str) -> str:
+        return os.path.join(self.objects_dir, key[:2], key)
+
+    def restore(
+        self, key: str, output_dir: str, output_prefix: str
+    ) -> Dict[str, Any] | None:
+        """
+        Copy a cached entry's outputs to '{output_dir}/{output_prefix}{filename}'.
+
+        The outputs are copied to temporary files next to their paths first and
+        renamed into place once all of them are complete, so a failed restore
+        leaves no partial output behind. Returns the cached metadata, or None
+        on a cache miss.
+        """
+        entry_dir = self._entry_dir(key)
+        copied: List[Tuple[str, str]] = []
+        try:
+            with open(os.path.join(entry_dir, "metadata.json"), "r") as f:
+                text = f.read()
+            entry = json.loads(text)
+            for filename in entry["files"]:
+                output_path = os.path.join(output_dir, f"{output_prefix}{filename}")
+                directory = os.path.dirname(output_path)
+                os.makedirs(directory, exist_ok=True)
+                tmp_path = os.path.join(
+                    directory,
+                    f".{os.path.basename(output_path)}.{uuid.uuid4().hex[:8]}.tmp",
+                )
+                copied.append((tmp_path, output_path))
+                shutil.copyfile(os.path.join(entry_dir, "files", filename), tmp_path)
+            for tmp_path, output_path in copied:
+                os.replace(tmp_path, output_path)
+                print(f"Restored cached output to: {output_path}", file=sys.stderr)
+            copied = []
+            os.utime(entry_dir)
+        except (OSError, ValueError, KeyError):
+            return None
+        finally:
+            for tmp_path, _ in copied:
+                try:
+                    os.unlink(tmp_path)
+                except OSError:
+                    pass
+        if isinstance(entry.get("size"), int):
+            # As in store(), the size includes the metadata file
+            self._record(key, entry["size"] + len(text))
+        return entry["metadata"]
+
+    def store(self, key: str, metadata: Dict[str, Any], files: Dict[str, str]) -> None:
+        """Add a result, given its metadata and a map of filename to saved path."""
+        entry_dir = self._entry_dir(key)
+        if os.path.isdir(entry_dir):
+            return
+
+        tmp_entry_dir = os.path.join(self.tmp_dir, uuid.uuid4().hex)
+        try:
+            size = 0
+            for filename, path in files.items():
+                cached_path = os.path.join(tmp_entry_dir, "files", filename)
+                os.makedirs(os.path.dirname(cached_path), exist_ok=True)
+                shutil.copyfile(path, cached_path)
+                size += os.path.getsize(cached_path)
+            os.makedirs(tmp_entry_dir, exist_ok=True)
+            entry = json.dumps(
+                {"metadata": metadata, "files": sorted(files), "size": size},
+                separators=(",", ":"),
+            )
+            size += len(entry)
+            with open(os.path.join(tmp_entry_dir, "metadata.json"), "w") as f:
+                f.write(entry)
+            os.makedirs(os.path.dirname(entry_dir), exist_ok=True)
+            # Publish the entry atomically, another writer may have won the race
+            os.rename(tmp_entry_dir, entry_dir)
+        except OSError as e:
+            if not os.path.isdir(entry_dir):
+                print(f"Warning: Could not write cache entry: {e}", file=sys.stderr)
+            shutil.rmtree(tmp_entry_dir, ignore_errors=True)
+            return
+
+        with self._lock:
+            entries = self._load_index()
+            if key not in entries:
+                self._size += size
+            entries[key] = (time.time(), size)
+            self._append_index([f"{key} {size} {entries[key][0]:.3f}"])
+            over_limit = self._size > self.max_size
+        if over_limit:
+            self.evict()
+
+    def evict(self) -> None:
+        """Remove least recently used entries down to the low-water mark."""
+        with self._lock:
+            entries = self._load_index()
+            target = self.max_size * EVICTION_LOW_WATER
+            victims: List[str] = []
+            for key, (_, size) in sorted(entries.items(), key=lambda item: item[1][0]):
+                if self._size <= target:
+                    break
+                victims.append(key)
+                del entries[key]
+                self._size -= size
+            if victims:
+                self._append_index([f"{key} -" for key in victims])
+        # Remove outside the lock, other threads only need the updated index
+        for key in victims:
+            shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+
+    def _record(self, key: str, size: int) -> None:
+        """Log a hit on an entry, so its last use survives this process."""
+        now = time.time()
+        with self._lock:
+            if self._entries is not None:
+                if key not in self._entries:
+                    self._size += size
+                self._entries[key] = (now, size)
+            self._append_index([f"{key} {size} {now:.3f}"])
+
+    def _append_index(self, lines: List[str]) -> None:
+        """Append lines to the index log; the lock must be held."""
+        try:
+            with file_lock(self.index_lock_path):
+                with open(self.index_path, "a") as f:
+                    f.write("".join(f"{line}\n" for line in lines))
+                self._index_lines += len(lines)
+                if (
+                    self._entries is not None
+                    and self._index_lines
+                    > len(self._entries) * 2 + INDEX_COMPACTION_SLACK
+                ):
+                    self._compact_index()
+        except OSError as e:
+            print(f"Warning: Could not update cache index: {e}", file=sys.stderr)
+
+    def _compact_index(self) -> None:
+        """Rewrite the index log with one line per entry; both locks are held."""
+        # Other runs may have appended since the index was loaded
+        entries = self._read_index()
+        tmp_path = f"{self.index_path}.{uuid.uuid4().hex[:8]}.tmp"
+        with open(tmp_path, "w") as f:
+            for key, (last_use, size) in entries.items():
+                f.write(f"{key} {size} {last_use:.3f}\n")
+        os.replace(tmp_path, self.index_path)
+        self._index_lines = len(entries)
+        self._entries = entries
+        self._size = sum(size for _, size in entries.values())
+
+    def _read_index(self) -> Dict[str, Tuple[float, int]]:
+        """Replay the index log into a map of key to last use and size."""
+        entries: Dict[str, Tuple[float, int]] = {}
+        lines = 0
+        try:
+            with open(self.index_path, "r") as f:
+                for line in f:
+                    lines += 1
+                    fields = line.split()
+                    try:
+                        if len(fields) == 2 and fields[1] == "-":
+                            entries.pop(fields[0], None)
+                        elif len(fields) == 3:
+                            entries[fields[0]] = (float(fields[2]), int(fields[1]))
+                    except ValueError:
+                        # A line cut short by a killed run
+                        continue
+        except FileNotFoundError:
+            pass
+        self._index_lines = lines
+        return entries
+
+    def _load_index(self) -> Dict[str, Tuple[float, int]]:
+        """Read the index on first use; the lock must be held."""
+        if self._entries is not None:
+            return self._entries
+        with file_lock(self.index_lock_path):
+            self._entries = self._read_index()
+        self._size = sum(size for _, size in self._entries.values())
+        return self._entries
@@ -1,24 +1,85 @@
 #!/usr/bin/env python3
 import argparse
+import functools
 import gzip
 import importlib.resources
 from importlib.resources.abc import Traversable
-import json
+import io
 import os
+import shutil
 import sys
+import tempfile
 import time
-from typing import Any, BinaryIO, Dict, List, Tuple, Union
+from typing import (
+    Any,
+    BinaryIO,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Tuple,
+    Union,
+)
 import uuid
 from concurrent.futures import ThreadPoolExecutor
-from email import message_from_bytes
 from pathlib import Path
 
 import docker
 import docker.models
 import docker.models.containers
 import requests
+import requests.adapters
+import urllib3.util.retry
 import yaml
 
+from .balancer import EndpointBalancer, NoHealthyEndpointError
+from .batching import merge_chunk_metadata, merge_output_files, split_chunks
+from .cache import (
+    DEFAULT_CACHE_DIR,
+    DEFAULT_CACHE_MAX_SIZE,
+    ResultCache,
+    config_fingerprint,
+    hash_stream,
+    parse_size,
+)
+from .compression import GZIP_SUFFIX, WireCompression, compress_upload
+from .concurrency import DEFAULT_MAX_CONCURRENCY, AdaptiveLimiter
+from .costmodel import DEFAULT_COST_DIR, CostStore, input_features, open_cost_store
+from .inputs import input_size, iter_input_files, prefetch
+from .metadata import (
+    DEFAULT_FSYNC_BATCH,
+    MetadataSink,
+    NdjsonMetadataSink,
+    ResumedResults,
+    scan_metadata_records,
+    write_metadata_file,
+)
+from .multipart import (
+    DEFAULT_CHUNK_SIZE,
+    MMAP_MIN_SIZE,
+    MappedFile,
+    MultipartBody,
+    parse_multipart_stream,
+)
+from .readahead import (
+    DEFAULT_READ_AHEAD,
+    DEFAULT_READ_AHEAD_MEMORY,
+    ReadAhead,
+    ReadAheadExecutor,
+)
+from .scheduler import run_scheduled, run_windowed
+from .writer import DEFAULT_OUTPUT_WRITERS, OutputBatch, OutputWriter
+
+
+RETRY_STATUS_CODES = (500, 502, 503, 504)
+DEFAULT_STARTUP_TIMEOUT = 120.0
+READINESS_INITIAL_INTERVAL = 0.005
+READINESS_MAX_INTERVAL = 0.5
+DEFAULT_IMAGE_LOCK = os.path.join(DEFAULT_CACHE_DIR, "images.lock")
+# Responses indicating that the endpoint itself, not the job, is unavailable
+FAILOVER_STATUS_CODES = (502, 503, 504)
+
 
 def positive_float(value: str) -> float:
     """Parse a positive floating-point value."""
@@ -28,6 +89,30 @@ def positive_float(value: str) -> float:
     return parsed_value
 
 
+def positive_int(value: str) -> int:
+    """Parse a positive integer value."""
+    parsed_value = int(value)
+    if parsed_value <= 0:
+        raise argparse.ArgumentTypeError("Value must be greater than 0")
+    return parsed_value
+
+
+def non_negative_int(value: str) -> int:
+    """Parse a non-negative integer value."""
+    parsed_value = int(value)
+    if parsed_value < 0:
+        raise argparse.ArgumentTypeError("Value must not be negative")
+    return parsed_value
+
+
+def non_negative_float(value: str) -> float:
+    """Parse a non-negative floating-point value."""
+    parsed_value = float(value)
+    if parsed_value < 0:
+        raise argparse.ArgumentTypeError("Value must not be negative")
+    return parsed_value
+
+
 def load_tool_config(config_path: str):
     """
     Load the YAML configuration.
@@ -110,8 +195,34 @@ def parse_arguments():
     parser.add_argument(
         "--threads",
         type=int,
-        default=os.cpu_count(),
-        help="Number of parallel threads to use",
+        help="Fixed number of parallel threads to use. Default: with the threads engine running a single tool, adapt the number of requests in flight to the server's latency per input byte and overload responses, up to --max-threads; otherwise the number of CPUs",
+    )
+
+    parser.add_argument(
+        "--max-threads",
+        type=positive_int,
+        default=DEFAULT_MAX_CONCURRENCY,
+        help=f"Upper bound of the number of requests in flight when --threads is not given. Default: {DEFAULT_MAX_CONCURRENCY}",
+    )
+
+    parser.add_argument(
+        "--tasks-per-thread",
+        type=positive_int,
+        default=2,
+        help="Maximum number of submitted but unfinished inputs per thread. Bounds client memory regardless of the number of inputs. Default: 2",
+    )
+
+    parser.add_argument(
+        "--batch-size",
+        type=positive_int,
+        help="Split the inputs of a batch configuration (input_files: true) into chunks of this many files, sent concurrently on --threads threads. The outputs of all chunks are merged in input order: JSON outputs by concatenating arrays and merging objects, others by concatenation. Default: all inputs in a single request",
+    )
+
+    parser.add_argument(
+        "--engine",
+        choices=["threads", "asyncio"],
+        default="threads",
+        help="Dispatch engine for standard mode. 'threads' runs one thread per request; 'asyncio' multiplexes all requests on one event loop and requires aiohttp. --threads sets the number of requests in flight for both. Default: threads",
     )
 
     parser.add_argument(
@@ -130,7 +241,82 @@ def parse_arguments():
     parser.add_argument(
         "--api-url",
         type=str,
-        help="REST API URL endpoint (e.g., http://localhost:8000). If provided, no Docker container will be created.",
+        action="append",
+        help="REST API URL endpoint (e.g., http://localhost:8000). If provided, no Docker container will be created. May be repeated or given as a comma-separated list to spread requests across several servers.",
+    )
+
+    parser.add_argument(
+        "--api-url-file",
+        type=str,
+        help="File listing REST API URL endpoints, one per line. Blank lines and lines starting with '#' are ignored.",
+    )
+
+    parser.add_argument(
+        "--containers",
+        type=positive_int,
+        default=1,
+        help="Number of Docker container replicas to start. Requests are sent to the replica with the fewest requests in flight. Default: 1",
+    )
+
+    parser.add_argument(
+        "--startup-timeout",
+        type=positive_float,
+        default=DEFAULT_STARTUP_TIMEOUT,
+        help=f"Seconds to wait for a started container to become ready before giving up. Default: {DEFAULT_STARTUP_TIMEOUT:g}",
+    )
+
+    parser.add_argument(
+        "--image-lock",
+        type=str,
+        default=DEFAULT_IMAGE_LOCK,
+        help=f"Lockfile written by 'cli2rest-bio prefetch'. Images listed there are run by their pinned digest, without registry lookups. Default: {DEFAULT_IMAGE_LOCK}",
+    )
+
+    parser.add_argument(
+        "--no-pool",
+        action="store_true",
+        help="Start dedicated containers even if a container pool ('cli2rest-bio pool start') is running",
+    )
+
+    parser.add_argument(
+        "--wire-compression",
+        choices=["auto", "gzip", "off"],
+        default="off",
+        help="Send inputs and receive outputs gzipped. The tool command is wrapped in a shell script decompressing the input and compressing the outputs in the container, which needs 'sh' and 'gzip' in the image; if they are missing, requests are sent uncompressed. Already gzipped inputs are uploaded as they are. 'auto' compresses only for --api-url endpoints. Threads engine, standard mode only. Default: off",
+    )
+
+    parser.add_argument(
+        "--read-ahead",
+        type=non_negative_int,
+        default=DEFAULT_READ_AHEAD,
+        help=f"Number of upcoming inputs prepared on a separate thread pool while earlier ones are uploaded: gzipped inputs are decompressed into memory and plain files are read into the page cache. 0 disables it. Threads engine, standard mode only. Default: {DEFAULT_READ_AHEAD}",
+    )
+
+    parser.add_argument(
+        "--read-ahead-memory",
+        type=parse_size,
+        default=DEFAULT_READ_AHEAD_MEMORY,
+        help="Maximum total uncompressed size of the inputs held by --read-ahead, e.g. '256M'. Larger inputs are decompressed by the upload worker itself. Default: 512M",
+    )
+
+    parser.add_argument(
+        "--micro-batch",
+        type=positive_int,
+        default=1,
+        help="Send up to this many consecutive small inputs (up to 1 MiB uncompressed) in one request. A shell script in the container runs the tool once per input in a subdirectory of its own, and outputs and metadata are split per input again. The image needs 'sh'; if it is missing, inputs are sent one by one. Threads engine, standard mode only. Default: 1 (off)",
+    )
+
+    parser.add_argument(
+        "--output-writers",
+        type=non_negative_int,
+        default=DEFAULT_OUTPUT_WRITERS,
+        help=f"Number of threads writing outputs to disk. A request thread only receives the response into memory, or a local temporary file for outputs over 4 MiB, and these threads create, write and rename the output files. 0 writes outputs directly on the request thread. Threads engine, standard mode only. Default: {DEFAULT_OUTPUT_WRITERS}",
+    )
+
+    parser.add_argument(
+        "--no-mmap",
+        action="store_true",
+        help="Read plain input files into memory for upload instead of sending them from a memory map. Use it when inputs may be truncated while they are uploaded, which would crash a mapped upload",
     )
 
     parser.add_argument(
@@ -139,28 +325,239 @@ def parse_arguments():
         help="Disable automatic ungzipping of .gz input files (enabled by default)",
     )
 
+    parser.add_argument(
+        "--cache-dir",
+        type=str,
+        default=DEFAULT_CACHE_DIR,
+        help=f"Directory of the local result cache, keyed by input content, tool configuration and Docker image. Default: {DEFAULT_CACHE_DIR}",
+    )
+
+    parser.add_argument(
+        "--cache-max-size",
+        type=parse_size,
+        default=DEFAULT_CACHE_MAX_SIZE,
+        help="Maximum size of the result cache (e.g. 500M, 10G); least recently used results are evicted first. Default: 10G",
+    )
+
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Disable the local result cache",
+    )
+
+    parser.add_argument(
+        "--cache-remote",
+        action="store_true",
+        help="Also cache results of --api-url endpoints whose docker_image is not pinned by digest. Their results are keyed on the image name, so they go stale when the server's image changes",
+    )
+
+    parser.add_argument(
+        "--cost-dir",
+        type=str,
+        default=DEFAULT_COST_DIR,
+        help=f"Directory where the execution_stats of completed runs are recorded per tool, to learn the runtime and memory use of inputs (see 'cli2rest-bio estimate'). Default: {DEFAULT_COST_DIR}",
+    )
+
+    parser.add_argument(
+        "--no-cost-model",
+        action="store_true",
+        help="Do not record execution_stats for the cost model",
+    )
+
+    parser.add_argument(
+        "--input-dir",
+        type=str,
+        action="append",
+        help="Directory to search recursively for input files. May be repeated.",
+    )
+
+    parser.add_argument(
+        "--include",
+        type=str,
+        action="append",
+        help="Glob pattern of files to take from --input-dir (e.g. '*.cif.gz'), matched against the file name and the path relative to the directory. May be repeated.",
+    )
+
+    parser.add_argument(
+        "--exclude",
+        type=str,
+        action="append",
+        help="Glob pattern of files to skip in --input-dir. May be repeated.",
+    )
+
+    parser.add_argument(
+        "--input-list",
+        type=str,
+        help="File listing input files, one per line, or '-' to read the list from stdin",
+    )
+
     parser.add_argument(
         "--output-metadata",
         type=str,
         help="Path to save the response metadata JSON (minified). Single-file and batch runs write one JSON object; standard multi-file runs write an array ordered by input file.",
     )
 
+    parser.add_argument(
+        "--retries",
+        type=non_negative_int,
+        default=3,
+        help="Number of retries for API requests failing with connection errors or HTTP 5xx responses. Default: 3",
+    )
+
+    parser.add_argument(
+        "--retry-backoff",
+        type=non_negative_float,
+        default=0.5,
+        help="Backoff factor in seconds between retries (doubled after each attempt). Default: 0.5",
+    )
+
+    parser.add_argument(
+        "--metadata-format",
+        choices=["json", "ndjson"],
+        default="json",
+        help="Format of --output-metadata in standard mode. 'json' writes one object or array, replacing the file only once the run completes, so an interrupted run keeps the previous file for --resume; 'ndjson' appends one line per input as soon as it finishes, so partial runs keep their results. Default: json",
+    )
+
+    parser.add_argument(
+        "--metadata-fsync-batch",
+        type=positive_int,
+        default=DEFAULT_FSYNC_BATCH,
+        help=f"With --metadata-format ndjson, fsync the metadata file every N records. Default: {DEFAULT_FSYNC_BATCH}",
+    )
+
+    parser.add_argument(
+        "--unordered",
+        action="store_true",
+        help="Write metadata in completion order instead of input order, so one slow input does not hold finished results in memory",
+    )
+
+    parser.add_argument(
+        "--schedule",
+        choices=["input", "largest-first", "shortest-first"],
+        default="input",
+        help="Order in which inputs are submitted. 'largest-first' starts the most expensive inputs first, so a few large structures do not form a long tail; 'shortest-first' does the opposite. Inputs are ranked by the duration the tool's cost model (see --cost-dir) predicts from their size, or by their uncompressed size while it has too few recorded runs. Both list all inputs before the first request. Metadata keeps input order unless --unordered. Threads engine only. Default: input",
+    )
+
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Skip inputs recorded as COMPLETED in the existing --output-metadata file whose output files are all present, and process only failed, timed out or missing ones. An NDJSON journal is appended to.",
+    )
+
     parser.add_argument(
         "--timeout",
         type=positive_float,
         help="Optional command timeout in seconds sent to the API. In standard multi-file mode it applies per input file; in batch mode it applies to the single batch command.",
     )
 
+    parser.add_argument(
+        "--timeout-per-kb",
+        type=non_negative_float,
+        default=0.0,
+        help="Seconds added to --timeout per KiB of (uncompressed) input, so large inputs get more time than small ones. Standard mode only",
+    )
+
+    parser.add_argument(
+        "--timeout-per-atom",
+        type=non_negative_float,
+        default=0.0,
+        help="Seconds added to --timeout per ATOM/HETATM record of the input. Standard mode only",
+    )
+
+    parser.add_argument(
+        "--timeout-percentile",
+        type=float,
+        help="Derive each input's timeout from the tool's recorded runs (see --cost-dir): the duration that this percentage of runs, scaled to the input, stayed under. --timeout, plus any per-KiB or per-atom allowance, is the minimum. Standard mode only",
+    )
+
+    parser.add_argument(
+        "--timeout-margin",
+        type=positive_float,
+        default=2.0,
+        help="Factor applied to the duration bound of --timeout-percentile. Default: 2",
+    )
+
+    parser.add_argument(
+        "--config",
+        type=str,
+        action="append",
+        help="Tool configuration to run. May be repeated to run several tools against the same inputs, each input being read once and sent to all tools concurrently. With several tools, --api-url takes the form TOOL=URL[,URL...] and may be repeated; tools without one run in containers, and --api-url-file is not supported. When given, all positional arguments are input files.",
+    )
+
     # Add config file and input files as positional arguments
     parser.add_argument(
         "config_and_input_files",
-        nargs="+",
-        help="Config file path followed by input file(s) to process",
+        nargs="*",
+        help="Config file path (unless --config is used) followed by input file(s) to process. Input files may also come from --input-dir and --input-list.",
     )
 
     return parser.parse_args()
 
 
+def create_session(
+    pool_size: int, retries: int = 0, backoff: float = 0.0, hosts: int = 1
+) -> requests.Session:
+    """
+    Create a requests session with a keep-alive connection pool.
+
+    The pool holds up to 'pool_size' connections for each of 'hosts' endpoints,
+    so one session can be shared by all worker threads. Connection errors and
+    HTTP 5xx responses are retried 'retries' times with exponential backoff.
+    Read errors are not: the request reached the server, which may already be
+    running a long tool on it.
+    """
+    retry = urllib3.util.retry.Retry(
+        total=retries,
+        connect=retries,
+        read=0,
+        other=0,
+        status=retries,
+        backoff_factor=backoff,
+        status_forcelist=RETRY_STATUS_CODES,
+        allowed_methods=None,  # Retry POST too, on the errors above only
+        raise_on_status=False,
+    )
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=max(hosts, 1),
+        pool_maxsize=pool_size,
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def read_api_urls(api_urls: List[str] | None, api_url_file: str | None) -> List[str]:
+    """Collect API endpoints from --api-url values and an optional endpoint file."""
+    values: List[str] = []
+    for value in api_urls or []:
+        values.extend(value.split(","))
+
+    if api_url_file:
+        try:
+            with open(api_url_file, "r") as f:
+                values.extend(
+                    line for line in f if not line.strip().startswith("#")
+                )
+        except IOError as e:
+            print(f"Error reading API endpoint file: {e}", file=sys.stderr)
+            sys.exit(1)
+
+    base_urls: List[str] = []
+    for value in values:
+        # Remove whitespace and trailing slash if present
+        base_url = value.strip().rstrip("/")
+        if base_url and base_url not in base_urls:
+            base_urls.append(base_url)
+
+    if not base_urls:
+        print("Error: No API endpoints provided", file=sys.stderr)
+        sys.exit(1)
+
+    return base_urls
+
+
 def build_error_metadata(
     command: List[str],
     output_file_names: List[str],
@@ -189,69 +586,216 @@ def build_error_metadata(
 
 
 def write_metadata_output(output_path: str, metadata: Any) -> None:
-    """Write response metadata JSON to disk."""
+    """Write response metadata JSON to disk atomically."""
     try:
-        with open(output_path, "w") as f:
-            json.dump(metadata, f, separators=(",", ":"))
+        write_metadata_file(output_path, metadata)
     except IOError as e:
         print(f"Error writing metadata file: {e}", file=sys.stderr)
 
 
-def start_docker_container(
-    docker_image: str,
-) -> Tuple[docker.models.containers.Container, str]:
-    """Start a Docker container with the specified image and return the container ID and port."""
-    # Generate a unique container name using UUID
-    container_name = (
-        f"{docker_image.split('/')[-1].split(':')[0]}-{uuid.uuid4().hex[:8]}"
+def output_opener(
+    output_dir: str,
+    output_prefix: str,
+    saved_paths: Dict[str, str],
+    batch: OutputBatch | None = None,
+) -> Callable[[str], BinaryIO | None]:
+    """
+    Return a callback opening '{output_dir}/{output_prefix}{filename}' for writing.
+
+    Each successfully opened path is recorded in 'saved_paths' under its filename.
+    With 'batch', outputs are received by it and only written once it is
+    committed.
+    """
+
+    def open_output(filename: str) -> BinaryIO | None:
+        prefixed_output_path = os.path.join(output_dir, f"{output_prefix}{filename}")
+        try:
+            if batch is not None:
+                handle = batch.open(filename, prefixed_output_path)
+            else:
+                os.makedirs(os.path.dirname(prefixed_output_path), exist_ok=True)
+                handle = open(prefixed_output_path, "wb")
+        except IOError as e:
+            print(
+                f"Error writing output file {prefixed_output_path}: {e}",
+                file=sys.stderr,
+            )
+            return None
+        saved_paths[filename] = prefixed_output_path
+        return handle  # type: ignore[return-value]
+
+    return open_output
+
+
+def save_multipart_response(
+    response: requests.Response,
+    output_dir: str,
+    output_prefix: str,
+    wrap_opener: Callable[[Callable[[str], Any]], Callable[[str], Any]] | None = None,
+    batch: OutputBatch | None = None,
+) -> Tuple[Dict[str, Any], Dict[str, str]]:
+    """
+    Stream a multipart response to disk.
+
+    Returns the parsed metadata and a map from each received filename to the
+    path it was saved to.
+    Every part with a filename is written in chunks to
+    '{output_dir}/{output_prefix}{filename}', so memory use is bounded by the
+    chunk size rather than by the size of the outputs. 'wrap_opener' may
+    replace the function opening each output, e.g. to decode it. With 'batch',
+    the outputs are only collected, to be committed to disk by the caller, and
+    the returned paths are those they will be written to.
+    """
+
+    saved_paths: Dict[str, str] = {}
+    open_output: Callable[[str], Any] = output_opener(
+        output_dir, output_prefix, saved_paths, batch
     )
+    if wrap_opener is not None:
+        open_output = wrap_opener(open_output)
+    try:
+        parser = parse_multipart_stream(
+            response.iter_content(chunk_size=DEFAULT_CHUNK_SIZE),
+            response.headers.get("Content-Type"),
+            open_output,
+        )
+    except (requests.RequestException, IOError, ValueError) as e:
+        if batch is not None:
+            batch.discard()
+        print(f"Error reading multipart response: {e}", file=sys.stderr)
+        return {}, {}
+    finally:
+        response.close()
 
-    print(f"Starting container with image: {docker_image}...", file=sys.stderr)
+    if batch is None:
+        for path in saved_paths.values():
+            print(f"Saved output to: {path}", file=sys.stderr)
 
-    # Initialize Docker client
-    client = docker.from_env()
+    return parser.metadata, saved_paths
 
-    # Pull the image if needed
+
+def pull_docker_image(client: docker.DockerClient, docker_image: str) -> None:
+    """Pull the Docker image unless it is already available locally."""
     try:
         client.images.get(docker_image)
     except Exception:
         print(f"Pulling image {docker_image}...", file=sys.stderr)
         client.images.pull(docker_image)
 
+
+class ContainerStartError(RuntimeError):
+    """Raised when a container exits or does not become ready in time."""
+
+
+def container_log_tail(
+    container: docker.models.containers.Container, lines: int = 20
+) -> str:
+    """Return the last lines of a container's logs, for error messages."""
+    try:
+        return container.logs(tail=lines).decode("utf-8", errors="replace").strip()
+    except Exception:
+        return ""
+
+
+def wait_until_ready(
+    container: docker.models.containers.Container,
+    port: str,
+    startup_timeout: float = DEFAULT_STARTUP_TIMEOUT,
+) -> float:
+    """
+    Poll the container's /health route until it answers, returning the time taken.
+
+    Polling starts a few milliseconds apart and backs off exponentially up to
+    READINESS_MAX_INTERVAL. Between attempts the container state is checked, so a
+    container that exits fails immediately instead of being polled forever.
+    ContainerStartError is raised, with the end of the container logs, on exit
+    or once 'startup_timeout' seconds have passed.
+    """
+    start_time = time.monotonic()
+    deadline = start_time + startup_timeout
+    interval = READINESS_INITIAL_INTERVAL
+
+    # Reuse a single keep-alive connection for polling, without retries
+    with create_session(pool_size=1) as health_session:
+        while True:
+            try:
+                response = health_session.get(
+                    f"http://localhost:{port}/health",
+                    timeout=max(min(1.0, deadline - time.monotonic()), 0.001),
+                )
+                if response.status_code == 200:
+                    return time.monotonic() - start_time
+            except requests.RequestException:
+                pass
+
+            container.reload()
+            if container.status in ("exited", "dead"):
+                exit_code = container.attrs.get("State", {}).get("ExitCode")
+                raise ContainerStartError(
+                    f"Container exited with code {exit_code} before it was ready:\n"
+                    f"{container_log_tail(container)}"
+                )
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise ContainerStartError(
+                    f"Container was not ready after {startup_timeout:g} seconds:\n"
+                    f"{container_log_tail(container)}"
+                )
+
+            time.sleep(min(interval, remaining))
+            interval = min(interval * 2, READINESS_MAX_INTERVAL)
+
+
+def start_docker_container(
+    docker_image: str,
+    labels: Dict[str, str] | None = None,
+    startup_timeout: float = DEFAULT_STARTUP_TIMEOUT,
+) -> Tuple[docker.models.containers.Container, str, float]:
+    """
+    Start a Docker container with the specified image.
+
+    Returns the container, its host port and the seconds it took to become
+    ready. A container that fails to start is removed before the error is raised.
+    """
+    # Generate a unique container name using UUID, without any tag or digest
+    image_name = docker_image.split("/")[-1].split("@")[0].split(":")[0]
+    container_name = f"{image_name}-{uuid.uuid4().hex[:8]}"
+
+    print(f"Starting container with image: {docker_image}...", file=sys.stderr)
+
+    # Initialize Docker client
+    client = docker.from_env()
+
+    # Pull the image if needed
+    pull_docker_image(client, docker_image)
+
     # Start the container with a random port
     container: docker.models.containers.Container = client.containers.run(
         docker_image,
         name=container_name,
         detach=True,
         ports={"8000/tcp": None},  # Assign a random port
+        labels=labels or {},
     )
 
-    # Get the port that Docker assigned
-    container_id = str(container.id)
-    container_info = client.containers.get(container_id)
-    port = container_info.ports["8000/tcp"][0]["HostPort"]
-
-    print(f"Container running on port: {port}", file=sys.stderr)
+    try:
+        # Get the port that Docker assigned
+        container_id = str(container.id)
+        container_info = client.containers.get(container_id)
+        port = container_info.ports["8000/tcp"][0]["HostPort"]
 
-    # Wait for the container to be ready
-    print("Waiting for service to be ready...", file=sys.stderr, end="")
-    sys.stderr.flush()
+        print(f"Container running on port: {port}", file=sys.stderr)
+        print("Waiting for service to be ready...", file=sys.stderr)
 
-    while True:
-        try:
-            response = requests.get(f"http://localhost:{port}/health", timeout=1)
-            if response.status_code == 200:
-                break
-        except requests.RequestException:
-            pass
+        ready_seconds = wait_until_ready(container, port, startup_timeout)
+    except BaseException:
+        stop_docker_container(container)
+        raise
 
-        print(".", file=sys.stderr, end="")
-        sys.stderr.flush()
-        time.sleep(1)
+    print(f"Service on port {port} ready in {ready_seconds:.3f} s", file=sys.stderr)
 
-    print(" Ready!", file=sys.stderr)
-
-    return container, port
+    return container, port, ready_seconds
 
 
 def stop_docker_container(container: docker.models.containers.Container):
@@ -263,24 +807,502 @@ def stop_docker_container(container: docker.models.containers.Container):
     container.remove()
 
 
+def upload_size(file_object: Any) -> int:
+    """Return the number of bytes an uploaded file object holds, if known."""
+    if isinstance(file_object, MappedFile):
+        return file_object.size
+    if isinstance(file_object, (bytes, bytearray)):
+        return len(file_object)
+    if isinstance(file_object, io.BytesIO):
+        return file_object.getbuffer().nbytes
+    if isinstance(file_object, tempfile.SpooledTemporaryFile):
+        # fileno() would move an in-memory spool to disk
+        position = file_object.tell()
+        size = file_object.seek(0, io.SEEK_END)
+        file_object.seek(position)
+        return size
+    try:
+        return os.fstat(file_object.fileno()).st_size
+    except (AttributeError, OSError, ValueError):
+        return 0
+
+
+def post_run_command(
+    session: requests.Session,
+    balancer: EndpointBalancer,
+    form_data: Dict[str, Any],
+    files: Any,
+) -> requests.Response:
+    """
+    Send a /run-command request to the least loaded healthy endpoint.
+
+    If the endpoint cannot be reached or reports that it is unavailable, it is
+    ejected and the request is sent again to another endpoint, rewinding the
+    uploaded file objects first. The last error is raised, or the last response
+    returned, once no other endpoint is left.
+    """
+    file_items = list(files.items() if isinstance(files, dict) else files)
+    file_objects = [file_object for _, (_, file_object) in file_items]
+    size = sum(upload_size(file_object) for file_object in file_objects)
+
+    # Memory-mapped inputs are streamed from the mapping by our own encoder,
+    # instead of being read into the body requests would build in memory
+    request_kwargs: Dict[str, Any] = {"data": form_data, "files": files}
+    if any(isinstance(file_object, MappedFile) for file_object in file_objects):
+        body = MultipartBody(
+            form_data,
+            [
+                (
+                    name,
+                    filename,
+                    (
+                        file_object
+                        if isinstance(file_object, MappedFile)
+                        else file_object.read()
+                    ),
+                )
+                for name, (filename, file_object) in file_items
+            ],
+        )
+        request_kwargs = {
+            "data": body,
+            "headers": {"Content-Type": body.content_type},
+        }
+
+    while True:
+        base_url = balancer.acquire()
+        for file_object in file_objects:
+            file_object.seek(0)
+
+        start_time = time.monotonic()
+        try:
+            response = session.post(
+                f"{base_url}/run-command",
+                stream=True,
+                **request_kwargs,
+            )
+        except requests.RequestException as e:
+            balancer.release(
+                base_url, time.monotonic() - start_time, failed=True, size=size
+            )
+            if balancer.healthy_count() <= 1:
+                raise
+            balancer.eject(base_url, str(e))
+            continue
+
+        failed = response.status_code in FAILOVER_STATUS_CODES
+        balancer.release(
+            base_url,
+            time.monotonic() - start_time,
+            failed=failed,
+            overloaded=failed or response.status_code == 429,
+            size=size,
+        )
+        if failed and balancer.healthy_count() > 1:
+            balancer.eject(base_url, f"HTTP {response.status_code}")
+            response.close()
+            continue
+
+        return response
+
+
+def start_docker_containers(
+    docker_image: str,
+    count: int,
+    labels: Dict[str, str] | None = None,
+    startup_timeout: float = DEFAULT_STARTUP_TIMEOUT,
+) -> List[Tuple[docker.models.containers.Container, str, float]]:
+    """
+    Start 'count' replicas of the Docker image in parallel.
+
+    Containers are started and health-checked concurrently. If any replica fails
+    to start, the ones already running are stopped before the error is raised.
+    """
+    # Pull once up front instead of racing one pull per replica
+    pull_docker_image(docker.from_env(), docker_image)
+
+    with ThreadPoolExecutor(max_workers=count) as executor:
+        futures = [
+            executor.submit(
+                start_docker_container, docker_image, labels, startup_timeout
+            )
+            for _ in range(count)
+        ]
+        started: List[Tuple[docker.models.containers.Container, str, float]] = []
+        error: Exception | None = None
+        for future in futures:
+            try:
+                started.append(future.result())
+            except Exception as e:
+                error = error or e
+
+    if error is not None:
+        stop_docker_containers([container for container, _, _ in started])
+        raise error
+
+    return started
+
+
+def stop_docker_containers(containers: List[docker.models.containers.Container]):
+    """Stop and remove several Docker containers in parallel."""
+    if not containers:
+        return
+    with ThreadPoolExecutor(max_workers=len(containers)) as executor:
+        list(executor.map(stop_docker_container, containers))
+
+
+class ToolContainers:
+    """Containers serving one tool, started for this run or leased from the pool."""
+
+    def __init__(
+        self,
+        containers: List[docker.models.containers.Container],
+        base_urls: List[str],
+        startup_seconds: float,
+        pool_lease: Any = None,
+    ):
+        self.containers = containers
+        self.base_urls = base_urls
+        self.startup_seconds = startup_seconds
+        self.pool_lease = pool_lease
+
+    @property
+    def image_id(self) -> str | None:
+        """Return the ID of the image the containers run, if known."""
+        if self.containers:
+            return str(self.containers[0].image.id)
+        if self.pool_lease is not None:
+            return self.pool_lease.image_id
+        return None
+
+    def release(self) -> None:
+        """Stop the containers we started, or hand pooled ones back."""
+        if self.pool_lease is not None:
+            # Pooled containers are kept running for the next invocation
+            self.pool_lease.release()
+        elif len(self.containers) == 1:
+            stop_docker_container(self.containers[0])
+        else:
+            stop_docker_containers(self.containers)
+
+
+def start_tool_containers(docker_image: str, args: argparse.Namespace) -> ToolContainers:
+    """
+    Provide --containers ready containers of an image.
+
+    Images pinned in --image-lock are run by digest. Warm containers are leased
+    from a running pool manager unless --no-pool is given, otherwise new ones
+    are started. ContainerStartError is raised if they do not become ready.
+    """
+    from .images import pinned_image
+    from .pool import attach as attach_pool
+
+    docker_image = pinned_image(docker_image, args.image_lock)
+
+    if not args.no_pool and (
+        pool_lease := attach_pool(docker_image, args.containers, args.startup_timeout)
+    ):
+        # Reuse warm containers kept by the pool manager
+        return ToolContainers(
+            [], pool_lease.base_urls, pool_lease.startup_seconds, pool_lease
+        )
+
+    if args.containers > 1:
+        # Start several replicas and spread the work across them
+        started = start_docker_containers(
+            docker_image, args.containers, startup_timeout=args.startup_timeout
+        )
+    else:
+        started = [
+            start_docker_container(docker_image, startup_timeout=args.startup_timeout)
+        ]
+    return ToolContainers(
+        [container for container, _, _ in started],
+        [f"http://localhost:{port}" for _, port, _ in started],
+        max(ready for _, _, ready in started),
+    )
+
+
+def open_result_cache(
+    config: Dict[str, Any],
+    args: argparse.Namespace,
+    image_digest: str,
+    remote: bool = False,
+) -> ResultCache | None:
+    """
+    Open the result cache for a tool configuration, or return None if disabled.
+
+    For a 'remote' server, 'image_digest' is only the configured image name.
+    Unless it is pinned by digest, the server may run another version of the
+    image at any time, so caching is only done with --cache-remote.
+    """
+    if args.no_cache:
+        return None
+    if remote and "@" not in image_digest and not args.cache_remote:
+        print(
+            f"Result cache is off for {config.get('name', image_digest)} on remote "
+            "endpoints, pin its image by digest or pass --cache-remote",
+            file=sys.stderr,
+        )
+        return None
+    try:
+        return ResultCache(
+            args.cache_dir,
+            args.cache_max_size,
+            config_fingerprint(config, image_digest),
+        )
+    except OSError as e:
+        print(f"Warning: Result cache disabled: {e}", file=sys.stderr)
+        return None
+
+
+def output_location(
+    input_file: str,
+    args: argparse.Namespace,
+    tool_name: str,
+    output_dir_base: str,
+    input_base: str | None = None,
+) -> Tuple[str, str]:
+    """
+    Return the output directory and the formatted output prefix for an input.
+
+    'input_base' overrides the name derived from the input file, e.g. for
+    intermediate files of a pipeline.
+    """
+    if input_base is None:
+        input_base = os.path.splitext(os.path.basename(input_file))[0]
+    effective_output_dir = output_dir_base or os.path.dirname(
+        os.path.abspath(input_file)
+    )
+    output_prefix = args.output_prefix_format.format(
+        tool_name=tool_name, input_base=input_base
+    )
+    return effective_output_dir, output_prefix
+
+
+def open_input_file(
+    input_file: str, args: argparse.Namespace
+) -> Union[BinaryIO, gzip.GzipFile]:
+    """Open an input file for upload, ungzipping .gz files unless disabled."""
+    if not args.no_auto_ungzip and input_file.endswith(".gz"):
+        print(f"Streaming ungzipped {input_file}...", file=sys.stderr)
+        return gzip.open(input_file, "rb")
+    return open(input_file, "rb")
+
+
+def read_input_features(
+    input_file: str, args: argparse.Namespace, input_data: bytes | None = None
+) -> Dict[str, int]:
+    """Measure the size, atoms and residues of an input as it is uploaded."""
+    if input_data is not None:
+        return input_features(io.BytesIO(input_data))
+    if not args.no_auto_ungzip and input_file.endswith(".gz"):
+        with gzip.open(input_file, "rb") as f:
+            return input_features(f)  # type: ignore[arg-type]
+    with open(input_file, "rb") as f:
+        return input_features(f)
+
+
+def record_cost(
+    costs: CostStore,
+    input_file: str,
+    args: argparse.Namespace,
+    result: Dict[str, Any],
+    input_data: bytes | None = None,
+    features: Dict[str, int] | None = None,
+) -> None:
+    """
+    Add a completed run to its tool's cost model, without failing the input.
+
+    Atoms and residues are only recorded when the input was already measured,
+    e.g. for a per-atom timeout; otherwise its size is taken from 'input_data'
+    or the file system, so recording never reads the input again.
+    """
+    try:
+        if features is None:
+            size = len(input_data) if input_data is not None else None
+            features = {"size": input_size(input_file) if size is None else size}
+        costs.record(features, result.get("execution_stats") or {})
+    except (OSError, EOFError) as e:
+        print(
+            f"Warning: Could not record execution stats of {input_file}: {e}",
+            file=sys.stderr,
+        )
+
+
+def uses_input_timeout(args: argparse.Namespace) -> bool:
+    """Check whether the timeout depends on each input rather than only --timeout."""
+    return bool(
+        args.timeout_per_kb
+        or args.timeout_per_atom
+        or args.timeout_percentile is not None
+    )
+
+
+def input_timeout(
+    features: Dict[str, int],
+    args: argparse.Namespace,
+    costs: CostStore | None = None,
+) -> float | None:
+    """
+    Return the command timeout for an input under the configured policy.
+
+    --timeout-per-kb and --timeout-per-atom are added to --timeout. With
+    --timeout-percentile, the bound learned from recorded runs of the tool,
+    times --timeout-margin, is used whenever it is longer.
+    """
+    timeout = args.timeout
+    if args.timeout_per_kb or args.timeout_per_atom:
+        timeout = round(
+            (timeout or 0.0)
+            + args.timeout_per_kb * features["size"] / 1024
+            + args.timeout_per_atom * features["atoms"],
+            3,
+        )
+
+    model = costs.model() if costs is not None else None
+    if args.timeout_percentile is not None and model is not None:
+        bound = model.duration_bound(features, args.timeout_percentile)
+        if bound is not None:
+            timeout = max(timeout or 0.0, round(args.timeout_margin * bound, 3))
+    return timeout
+
+
+def build_form_data(
+    full_arguments: List[str],
+    output_file_names: List[str],
+    args: argparse.Namespace,
+    timeout: float | None = None,
+) -> Dict[str, Any]:
+    """
+    Build the non-file form fields of a /run-command request.
+
+    'timeout' overrides --timeout, e.g. with a timeout computed for one input.
+    """
+    form_data: Dict[str, Any] = {
+        "arguments": tuple(full_arguments),  # Send arguments as a tuple/list
+        "output_files": tuple(
+            output_file_names
+        ),  # Send output file names as tuple/list
+    }
+    if timeout is None:
+        timeout = args.timeout
+    if timeout is not None:
+        form_data["timeout"] = str(timeout)
+    return form_data
+
+
+def is_complete_result(
+    result: Dict[str, Any],
+    saved_files: Dict[str, str],
+    output_file_names: List[str],
+) -> bool:
+    """Check that a run completed and every output it produced was saved."""
+    return result.get("status") == "COMPLETED" and set(saved_files) == set(
+        output_file_names
+    ) - set(result.get("missing_files") or [])
+
+
+def report_result_status(result: Dict[str, Any], input_file: str) -> None:
+    """Print a message for results which did not complete."""
+    if result.get("status") == "TIMEOUT":
+        print(f"API timed out for {input_file}", file=sys.stderr)
+    elif result.get("status") != "COMPLETED":
+        print(
+            f"API returned status {result.get('status')} for {input_file}",
+            file=sys.stderr,
+        )
+
+
+def with_startup_time(
+    result: Dict[str, Any], startup_seconds: float | None
+) -> Dict[str, Any]:
+    """Add the time the run's containers took to become ready to a result."""
+    if startup_seconds is None:
+        return result
+    return {**result, "container_startup_seconds": round(startup_seconds, 3)}
+
+
+def find_resumable_results(
+    metadata_path: str,
+    config: Dict[str, Any],
+    args: argparse.Namespace,
+    tool_name: str,
+    output_dir_base: str,
+) -> ResumedResults:
+    """
+    Collect results of a previous run which do not need to be recomputed.
+
+    An input is resumable when its latest record has status COMPLETED and every
+    output file it produced still exists in the output directory. The file is
+    scanned record by record and only the location of resumable records is
+    kept, keyed by the normalized absolute path of the input file.
+    """
+    output_file_names = config.get("output_files", [])
+    locations: Dict[str, Tuple[int, int] | None] = {}
+    try:
+        for offset, length, record in scan_metadata_records(metadata_path):
+            input_file = record.get("input_file")
+            if not isinstance(input_file, str):
+                continue
+            input_file = os.path.abspath(input_file)
+            locations[input_file] = None
+            if record.get("status") != "COMPLETED":
+                continue
+            effective_output_dir, output_prefix = output_location(
+                input_file, args, tool_name, output_dir_base
+            )
+            produced = set(output_file_names) - set(record.get("missing_files") or [])
+            if all(
+                os.path.isfile(
+                    os.path.join(effective_output_dir, f"{output_prefix}{filename}")
+                )
+                for filename in produced
+            ):
+                locations[input_file] = (offset, length)
+    except FileNotFoundError:
+        return ResumedResults(metadata_path, {})
+    except IOError as e:
+        print(f"Error reading metadata file: {e}", file=sys.stderr)
+        return ResumedResults(metadata_path, {})
+
+    return ResumedResults(
+        metadata_path,
+        {
+            input_file: location
+            for input_file, location in locations.items()
+            if location is not None
+        },
+    )
+
+
 def process_file(
     input_file: str,
     config: Dict[str, Any],
     args: argparse.Namespace,
-    base_url: str,
+    session: requests.Session,
+    balancer: EndpointBalancer,
     tool_name: str,
     output_dir_base: str,
+    cache: ResultCache | None = None,
+    input_base: str | None = None,
+    input_data: bytes | None = None,
+    costs: CostStore | None = None,
+    compression: WireCompression | None = None,
+    output_batch: OutputBatch | None = None,
 ) -> Dict[str, Any]:
-    """Process a single input file using the specified tool configuration."""
-    # Get file information
-    input_base = os.path.splitext(os.path.basename(input_file))[0]
-    effective_output_dir = output_dir_base or os.path.dirname(
-        os.path.abspath(input_file)
-    )
-
-    # Format the output prefix
-    output_prefix = args.output_prefix_format.format(
-        tool_name=tool_name, input_base=input_base
+    """
+    Process a single input file using the specified tool configuration.
+
+    When 'input_data' is given, it is uploaded instead of reading the file
+    again, so several tools can share one read of the same input. Completed
+    runs are recorded in 'costs', if given. With 'compression', the input and
+    outputs travel gzipped. With 'output_batch', the outputs are committed to
+    it once the response is parsed and written in the background; wait on the
+    batch before relying on them.
+    """
+    effective_output_dir, output_prefix = output_location(
+        input_file, args, tool_name, output_dir_base, input_base
     )
 
     print(f"Processing file: {input_file}", file=sys.stderr)
@@ -302,13 +1324,11 @@ def process_file(
     input_file_config_path = config.get("input_file")
     if input_file_config_path:
         try:
-            file_object: Union[BinaryIO, gzip.GzipFile]
-            # Check if we need to ungzip the file
-            if not args.no_auto_ungzip and input_file.endswith(".gz"):
-                print(f"Streaming ungzipped {input_file}...", file=sys.stderr)
-                file_object = gzip.open(input_file, "rb")
-            else:
-                file_object = open(input_file, "rb")
+            file_object = (
+                io.BytesIO(input_data)
+                if input_data is not None
+                else open_input_file(input_file, args)
+            )
 
             # Use the field name expected by the FastAPI server ("input_files")
             # and pass the configured filename within the tuple.
@@ -330,25 +1350,100 @@ def process_file(
         print(f"Error: {message}", file=sys.stderr)
         return build_error_metadata(full_arguments, output_file_names, stderr=message)
 
+    # Restore the outputs without any HTTP call if this input was seen before
+    cache_key = None
+    if cache is not None:
+        try:
+            cache_key = cache.key(hash_stream(file_object))
+            file_object.seek(0)
+        except Exception as e:
+            file_object.close()
+            message = f"Error reading input file {input_file}: {e}"
+            print(message, file=sys.stderr)
+            return build_error_metadata(
+                full_arguments, output_file_names, stderr=message
+            )
+
+        cached_result = cache.restore(cache_key, effective_output_dir, output_prefix)
+        if cached_result is not None:
+            file_object.close()
+            print(f"Using cached result for {input_file}", file=sys.stderr)
+            return cached_result
+
+    # Scale the timeout to this input if requested
+    features = None
+    timeout = args.timeout
+    if uses_input_timeout(args):
+        try:
+            features = read_input_features(input_file, args, input_data)
+            timeout = input_timeout(features, args, costs)
+        except (OSError, EOFError) as e:
+            print(
+                f"Warning: Using --timeout for {input_file}, could not measure it: {e}",
+                file=sys.stderr,
+            )
+
+    # Gzip the upload and wrap the command to decompress it in the container
+    wire_arguments, wire_output_names = full_arguments, output_file_names
+    wrap_opener = None
+    compressed = compression is not None and compression.enabled
+    if compressed:
+        try:
+            if (
+                input_data is None
+                and input_file.endswith(GZIP_SUFFIX)
+                and not args.no_auto_ungzip
+            ):
+                # Already compressed, upload the file as it is
+                upload: BinaryIO = open(input_file, "rb")
+            else:
+                upload = compress_upload(file_object)
+        except Exception as e:
+            message = f"Error reading input file {input_file}: {e}"
+            print(message, file=sys.stderr)
+            return build_error_metadata(
+                full_arguments, output_file_names, stderr=message
+            )
+        finally:
+            file_object.close()
+        files_to_upload["input_files"] = (
+            input_file_config_path + GZIP_SUFFIX,
+            upload,
+        )
+        wire_arguments = compression.wrap_arguments(
+            full_arguments, input_file_config_path, output_file_names
+        )
+        wire_output_names = compression.wire_output_names(output_file_names)
+        wrap_opener = functools.partial(
+            compression.output_opener, output_names=output_file_names
+        )
+    elif (
+        not args.no_mmap
+        and isinstance(file_object, io.BufferedReader)
+        and os.fstat(file_object.fileno()).st_size >= MMAP_MIN_SIZE
+    ):
+        # Upload large plain files straight from a memory map
+        try:
+            files_to_upload["input_files"] = (
+                input_file_config_path,
+                MappedFile(file_object),  # type: ignore[arg-type]
+            )
+        except (OSError, ValueError) as e:
+            print(f"Warning: Could not map {input_file}: {e}", file=sys.stderr)
+
     # Prepare form data
-    form_data = {
-        "arguments": tuple(full_arguments),  # Send arguments as a tuple/list
-        "output_files": tuple(
-            output_file_names
-        ),  # Send output file names as tuple/list
-    }
-    if args.timeout is not None:
-        form_data["timeout"] = str(args.timeout)
+    form_data = build_form_data(wire_arguments, wire_output_names, args, timeout)
 
     # Send the request to the API endpoint using multipart/form-data
     try:
         try:
-            response = requests.post(
-                f"{base_url}/run-command",
-                data=form_data,
-                files=files_to_upload,
+            response = post_run_command(
+                session,
+                balancer,
+                form_data,
+                files_to_upload,
             )
-        except requests.RequestException as e:
+        except (requests.RequestException, NoHealthyEndpointError) as e:
             message = f"Error processing {input_file}: {e}"
             print(message, file=sys.stderr)
             return build_error_metadata(
@@ -374,45 +1469,33 @@ def process_file(
         print(f"Error processing {input_file}: {response.text}", file=sys.stderr)
         return error_metadata
 
-    # Parse the multipart response
-    raw_message = (
-        f"Content-Type: {response.headers.get('Content-Type')}\r\n\r\n".encode()
-        + response.content
+    # Parse the multipart response, streaming output files to disk
+    result, saved_files = save_multipart_response(
+        response, effective_output_dir, output_prefix, wrap_opener, output_batch
     )
-    msg = message_from_bytes(raw_message)
 
-    result: Dict[str, Any] = {}
-    for part in msg.walk():
-        if part.get_content_maintype() == "multipart":
-            continue
-        disposition = part.get("Content-Disposition", "")
-
-        if 'name="metadata"' in disposition:
-            payload = part.get_payload(decode=True)
-            if isinstance(payload, bytes):
-                result = json.loads(payload.decode("utf-8"))
-        elif "filename=" in disposition:
-            filename = part.get_filename()
-            payload = part.get_payload(decode=True)
-            if not isinstance(payload, bytes):
-                continue
-            content_bytes = payload
-
-            # Create the file path with the formatted prefix
-            prefixed_output_path = os.path.join(
-                effective_output_dir, f"{output_prefix}{filename}"
+    if compressed:
+        if compression.is_unsupported(result):
+            if output_batch is not None:
+                output_batch.discard()
+            return process_file(
+                input_file,
+                config,
+                args,
+                session,
+                balancer,
+                tool_name,
+                output_dir_base,
+                cache,
+                input_base,
+                input_data,
+                costs,
+                compression,
+                output_batch,
             )
-            os.makedirs(os.path.dirname(prefixed_output_path), exist_ok=True)
-
-            try:
-                with open(prefixed_output_path, "wb") as f:
-                    f.write(content_bytes)
-                print(f"Saved output to: {prefixed_output_path}", file=sys.stderr)
-            except IOError as e:
-                print(
-                    f"Error writing output file {prefixed_output_path}: {e}",
-                    file=sys.stderr,
-                )
+        result = compression.restore_metadata(
+            result, full_arguments, output_file_names
+        )
 
     if not result:
         print(
@@ -421,30 +1504,360 @@ def process_file(
         )
         result = error_metadata
 
-    if result.get("status") == "TIMEOUT":
-        print(f"API timed out for {input_file}", file=sys.stderr)
-    elif result.get("status") != "COMPLETED":
+    def store_result(saved_files: Dict[str, str]) -> None:
+        if (
+            cache is not None
+            and cache_key is not None
+            and is_complete_result(result, saved_files, output_file_names)
+        ):
+            cache.store(cache_key, result, saved_files)
+
+    if output_batch is None:
+        store_result(saved_files)
+    else:
+        output_batch.commit(store_result)
+
+    if costs is not None and result.get("status") == "COMPLETED":
+        record_cost(costs, input_file, args, result, input_data, features)
+
+    report_result_status(result, input_file)
+
+    return result
+
+
+def input_cost(stores: Iterable[CostStore | None]) -> Callable[[str], float]:
+    """
+    Return the cost by which --schedule orders inputs.
+
+    It is the total duration the cost models of the given tools predict from
+    the input's size, or the uncompressed size itself when none of them has
+    a model yet.
+    """
+    models = [
+        model
+        for store in stores
+        if store is not None
+        and (model := store.model()) is not None
+        and "duration_seconds" in model.fits
+    ]
+    if not models:
+        return input_size
+
+    def predicted_duration(path: str) -> float:
+        features = {"size": input_size(path)}
+        return sum(
+            model.predict(features).get("duration_seconds", 0.0) for model in models
+        )
+
+    return predicted_duration
+
+
+def run_inputs(
+    executor: ThreadPoolExecutor,
+    func: Callable[[Any], Any],
+    input_files: Iterable[Any],
+    args: argparse.Namespace,
+    cost: Callable[[Any], float] = input_size,
+) -> Iterator[Tuple[Any, Any]]:
+    """
+    Run func for every input file on the executor, in the order chosen by --schedule.
+
+    The items may also be groups of input files, given a 'cost' measuring them.
+    """
+    window = (args.threads or 1) * args.tasks_per_thread
+    if args.schedule == "input":
+        return run_windowed(
+            executor, func, input_files, window, ordered=not args.unordered
+        )
+    return run_scheduled(
+        executor,
+        func,
+        input_files,
+        cost,
+        window,
+        ordered=not args.unordered,
+        largest_first=args.schedule == "largest-first",
+    )
+
+
+def run_files_threaded(
+    input_files: Iterable[str],
+    on_result: Callable[[str, Dict[str, Any]], None],
+    process_new: Callable[..., Dict[str, Any]],
+    args: argparse.Namespace,
+    resumed: ResumedResults,
+    costs: CostStore | None = None,
+    limiter: AdaptiveLimiter | None = None,
+    read_ahead: ReadAhead | None = None,
+    writer: OutputWriter | None = None,
+    micro: Any = None,
+    process_micro: Callable[..., List[Dict[str, Any]]] | None = None,
+) -> None:
+    """
+    Process input files on --threads worker threads.
+
+    process_new(input_file, input_data=..., output_batch=...) processes one
+    input. on_result(input_file, result) is called in the order chosen by
+    run_inputs(), once the input's outputs are on disk. Inputs found in
+    'resumed' are reported with their previous result without sending any
+    request. 'limiter' bounds the requests in flight, 'read_ahead' prepares
+    upcoming inputs, 'writer' publishes outputs in the background, and with
+    'micro' (a MicroBatching) small inputs are sent together by
+    process_micro(). The read-ahead and writer pools are shut down at the end.
+    """
+    if micro is not None:
+        groups: Iterable[Tuple[str, ...]] = micro.group(input_files)
+    else:
+        groups = ((input_file,) for input_file in input_files)
+    schedule_cost = input_cost([costs])
+
+    def process_group(
+        group: Tuple[str, ...],
+    ) -> List[Tuple[Dict[str, Any], OutputBatch | None]]:
+        outcomes: List[Tuple[Dict[str, Any], OutputBatch | None]] = []
+        new: List[int] = []
+        for input_file in group:
+            result = resumed.get(os.path.abspath(input_file))
+            if result is None:
+                new.append(len(outcomes))
+            else:
+                if read_ahead is not None:
+                    read_ahead.release(input_file)
+                print(
+                    f"Skipping {input_file}: completed in a previous run",
+                    file=sys.stderr,
+                )
+            outcomes.append((result, None))  # type: ignore[arg-type]
+
+        input_data = [
+            read_ahead.take(group[i]) if read_ahead is not None else None
+            for i in new
+        ]
+        batches = [writer.batch() if writer is not None else None for _ in new]
+
+        def process_single(position: int) -> Dict[str, Any]:
+            return process_new(
+                group[new[position]],
+                input_data=input_data[position],
+                output_batch=batches[position],
+            )
+
+        def process_new_inputs() -> List[Dict[str, Any]]:
+            if (
+                process_micro is not None
+                and micro is not None
+                and micro.enabled
+                and len(new) > 1
+            ):
+                return process_micro(
+                    [group[i] for i in new],
+                    process_single=process_single,
+                    input_data=input_data,
+                    output_batches=batches,
+                )
+            return [process_single(p) for p in range(len(new))]
+
+        try:
+            if limiter is None:
+                results = process_new_inputs()
+            else:
+                with limiter:
+                    results = process_new_inputs()
+        finally:
+            if read_ahead is not None:
+                for i in new:
+                    read_ahead.release(group[i])
+        for i, result, batch in zip(new, results, batches):
+            outcomes[i] = (result, batch)
+        return outcomes
+
+    with ThreadPoolExecutor(max_workers=args.threads) as executor:
+        try:
+            for group, outcomes in run_inputs(
+                (
+                    ReadAheadExecutor(executor, read_ahead)
+                    if read_ahead is not None
+                    else executor
+                ),
+                process_group,
+                groups,
+                args,
+                cost=lambda group: sum(map(schedule_cost, group)),
+            ):
+                for input_file, (result, batch) in zip(group, outcomes):
+                    # Record an input only once its outputs are on disk
+                    if batch is not None:
+                        batch.wait()
+                    on_result(input_file, result)
+        finally:
+            if read_ahead is not None:
+                read_ahead.shutdown()
+            if writer is not None:
+                writer.shutdown()
+
+
+def run_standard(
+    input_files: Iterable[str],
+    config: Dict[str, Any],
+    args: argparse.Namespace,
+    session: requests.Session,
+    balancer: EndpointBalancer,
+    tool_name: str,
+    startup_seconds: float | None,
+    cache: ResultCache | None = None,
+    costs: CostStore | None = None,
+    compression: WireCompression | None = None,
+    limiter: AdaptiveLimiter | None = None,
+) -> int:
+    """
+    Process input files one request each and return the exit code.
+
+    A bounded window of inputs is in flight, on the engine chosen by --engine,
+    and their metadata is written to --output-metadata as results come in.
+    With --resume, inputs completed by a previous run are skipped.
+    """
+    resumed = ResumedResults(args.output_metadata, {})
+    if args.resume:
+        resumed = find_resumable_results(
+            args.output_metadata, config, args, tool_name, args.output_dir
+        )
         print(
-            f"API returned status {result.get('status')} for {input_file}",
+            f"Resuming: {len(resumed)} input(s) already completed",
             file=sys.stderr,
         )
 
-    return result
+    # A resumed NDJSON journal is appended to and already holds the
+    # records of skipped inputs; a JSON file is rewritten in full
+    append_journal = args.resume and args.metadata_format == "ndjson"
+    metadata_sink = (
+        NdjsonMetadataSink(
+            args.output_metadata,
+            args.metadata_fsync_batch,
+            append=append_journal,
+        )
+        if args.metadata_format == "ndjson"
+        else MetadataSink(args.output_metadata)
+    )
+
+    def record_result(input_file: str, result: Dict[str, Any]) -> None:
+        is_resumed = os.path.abspath(input_file) in resumed
+        if not is_resumed:
+            result = with_startup_time(result, startup_seconds)
+        metadata_sink.add(
+            input_file, result, write=not (is_resumed and append_journal)
+        )
+
+    try:
+        if args.engine == "asyncio":
+            from .async_engine import run_files_async
+
+            if args.schedule != "input":
+                print(
+                    "Warning: --schedule is ignored by the asyncio engine",
+                    file=sys.stderr,
+                )
+
+            run_files_async(
+                input_files,
+                record_result,
+                config,
+                args,
+                balancer,
+                tool_name,
+                args.output_dir,
+                cache,
+                (args.threads or 1) * args.tasks_per_thread,
+                not args.unordered,
+                resumed,
+                costs,
+            )
+        else:
+            process_new = functools.partial(
+                process_file,
+                config=config,
+                args=args,
+                session=session,
+                balancer=balancer,
+                tool_name=tool_name,
+                output_dir_base=args.output_dir,
+                cache=cache,
+                costs=costs,
+                compression=compression,
+            )
+
+            # Small inputs may share a request, larger ones go alone
+            micro = None
+            process_micro = None
+            if args.micro_batch > 1:
+                from .microbatch import MicroBatching, process_micro_batch
+
+                micro = MicroBatching(args.micro_batch)
+                process_micro = functools.partial(
+                    process_micro_batch,
+                    config=config,
+                    args=args,
+                    session=session,
+                    balancer=balancer,
+                    tool_name=tool_name,
+                    output_dir_base=args.output_dir,
+                    micro=micro,
+                    cache=cache,
+                    costs=costs,
+                )
+
+            run_files_threaded(
+                input_files,
+                record_result,
+                process_new,
+                args,
+                resumed,
+                costs,
+                limiter=limiter,
+                # Gzipped inputs are passed through as they are when compressing
+                read_ahead=(
+                    ReadAhead(
+                        args.read_ahead,
+                        args.read_ahead_memory,
+                        min(args.read_ahead, os.cpu_count() or 1),
+                        decompress=compression is None and not args.no_auto_ungzip,
+                    )
+                    if args.read_ahead
+                    else None
+                ),
+                writer=(
+                    OutputWriter(args.output_writers) if args.output_writers else None
+                ),
+                micro=micro,
+                process_micro=process_micro,
+            )
+    except BaseException:
+        # Interrupted, e.g. by Ctrl-C: do not leave a temporary file behind
+        metadata_sink.abort()
+        raise
+    metadata_sink.close()
+
+    if metadata_sink.count == 0:
+        print("Error: No input files found", file=sys.stderr)
+        return 1
+    return 1 if metadata_sink.failed else 0
 
 
 def process_files_batch(
     input_files: List[str],
     config: Dict[str, Any],
     args: argparse.Namespace,
-    base_url: str,
+    session: requests.Session,
+    balancer: EndpointBalancer,
     tool_name: str,
     output_dir_base: str,
+    output_prefix: str | None = None,
 ) -> Dict[str, Any]:
     """Process multiple input files in a single API call (batch mode)."""
     effective_output_dir = output_dir_base or os.getcwd()
 
     # Use tool name only as prefix for batch mode
-    output_prefix = f"{tool_name}-"
+    if output_prefix is None:
+        output_prefix = f"{tool_name}-"
 
     print(f"Processing {len(input_files)} file(s) in batch mode", file=sys.stderr)
 
@@ -492,22 +1905,18 @@ def process_files_batch(
             )
 
     # Prepare form data
-    form_data = {
-        "arguments": tuple(full_arguments),
-        "output_files": tuple(output_file_names),
-    }
-    if args.timeout is not None:
-        form_data["timeout"] = str(args.timeout)
+    form_data = build_form_data(full_arguments, output_file_names, args)
 
     # Send the request
     try:
         try:
-            response = requests.post(
-                f"{base_url}/run-command",
-                data=form_data,
-                files=files_to_upload,
+            response = post_run_command(
+                session,
+                balancer,
+                form_data,
+                files_to_upload,
             )
-        except requests.RequestException as e:
+        except (requests.RequestException, NoHealthyEndpointError) as e:
             message = f"Error processing batch: {e}"
             print(message, file=sys.stderr)
             return build_error_metadata(
@@ -532,44 +1941,10 @@ def process_files_batch(
         print(f"Error processing batch: {response.text}", file=sys.stderr)
         return error_metadata
 
-    # Parse the multipart response
-    raw_message = (
-        f"Content-Type: {response.headers.get('Content-Type')}\r\n\r\n".encode()
-        + response.content
+    # Parse the multipart response, streaming output files to disk
+    result, _ = save_multipart_response(
+        response, effective_output_dir, output_prefix
     )
-    msg = message_from_bytes(raw_message)
-
-    result: Dict[str, Any] = {}
-    for part in msg.walk():
-        if part.get_content_maintype() == "multipart":
-            continue
-        disposition = part.get("Content-Disposition", "")
-
-        if 'name="metadata"' in disposition:
-            payload = part.get_payload(decode=True)
-            if isinstance(payload, bytes):
-                result = json.loads(payload.decode("utf-8"))
-        elif "filename=" in disposition:
-            filename = part.get_filename()
-            payload = part.get_payload(decode=True)
-            if not isinstance(payload, bytes):
-                continue
-            content_bytes = payload
-
-            prefixed_output_path = os.path.join(
-                effective_output_dir, f"{output_prefix}{filename}"
-            )
-            os.makedirs(os.path.dirname(prefixed_output_path), exist_ok=True)
-
-            try:
-                with open(prefixed_output_path, "wb") as f:
-                    f.write(content_bytes)
-                print(f"Saved output to: {prefixed_output_path}", file=sys.stderr)
-            except IOError as e:
-                print(
-                    f"Error writing output file {prefixed_output_path}: {e}",
-                    file=sys.stderr,
-                )
 
     if not result:
         print(
@@ -589,113 +1964,361 @@ def process_files_batch(
     return result
 
 
+def process_files_chunked(
+    input_files: List[str],
+    config: Dict[str, Any],
+    args: argparse.Namespace,
+    session: requests.Session,
+    balancer: EndpointBalancer,
+    tool_name: str,
+    output_dir_base: str,
+) -> Dict[str, Any]:
+    """
+    Process input files in batch mode, at most --batch-size files per API call.
+
+    Chunks are sent concurrently on --threads threads and their outputs saved
+    to a temporary directory. They are then merged, in input order, into the
+    '{tool_name}-{filename}' outputs a single batch would have produced, and
+    their metadata into one record.
+    """
+    effective_output_dir = output_dir_base or os.getcwd()
+    output_file_names = config.get("output_files", [])
+    chunks = split_chunks(input_files, args.batch_size)
+    if len(chunks) <= 1:
+        return process_files_batch(
+            input_files, config, args, session, balancer, tool_name, output_dir_base
+        )
+
+    print(
+        f"Processing {len(input_files)} file(s) in {len(chunks)} chunk(s) "
+        f"of up to {args.batch_size}",
+        file=sys.stderr,
+    )
+
+    os.makedirs(effective_output_dir, exist_ok=True)
+    chunk_dir = tempfile.mkdtemp(
+        prefix=f".{tool_name}-chunks-", dir=effective_output_dir
+    )
+
+    def process_chunk(index: int) -> Dict[str, Any]:
+        return process_files_batch(
+            chunks[index],
+            config,
+            args,
+            session,
+            balancer,
+            tool_name,
+            chunk_dir,
+            output_prefix=f"{index:06d}-",
+        )
+
+    with ThreadPoolExecutor(max_workers=args.threads) as executor:
+        results = list(executor.map(process_chunk, range(len(chunks))))
+
+    missing_files: List[str] = []
+    keep_chunks = False
+    for filename in output_file_names:
+        chunk_paths = [
+            os.path.join(chunk_dir, f"{index:06d}-{filename}")
+            for index in range(len(chunks))
+        ]
+        saved_paths = [path for path in chunk_paths if os.path.isfile(path)]
+        if len(saved_paths) < len(chunk_paths):
+            missing_files.append(filename)
+        if not saved_paths:
+            continue
+
+        output_path = os.path.join(effective_output_dir, f"{tool_name}-{filename}")
+        try:
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            merge_output_files(saved_paths, output_path)
+        except (OSError, ValueError) as e:
+            print(
+                f"Error merging {filename}, chunk outputs are kept in {chunk_dir}: {e}",
+                file=sys.stderr,
+            )
+            keep_chunks = True
+            if filename not in missing_files:
+                missing_files.append(filename)
+            continue
+        print(f"Saved merged output to: {output_path}", file=sys.stderr)
+
+    if not keep_chunks:
+        shutil.rmtree(chunk_dir, ignore_errors=True)
+
+    result = merge_chunk_metadata(
+        results,
+        [len(chunk) for chunk in chunks],
+        config.get("arguments", []),
+        missing_files,
+    )
+    if result.get("status") != "COMPLETED":
+        print(
+            f"API returned status {result.get('status')} for a chunk of the batch",
+            file=sys.stderr,
+        )
+    return result
+
+
 def main():
+    if sys.argv[1:2] == ["pool"]:
+        from .pool import pool_main
+
+        pool_main(sys.argv[2:])
+        return
+    if sys.argv[1:2] == ["prefetch"]:
+        from .images import prefetch_main
+
+        prefetch_main(sys.argv[2:])
+        return
+    if sys.argv[1:2] == ["estimate"]:
+        from .estimate import estimate_main
+
+        estimate_main(sys.argv[2:])
+        return
+
     # Parse command line arguments
     args = parse_arguments()
 
-    # Ensure we have at least a config file and one input file
-    if len(args.config_and_input_files) < 2:
+    # Config files come from --config, otherwise from the first positional argument
+    if args.config:
+        config_paths = args.config
+        input_args = args.config_and_input_files
+    else:
+        config_paths = args.config_and_input_files[:1]
+        input_args = args.config_and_input_files[1:]
+
+    # Ensure we have at least a config file and one source of input files
+    if not config_paths or not (input_args or args.input_dir or args.input_list):
         print(
-            "Error: You must provide a config file path and at least one input file",
+            "Error: You must provide a config file path and at least one input file, --input-dir or --input-list",
             file=sys.stderr,
         )
         sys.exit(1)
 
-    # First argument is the config file path
-    config_path = args.config_and_input_files[0]
-
-    # Load the tool configuration
-    config = load_tool_config(config_path)
+    # Load the tool configurations
+    configs = [load_tool_config(config_path) for config_path in config_paths]
+    config = configs[0]
 
     # Get the tool name from the config
     tool_name = config["name"]
 
-    print(f"Using tool: {tool_name}", file=sys.stderr)
+    for loaded_config in configs:
+        print(f"Using tool: {loaded_config['name']}", file=sys.stderr)
     # The load_tool_config function now prints where it loaded from
 
-    # Get the input files (all arguments after the first one)
-    input_files: List[str] = []
-    for input_file in args.config_and_input_files[1:]:
+    # Get the input files (all positional arguments after the config)
+    for input_file in input_args:
         # Check if the file exists
         if not os.path.isfile(input_file):
             print(f"Error: Input file '{input_file}' not found", file=sys.stderr)
             sys.exit(1)
-        input_files.append(input_file)
+    for input_dir in args.input_dir or []:
+        if not os.path.isdir(input_dir):
+            print(f"Error: Input directory '{input_dir}' not found", file=sys.stderr)
+            sys.exit(1)
+    if args.input_list and args.input_list != "-":
+        if not os.path.isfile(args.input_list):
+            print(f"Error: Input list '{args.input_list}' not found", file=sys.stderr)
+            sys.exit(1)
+
+    if args.timeout_percentile is not None and not 0 < args.timeout_percentile <= 100:
+        print("Error: --timeout-percentile must be in (0, 100]", file=sys.stderr)
+        sys.exit(1)
+    if uses_input_timeout(args) and config.get("input_files"):
+        print(
+            "Warning: Per-input timeouts are ignored in batch mode, using --timeout",
+            file=sys.stderr,
+        )
+
+    if args.resume and not args.output_metadata:
+        print("Error: --resume requires --output-metadata", file=sys.stderr)
+        sys.exit(1)
+    if args.resume and config.get("input_files"):
+        print("Warning: --resume is ignored in batch mode", file=sys.stderr)
+
+    # Unless --threads fixes it, let the server's latency and overload responses
+    # decide how many requests to keep in flight
+    limiter: AdaptiveLimiter | None = None
+    if (
+        args.threads is None
+        and args.engine == "threads"
+        and len(configs) == 1
+        and not config.get("stages")
+        and not config.get("input_files")
+    ):
+        limiter = AdaptiveLimiter(args.max_threads)
+        args.threads = args.max_threads
+    if args.threads is None:
+        args.threads = os.cpu_count() or 1
+
+    # Directories and input lists are enumerated lazily in a background thread,
+    # so the first requests are sent while discovery is still running
+    discovered_files = prefetch(
+        iter_input_files(
+            input_args,
+            args.input_dir,
+            args.include,
+            args.exclude,
+            args.input_list,
+        )
+    )
 
-    # Determine if we're using an external API or starting a Docker container
-    container = None
-    base_url: str = args.api_url
+    # Determine if we're using an external API or starting Docker containers
+    base_urls: List[str] = []
+    tool_containers: ToolContainers | None = None
 
     # Create output directory if specified and it doesn't exist
     if args.output_dir:
         os.makedirs(args.output_dir, exist_ok=True)
         print(f"Output directory set to: {args.output_dir}", file=sys.stderr)
 
-    if base_url:
-        # Using external API
-        print(f"Using external API at: {base_url}", file=sys.stderr)
-        # Remove trailing slash if present
-        base_url = base_url.rstrip("/")
-        port = None  # Not needed when using external API
+    if len(configs) > 1 or config.get("stages"):
+        from .pipeline import run_fanout, run_pipeline
+
+        if len(configs) > 1:
+            exit_code = run_fanout(configs, discovered_files, args)
+        else:
+            exit_code = run_pipeline(config, discovered_files, args)
+        print("Done!", file=sys.stderr)
+        sys.exit(exit_code)
+
+    if args.api_url or args.api_url_file:
+        # Using external API(s)
+        for base_url in read_api_urls(args.api_url, args.api_url_file):
+            print(f"Using external API at: {base_url}", file=sys.stderr)
+            base_urls.append(base_url)
+        if args.containers > 1:
+            print(
+                "Warning: --containers is ignored when --api-url is provided",
+                file=sys.stderr,
+            )
     else:
-        # Start the Docker container
-        container, port = start_docker_container(config["docker_image"])
-        base_url = f"http://localhost:{port}"
+        try:
+            tool_containers = start_tool_containers(config["docker_image"], args)
+        except ContainerStartError as e:
+            print(f"Error: {e}", file=sys.stderr)
+            sys.exit(1)
+        base_urls.extend(tool_containers.base_urls)
+
+    # Time for the containers used by this run to become ready, if we wait for any
+    startup_seconds = tool_containers.startup_seconds if tool_containers else None
+
+    balancer = EndpointBalancer(base_urls, limiter)
 
     metadata_output: Any = None
     exit_code = 0
 
+    # Share one connection pool between all worker threads
+    session = create_session(
+        pool_size=args.threads or 1,
+        retries=args.retries,
+        backoff=args.retry_backoff,
+        hosts=len(base_urls),
+    )
+
+    cache = None
+    costs = None
+    if not config.get("input_files"):
+        # Key results on the exact image when we run it, otherwise on its name
+        cache = open_result_cache(
+            config,
+            args,
+            (tool_containers and tool_containers.image_id) or config["docker_image"],
+            remote=tool_containers is None,
+        )
+        costs = open_cost_store(config, None if args.no_cost_model else args.cost_dir)
+        if args.timeout_percentile is not None and (
+            costs is None or costs.model() is None
+        ):
+            print(
+                "Warning: No recorded runs of this tool yet, --timeout-percentile "
+                "falls back to --timeout",
+                file=sys.stderr,
+            )
+
+    # Compressing pays off for remote servers, not for local containers
+    compression = None
+    if args.wire_compression == "gzip" or (
+        args.wire_compression == "auto" and tool_containers is None
+    ):
+        if args.engine == "threads" and not config.get("input_files"):
+            compression = WireCompression()
+        elif args.wire_compression == "gzip":
+            print(
+                "Warning: --wire-compression is ignored in batch mode and by the asyncio engine",
+                file=sys.stderr,
+            )
+
+    if args.micro_batch > 1 and (config.get("input_files") or args.engine != "threads"):
+        print(
+            "Warning: --micro-batch is ignored in batch mode and by the asyncio engine",
+            file=sys.stderr,
+        )
+
+    if args.batch_size and not config.get("input_files"):
+        print(
+            "Warning: --batch-size only applies to batch configurations "
+            "(input_files: true)",
+            file=sys.stderr,
+        )
+
+    if len(base_urls) > 1 and tool_containers is None:
+        # Eject external endpoints which are down before sending any work
+        if balancer.probe(session) == 0:
+            print("Error: None of the API endpoints is healthy", file=sys.stderr)
+            session.close()
+            sys.exit(1)
+
+    start_time = time.monotonic()
+
     try:
         if config.get("input_files"):
-            # Batch mode: send all files in a single API call
-            batch_result = process_files_batch(
-                input_files,
+            # Batch mode: send all files in a single API call, or in chunks
+            batch_result = (
+                process_files_chunked if args.batch_size else process_files_batch
+            )(
+                list(discovered_files),
                 config,
                 args,
-                base_url,
+                session,
+                balancer,
                 tool_name,
                 args.output_dir,
             )
-            metadata_output = batch_result
+            metadata_output = with_startup_time(batch_result, startup_seconds)
             if batch_result.get("status") != "COMPLETED":
                 exit_code = 1
         else:
             # Standard mode: process files individually in parallel
-            with ThreadPoolExecutor(max_workers=args.threads) as executor:
-                futures = [
-                    executor.submit(
-                        process_file,
-                        input_file,
-                        config,
-                        args,
-                        base_url,
-                        tool_name,
-                        args.output_dir,
-                    )
-                    for input_file in input_files
-                ]
-
-                # Wait for all tasks to complete in CLI input order.
-                results = [future.result() for future in futures]
-
-            if len(results) == 1:
-                metadata_output = results[0]
-            else:
-                metadata_output = [
-                    {"input_file": input_file, **result}
-                    for input_file, result in zip(input_files, results)
-                ]
-
-            if any(result.get("status") != "COMPLETED" for result in results):
-                exit_code = 1
+            exit_code = run_standard(
+                discovered_files,
+                config,
+                args,
+                session,
+                balancer,
+                tool_name,
+                startup_seconds,
+                cache,
+                costs,
+                compression,
+                limiter,
+            )
 
         if args.output_metadata and metadata_output is not None:
             write_metadata_output(args.output_metadata, metadata_output)
 
+        if len(base_urls) > 1:
+            balancer.report(time.monotonic() - start_time)
+        if limiter is not None:
+            limiter.report()
+
     finally:
-        # Clean up - stop and remove the container if we created one
-        if container:
-            stop_docker_container(container)
+        session.close()
+
+        # Clean up - stop the containers we created, or return pooled ones
+        if tool_containers is not None:
+            tool_containers.release()
 
     print("Done!", file=sys.stderr)
 
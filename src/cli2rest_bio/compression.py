@@ -0,0 +1,192 @@
+"""Gzip compression of uploads and outputs on the wire."""
+
+import gzip
+import shlex
+import shutil
+import sys
+import tempfile
+import threading
+import zlib
+from typing import Any, BinaryIO, Callable, Dict, List
+
+GZIP_SUFFIX = ".gz"
+COMPRESSION_LEVEL = 6
+# Exit code and stderr line of a wrapper script which cannot run in the image
+UNSUPPORTED_EXIT_CODE = 199
+UNSUPPORTED_MARKER = "cli2rest-bio: wrapper unsupported by the image"
+# Exit code and stderr line of a wrapper script which cannot decompress its input
+DECOMPRESSION_EXIT_CODE = 198
+DECOMPRESSION_MARKER = "cli2rest-bio: could not decompress the input"
+# Compressed uploads larger than this are spooled to a local temporary file
+UPLOAD_SPOOL_SIZE = 4 * 1024**2
+_COPY_CHUNK_SIZE = 1024 * 1024
+# How a server reports that the image has no 'sh' to run the wrapper at all
+_MISSING_SHELL = "No such file or directory: 'sh'"
+
+
+def unsupported_exit() -> str:
+    """Return the shell command a wrapper script runs when the image lacks a tool."""
+    return (
+        f"{{ echo {shlex.quote(UNSUPPORTED_MARKER)} >&2; "
+        f"exit {UNSUPPORTED_EXIT_CODE}; }}"
+    )
+
+
+def decompression_failed_exit() -> str:
+    """Return the shell command a wrapper script runs when its input is corrupt."""
+    return (
+        f"{{ echo {shlex.quote(DECOMPRESSION_MARKER)} >&2; "
+        f"exit {DECOMPRESSION_EXIT_CODE}; }}"
+    )
+
+
+def is_wrapper_failure(result: Dict[str, Any]) -> bool:
+    """
+    Check whether a wrapped command failed because of the wrapper itself.
+
+    Only the wrapper's own exit code and stderr marker, or a missing shell,
+    count. Exit codes 126 and 127 of the tool, e.g. a missing program on one
+    input, are its own failures and are reported as they are.
+    """
+    stderr = result.get("stderr") or ""
+    if result.get("exit_code") == UNSUPPORTED_EXIT_CODE:
+        return UNSUPPORTED_MARKER in stderr
+    return result.get("exit_code") in (126, 127) and _MISSING_SHELL in stderr
+
+
+class _GunzipWriter:
+    """Incrementally decompress gzip data into an underlying file object."""
+
+    def __init__(self, target: BinaryIO):
+        self.target = target
+        self.decompressor = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+
+    def write(self, data: bytes) -> None:
+        self.target.write(self.decompressor.decompress(data))
+
+    def close(self) -> None:
+        try:
+            self.target.write(self.decompressor.flush())
+        finally:
+            self.target.close()
+
+
+class WireCompression:
+    """
+    Gzip compression of the input and outputs of each /run-command request.
+
+    cli2rest has no notion of compressed bodies, so the compressed input is
+    uploaded as '{input_file}.gz' and the configured command is wrapped in a
+    'sh -c' script run in the container. The script decompresses the input,
+    runs the tool, and gzips every output, which is requested as
+    '{output_file}.gz' and decompressed again while it is streamed to disk.
+
+    Whether the image can run the script (it needs 'sh' and 'gzip') is found
+    out on the first request. If it cannot, compression is turned off and the
+    request is sent again as it is. An input which gzip fails to decompress,
+    e.g. a corrupt '.gz' file uploaded as it is, fails on its own with
+    DECOMPRESSION_EXIT_CODE.
+    """
+
+    def __init__(self) -> None:
+        self.enabled = True
+        self._lock = threading.Lock()
+
+    def wrap_arguments(
+        self, arguments: List[str], input_name: str, output_names: List[str]
+    ) -> List[str]:
+        """Return the command which runs 'arguments' on a compressed input."""
+        compressed_input = shlex.quote(input_name + GZIP_SUFFIX)
+        outputs = " ".join(
+            shlex.quote(name) for name in output_names if not name.endswith(GZIP_SUFFIX)
+        )
+        script = (
+            f"command -v gzip >/dev/null 2>&1 || {unsupported_exit()}; "
+            f"gzip -dc {compressed_input} > {shlex.quote(input_name)} "
+            f"&& rm -f {compressed_input} || {decompression_failed_exit()}; "
+            '"$@"; status=$?; '
+            f"for f in {outputs}; do "
+            '[ -f "$f" ] && gzip -f "$f"; done; exit $status'
+        )
+        return ["sh", "-c", script, "sh", *arguments]
+
+    def wire_output_names(self, output_names: List[str]) -> List[str]:
+        """Return the names under which the outputs are requested."""
+        return [
+            name if name.endswith(GZIP_SUFFIX) else name + GZIP_SUFFIX
+            for name in output_names
+        ]
+
+    def output_opener(
+        self, open_output: Callable[[str], BinaryIO | None], output_names: List[str]
+    ) -> Callable[[str], Any]:
+        """Wrap an output opener to decompress outputs under their original names."""
+        original = {
+            name + GZIP_SUFFIX: name
+            for name in output_names
+            if not name.endswith(GZIP_SUFFIX)
+        }
+
+        def open_file(filename: str) -> Any:
+            if filename not in original:
+                return open_output(filename)
+            target = open_output(original[filename])
+            return None if target is None else _GunzipWriter(target)
+
+        return open_file
+
+    def restore_metadata(
+        self,
+        result: Dict[str, Any],
+        arguments: List[str],
+        output_names: List[str],
+    ) -> Dict[str, Any]:
+        """Report a result in terms of the unwrapped command and output names."""
+        if not result:
+            return result
+        wire_names = dict(zip(self.wire_output_names(output_names), output_names))
+        restored = dict(result)
+        restored["command"] = arguments
+        if result.get("missing_files") is not None:
+            restored["missing_files"] = [
+                wire_names.get(name, name) for name in result["missing_files"]
+            ]
+        return restored
+
+    def is_unsupported(self, result: Dict[str, Any]) -> bool:
+        """
+        Check whether a wrapped command failed because of the wrapper itself.
+
+        If so, compression is turned off for the remaining requests.
+        """
+        if not is_wrapper_failure(result):
+            return False
+        with self._lock:
+            if self.enabled:
+                self.enabled = False
+                print(
+                    "Warning: The tool image cannot decompress uploads, "
+                    "sending uncompressed requests",
+                    file=sys.stderr,
+                )
+        return True
+
+
+def compress_upload(file_object: BinaryIO) -> BinaryIO:
+    """
+    Gzip an (uncompressed) upload chunk by chunk.
+
+    The result is kept in memory up to UPLOAD_SPOOL_SIZE and in a local
+    temporary file beyond that, rewound and ready to be uploaded.
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_SIZE)
+    try:
+        with gzip.GzipFile(
+            fileobj=spool, mode="wb", compresslevel=COMPRESSION_LEVEL
+        ) as compressed:
+            shutil.copyfileobj(file_object, compressed, _COPY_CHUNK_SIZE)
+        spool.seek(0)
+    except BaseException:
+        spool.close()
+        raise
+    return spool  # type: ignore[return-value]
@@ -0,0 +1,148 @@
+"""Adaptive limit on the number of requests in flight."""
+
+import math
+import sys
+import threading
+import time
+
+DEFAULT_MAX_CONCURRENCY = 64
+INITIAL_CONCURRENCY = 2
+OVERLOAD_BACKOFF = 0.5
+# Fixed cost of a request expressed in bytes of input, so the latency of
+# tiny inputs is not dominated by their size
+REQUEST_OVERHEAD_BYTES = 64 * 1024
+SHORT_SMOOTHING = 0.2
+LONG_SMOOTHING = 0.005
+# Per-byte latency may exceed its long-term average this much before the
+# limit shrinks, which absorbs the noise of tool runtimes
+LATENCY_TOLERANCE = 1.25
+MIN_GRADIENT = 0.5
+
+
+class AdaptiveLimiter:
+    """
+    Latency-gradient limit on concurrent requests.
+
+    Callers hold a slot (acquire/release, or 'with limiter:') while processing
+    an input, and report every request with record(): its latency, the size of
+    its input and whether the server shed it. Latency is divided by the input
+    size plus a fixed per-request overhead, so a large input does not look like
+    congestion. A short-term and a long-term average of this per-byte latency
+    are kept, and their ratio (the gradient) falls below one once requests
+    queue on the server. The limit grows by one per request (slow start) until
+    the short-term average first exceeds the long-term one. From then on, each
+    limit's worth of busy requests moves it to limit * gradient + sqrt(limit):
+    it grows while latency holds and shrinks in proportion when it rises, the
+    square root being a queue allowance that keeps it from collapsing.
+    Overload responses and errors halve it, at most once per round trip, so
+    a burst of errors from one moment of overload counts once.
+    """
+
+    def __init__(
+        self,
+        max_limit: int = DEFAULT_MAX_CONCURRENCY,
+        initial_limit: int = INITIAL_CONCURRENCY,
+        min_limit: int = 1,
+    ):
+        self.min_limit = min_limit
+        self.max_limit = max(max_limit, min_limit)
+        self.limit = float(min(max(initial_limit, min_limit), self.max_limit))
+        self.peak_limit = self.limit
+        self.in_flight = 0
+        self._slow_start = True
+        self._round_trip: float | None = None
+        self._short: float | None = None
+        self._long: float | None = None
+        self._last_decrease = 0.0
+        self._started = time.monotonic()
+        self._last_change = self._started
+        self._limit_seconds = 0.0
+        self._condition = threading.Condition()
+
+    def acquire(self) -> None:
+        """Wait until fewer requests than the current limit are in flight."""
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self) -> None:
+        """Give back a slot taken with acquire()."""
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify()
+
+    def __enter__(self) -> "AdaptiveLimiter":
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.release()
+
+    def record(
+        self, latency: float, overloaded: bool = False, size: int = 0
+    ) -> None:
+        """Adjust the limit after a request for 'size' bytes took 'latency' seconds."""
+        with self._condition:
+            now = time.monotonic()
+            if self._round_trip is None:
+                self._round_trip = latency
+            else:
+                self._round_trip += SHORT_SMOOTHING * (latency - self._round_trip)
+            if overloaded:
+                self._decrease(now, OVERLOAD_BACKOFF)
+                self._condition.notify_all()
+                return
+
+            per_byte = latency / (max(size, 0) + REQUEST_OVERHEAD_BYTES)
+            if self._short is None or self._long is None:
+                self._short = self._long = per_byte
+            else:
+                self._short += SHORT_SMOOTHING * (per_byte - self._short)
+                self._long += LONG_SMOOTHING * (per_byte - self._long)
+            gradient = 1.0
+            if self._short > 0:
+                gradient = min(
+                    max(LATENCY_TOLERANCE * self._long / self._short, MIN_GRADIENT),
+                    1.0,
+                )
+
+            busy = self.in_flight >= int(self.limit) - 1
+            if self._short > self._long:
+                self._slow_start = False
+            if self._slow_start:
+                if busy:
+                    self._set_limit(now, self.limit + 1)
+            else:
+                target = self.limit * gradient + math.sqrt(self.limit)
+                if not busy:
+                    target = min(target, self.limit)
+                self._set_limit(now, self.limit + (target - self.limit) / self.limit)
+            self._condition.notify_all()
+
+    def _decrease(self, now: float, factor: float) -> None:
+        if now - self._last_decrease < (self._round_trip or 0.0):
+            return
+        self._slow_start = False
+        self._last_decrease = now
+        self._set_limit(now, self.limit * factor)
+
+    def _set_limit(self, now: float, limit: float) -> None:
+        self._limit_seconds += self.limit * (now - self._last_change)
+        self._last_change = now
+        self.limit = min(max(limit, float(self.min_limit)), float(self.max_limit))
+        self.peak_limit = max(self.peak_limit, self.limit)
+
+    def report(self) -> None:
+        """Print the concurrency the limiter settled on."""
+        with self._condition:
+            now = time.monotonic()
+            elapsed = now - self._started
+            limit_seconds = self._limit_seconds + self.limit * (now - self._last_change)
+            average = limit_seconds / elapsed if elapsed > 0 else self.limit
+            print(
+                f"Adaptive concurrency: {int(self.limit)} request(s) in flight at the end "
+                f"(average {average:.1f}, peak {int(self.peak_limit)}, "
+                f"maximum {self.max_limit})",
+                file=sys.stderr,
+            )
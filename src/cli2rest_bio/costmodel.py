@@ -0,0 +1,279 @@
+"""Runtime and memory model of each tool, learned from past execution_stats."""
+
+import json
+import math
+import os
+import sys
+import threading
+from typing import Any, BinaryIO, Dict, List, Set, Tuple
+
+from .cache import DEFAULT_CACHE_DIR, config_fingerprint, file_lock
+
+DEFAULT_COST_DIR = os.path.join(DEFAULT_CACHE_DIR, "costs")
+# Fit on the most recent observations only, so models follow new tool versions
+MAX_OBSERVATIONS = 5000
+MIN_OBSERVATIONS = 3
+FEATURES = ("atoms", "residues", "size")
+TARGETS = ("duration_seconds", "max_rss_kb", "cpu_user_seconds")
+
+_SITE_PREFIX = b"_atom_site."
+_RESIDUE_FIELDS = (
+    (b"auth_asym_id", b"label_asym_id"),
+    (b"auth_seq_id", b"label_seq_id"),
+    (b"pdbx_PDB_ins_code",),
+)
+
+
+def input_features(file_object: BinaryIO) -> Dict[str, int]:
+    """
+    Measure a PDB or mmCIF input: its size in bytes, atoms and residues.
+
+    Atoms are the ATOM and HETATM records of all models; residues are the
+    distinct chain, number and insertion code triples. Other formats only get
+    a size.
+    """
+    size = 0
+    atoms = 0
+    residues: Set[Any] = set()
+    site_fields: List[bytes] = []
+    residue_columns: List[int] | None = None
+
+    for line in file_object:
+        size += len(line)
+        if line.startswith((b"ATOM", b"HETATM")):
+            atoms += 1
+            if not site_fields:
+                # PDB: chain, residue number and insertion code in columns 22-27
+                residues.add(line[21:27])
+                continue
+            if residue_columns is None:
+                residue_columns = [
+                    next(
+                        (site_fields.index(f) for f in names if f in site_fields), -1
+                    )
+                    for names in _RESIDUE_FIELDS
+                ]
+            values = line.split()
+            residues.add(
+                tuple(
+                    values[i] if 0 <= i < len(values) else b""
+                    for i in residue_columns
+                )
+            )
+        elif line.startswith(_SITE_PREFIX):
+            site_fields.append(line[len(_SITE_PREFIX) :].strip())
+        elif line.startswith(b"loop_") and residue_columns is None:
+            site_fields = []
+
+    return {"size": size, "atoms": atoms, "residues": len(residues)}
+
+
+class LinearFit:
+    """Least-squares line predicting one target from one input feature."""
+
+    def __init__(
+        self, feature: str | None, intercept: float, slope: float, r2: float
+    ):
+        self.feature = feature
+        self.intercept = intercept
+        self.slope = slope
+        self.r2 = r2
+
+    @classmethod
+    def fit(
+        cls, points: List[Tuple[float, float]], feature: str | None
+    ) -> "LinearFit":
+        n = len(points)
+        mean_x = sum(x for x, _ in points) / n
+        mean_y = sum(y for _, y in points) / n
+        sxx = sum((x - mean_x) ** 2 for x, _ in points)
+        syy = sum((y - mean_y) ** 2 for _, y in points)
+        sxy = sum((x - mean_x) * (y - mean_y) for x, y in points)
+        if feature is None or sxx == 0 or syy == 0:
+            return cls(None, mean_y, 0.0, 0.0)
+        slope = sxy / sxx
+        return cls(feature, mean_y - slope * mean_x, slope, sxy * sxy / (sxx * syy))
+
+    def predict(self, features: Dict[str, int]) -> float:
+        x = features.get(self.feature, 0) if self.feature else 0
+        return max(self.intercept + self.slope * x, 0.0)
+
+    def describe(self) -> str:
+        if self.feature is None:
+            return f"{self.intercept:.4g}"
+        return (
+            f"{self.intercept:.4g} + {self.slope:.4g} x {self.feature} "
+            f"(R² {self.r2:.2f})"
+        )
+
+
+class CostModel:
+    """
+    Per-target linear models of a tool, fitted on recorded observations.
+
+    For every target of TARGETS, one line is fitted per input feature, on the
+    observations which measured it, and the one explaining the target best
+    (highest R²) is in 'fits'. Predictions use the best line whose feature
+    is known for the input, e.g. only the size when its atoms were not
+    counted. With too little variation in the inputs the model predicts the
+    mean.
+    """
+
+    def __init__(self, observations: List[Dict[str, Any]]):
+        self.observations = observations
+        self.fits: Dict[str, LinearFit] = {}
+        self._candidates: Dict[str, List[LinearFit]] = {}
+        self._ratios: Dict[str | None, List[float]] = {}
+        for target in TARGETS:
+            rows = [
+                row
+                for row in observations
+                if isinstance(row.get(target), (int, float))
+            ]
+            if not rows:
+                continue
+            candidates = []
+            for feature in FEATURES:
+                points = [
+                    (row[feature], row[target])
+                    for row in rows
+                    if isinstance(row.get(feature), (int, float))
+                ]
+                # A feature measured on a handful of runs fits them all too well
+                if len(points) >= MIN_OBSERVATIONS and any(x for x, _ in points):
+                    candidates.append(LinearFit.fit(points, feature))
+            candidates.sort(key=lambda fit: fit.r2, reverse=True)
+            # The mean of the target, for inputs without any known feature
+            candidates.append(LinearFit.fit([(0, row[target]) for row in rows], None))
+            self._candidates[target] = candidates
+            self.fits[target] = candidates[0]
+
+    def _fit(self, target: str, features: Dict[str, int]) -> LinearFit | None:
+        for fit in self._candidates.get(target, []):
+            if fit.feature is None or fit.feature in features:
+                return fit
+        return None
+
+    def predict(self, features: Dict[str, int]) -> Dict[str, float]:
+        """Predict every modelled target for an input with the given features."""
+        return {
+            target: fit.predict(features)
+            for target in self.fits
+            if (fit := self._fit(target, features)) is not None
+        }
+
+    def duration_bound(
+        self, features: Dict[str, int], percentile: float
+    ) -> float | None:
+        """
+        Return a duration that 'percentile' percent of similar runs stayed under.
+
+        The predicted duration is scaled by the given percentile of the ratios
+        of actual to predicted duration over the recorded runs, so a tool with
+        erratic runtimes gets a wider bound than a predictable one.
+        """
+        fit = self._fit("duration_seconds", features)
+        if fit is None:
+            return None
+        if fit.feature not in self._ratios:
+            ratios = []
+            for row in self.observations:
+                if fit.feature is not None and fit.feature not in row:
+                    continue
+                predicted = fit.predict(row)
+                actual = row.get("duration_seconds")
+                if predicted > 0 and isinstance(actual, (int, float)):
+                    ratios.append(actual / predicted)
+            self._ratios[fit.feature] = sorted(ratios)
+        ratios = self._ratios[fit.feature]
+        if not ratios:
+            return None
+        rank = math.ceil(percentile / 100 * len(ratios))
+        ratio = ratios[min(max(rank, 1), len(ratios)) - 1]
+        return fit.predict(features) * ratio
+
+
+class CostStore:
+    """
+    Observations of one tool configuration, appended as JSON lines.
+
+    Each line combines the input features with the execution_stats of a
+    completed run. The file is named after the tool and the fingerprint of its
+    configuration, so changing the arguments or the image starts a new model.
+    Appends and compaction hold a lock on '{path}.lock', so runs of the same
+    tool do not lose each other's lines.
+    """
+
+    def __init__(self, cost_dir: str, config: Dict[str, Any]):
+        os.makedirs(cost_dir, exist_ok=True)
+        fingerprint = config_fingerprint(config, config["docker_image"])
+        self.path = os.path.join(
+            cost_dir, f"{config['name']}-{fingerprint[:16]}.ndjson"
+        )
+        self.lock_path = f"{self.path}.lock"
+        self._lock = threading.Lock()
+        self._model: CostModel | None = None
+        self._fitted = False
+
+    def record(
+        self, features: Dict[str, int], execution_stats: Dict[str, Any]
+    ) -> None:
+        """Append the features of an input with the statistics of its run."""
+        row: Dict[str, Any] = dict(features)
+        for target in TARGETS:
+            row[target] = execution_stats.get(target)
+        if row["duration_seconds"] is None:
+            return
+        line = json.dumps(row, separators=(",", ":")) + "\n"
+        with self._lock, file_lock(self.lock_path), open(self.path, "a") as f:
+            f.write(line)
+
+    def observations(self) -> List[Dict[str, Any]]:
+        """Return the most recent observations, compacting an overgrown file."""
+        with file_lock(self.lock_path):
+            try:
+                with open(self.path, "r") as f:
+                    lines = f.readlines()
+            except FileNotFoundError:
+                return []
+            if len(lines) > 2 * MAX_OBSERVATIONS:
+                lines = lines[-MAX_OBSERVATIONS:]
+                tmp_path = f"{self.path}.{os.getpid()}.tmp"
+                with open(tmp_path, "w") as f:
+                    f.writelines(lines)
+                os.replace(tmp_path, self.path)
+
+        rows: List[Dict[str, Any]] = []
+        for line in lines[-MAX_OBSERVATIONS:]:
+            try:
+                row = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(row, dict):
+                rows.append(row)
+        return rows
+
+    def model(self) -> CostModel | None:
+        """
+        Fit a model, or return None while there are too few observations.
+
+        The model is fitted once, on the runs recorded before the first call.
+        """
+        with self._lock:
+            if not self._fitted:
+                observations = self.observations()
+                if len(observations) >= MIN_OBSERVATIONS:
+                    self._model = CostModel(observations)
+                self._fitted = True
+            return self._model
+
+
+def open_cost_store(config: Dict[str, Any], cost_dir: str | None) -> CostStore | None:
+    """Open the observation store of a tool, or return None if disabled."""
+    if not cost_dir:
+        return None
+    try:
+        return CostStore(cost_dir, config)
+    except OSError as e:
+        print(f"Warning: Cost model disabled: {e}", file=sys.stderr)
+        return None
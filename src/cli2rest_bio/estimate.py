@@ -0,0 +1,99 @@
+"""Prediction of the runtime and memory of inputs from a tool's cost model."""
+
+import argparse
+import gzip
+import os
+import sys
+from typing import Any, BinaryIO, Dict, List
+
+from .cli2rest_bio import load_tool_config, positive_int
+from .costmodel import DEFAULT_COST_DIR, CostStore, input_features
+
+
+def _open_input(path: str) -> BinaryIO:
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")  # type: ignore[return-value]
+    return open(path, "rb")
+
+
+def estimate_files(store: CostStore, input_files: List[str], threads: int) -> bool:
+    """
+    Print the predicted runtime and peak memory of every input and in total.
+
+    The wall clock is bounded below both by the total runtime spread over
+    'threads' and by the longest single input. Returns False when the tool has
+    no model yet.
+    """
+    model = store.model()
+    if model is None:
+        print(
+            f"Error: Not enough recorded runs to estimate costs ({store.path})",
+            file=sys.stderr,
+        )
+        return False
+
+    for target, fit in model.fits.items():
+        print(f"{target} = {fit.describe()}", file=sys.stderr)
+    print(f"Fitted on {len(model.observations)} run(s)", file=sys.stderr)
+
+    print("input_file\tsize\tatoms\tresidues\tduration_seconds\tmax_rss_kb")
+    durations: List[float] = []
+    peak_rss = 0.0
+    for input_file in input_files:
+        try:
+            with _open_input(input_file) as f:
+                features = input_features(f)
+        except (OSError, EOFError) as e:
+            print(f"Error reading {input_file}: {e}", file=sys.stderr)
+            continue
+        predicted: Dict[str, Any] = model.predict(features)
+        duration = predicted.get("duration_seconds", 0.0)
+        rss = predicted.get("max_rss_kb", 0.0)
+        durations.append(duration)
+        peak_rss = max(peak_rss, rss)
+        print(
+            f"{input_file}\t{features['size']}\t{features['atoms']}\t"
+            f"{features['residues']}\t{duration:.2f}\t{rss:.0f}"
+        )
+
+    total = sum(durations)
+    wall = max(total / threads, max(durations, default=0.0))
+    print(
+        f"Estimated {total:.1f} s of tool time for {len(durations)} input(s), "
+        f"at least {wall:.1f} s wall clock with {threads} request(s) in flight, "
+        f"peak memory {peak_rss / 1024:.0f} MiB per run",
+        file=sys.stderr,
+    )
+    return True
+
+
+def estimate_main(argv: List[str]) -> None:
+    """Entry point of 'cli2rest-bio estimate'."""
+    parser = argparse.ArgumentParser(prog="cli2rest-bio.py estimate")
+    parser.add_argument("config", help="Tool configuration whose recorded runs are used")
+    parser.add_argument("input_files", nargs="+", help="Inputs to estimate")
+    parser.add_argument(
+        "--threads",
+        type=positive_int,
+        default=os.cpu_count() or 1,
+        help="Number of requests in flight assumed for the wall clock estimate. Default: number of CPUs",
+    )
+    parser.add_argument(
+        "--cost-dir",
+        type=str,
+        default=DEFAULT_COST_DIR,
+        help=f"Directory of the recorded runs. Default: {DEFAULT_COST_DIR}",
+    )
+    args = parser.parse_args(argv)
+
+    config = load_tool_config(args.config)
+    if "docker_image" not in config:
+        print(
+            "Error: Costs can only be estimated for a single tool configuration",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+
+    store = CostStore(args.cost_dir, config)
+    if not estimate_files(store, args.input_files, args.threads):
+        sys.exit(1)
@@ -0,0 +1,223 @@
+"""Pre-pulling of tool images and pinning them to digests in a lockfile."""
+
+import argparse
+import importlib.resources
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from importlib.resources.abc import Traversable
+from typing import Dict, Iterator, List
+
+import docker
+import docker.errors
+import docker.utils
+import yaml
+
+from .cli2rest_bio import DEFAULT_IMAGE_LOCK, load_tool_config, positive_int
+
+DEFAULT_PULL_PARALLELISM = 4
+PROGRESS_INTERVAL = 2.0
+
+_print_lock = threading.Lock()
+
+
+def _log(message: str) -> None:
+    with _print_lock:
+        print(message, file=sys.stderr)
+
+
+def _walk_configs(directory: Traversable) -> Iterator[Traversable]:
+    for entry in sorted(directory.iterdir(), key=lambda entry: entry.name):
+        if entry.is_dir():
+            yield from _walk_configs(entry)
+        elif entry.name.endswith((".yaml", ".yml")):
+            yield entry
+
+
+def packaged_images() -> List[str]:
+    """Return the distinct Docker images of all configurations shipped with the package."""
+    images: List[str] = []
+    for path in _walk_configs(importlib.resources.files("cli2rest_bio.configs")):
+        with path.open("r") as f:
+            config = yaml.safe_load(f) or {}
+        image = config.get("docker_image")
+        if image and image not in images:
+            images.append(image)
+    return images
+
+
+def read_image_lock(lock_path: str) -> Dict[str, str]:
+    """Read a lockfile mapping image references to pinned 'repository@digest' references."""
+    try:
+        with open(lock_path, "r") as f:
+            return dict(json.load(f).get("images", {}))
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError, AttributeError) as e:
+        print(f"Warning: Ignoring unreadable image lock {lock_path}: {e}", file=sys.stderr)
+        return {}
+
+
+def write_image_lock(lock_path: str, images: Dict[str, str]) -> None:
+    """Write a lockfile atomically."""
+    os.makedirs(os.path.dirname(os.path.abspath(lock_path)), exist_ok=True)
+    tmp_lock_path = f"{lock_path}.{os.getpid()}.tmp"
+    with open(tmp_lock_path, "w") as f:
+        json.dump({"images": dict(sorted(images.items()))}, f, indent=2)
+        f.write("\n")
+    os.replace(tmp_lock_path, lock_path)
+
+
+def pinned_image(docker_image: str, lock_path: str | None) -> str:
+    """Return the digest reference recorded for an image, or the image itself."""
+    if not lock_path:
+        return docker_image
+    pinned = read_image_lock(lock_path).get(docker_image)
+    if pinned:
+        print(f"Using pinned image {pinned}", file=sys.stderr)
+        return pinned
+    return docker_image
+
+
+def resolve_digest(client: docker.DockerClient, docker_image: str) -> str:
+    """
+    Resolve an image reference to 'repository@sha256:...'.
+
+    The registry is asked first. When it cannot be reached, the digest of a
+    locally available copy of the image is used instead.
+    """
+    repository, tag = docker.utils.parse_repository_tag(docker_image)
+    if tag and tag.startswith("sha256:"):
+        return docker_image
+
+    try:
+        digest = client.images.get_registry_data(docker_image).id
+        return f"{repository}@{digest}"
+    except docker.errors.APIError as registry_error:
+        try:
+            repo_digests = client.images.get(docker_image).attrs.get("RepoDigests", [])
+        except docker.errors.APIError:
+            repo_digests = []
+        for repo_digest in repo_digests:
+            if repo_digest.startswith(f"{repository}@"):
+                return repo_digest
+        raise registry_error
+
+
+def _is_local(client: docker.DockerClient, reference: str) -> bool:
+    try:
+        client.images.get(reference)
+    except docker.errors.ImageNotFound:
+        return False
+    return True
+
+
+def pull_with_progress(client: docker.DockerClient, reference: str) -> None:
+    """Pull an image by reference, periodically reporting the bytes downloaded."""
+    repository, tag = docker.utils.parse_repository_tag(reference)
+    layers: Dict[str, Dict[str, int]] = {}
+    last_report = time.monotonic()
+
+    for event in client.api.pull(repository, tag=tag, stream=True, decode=True):
+        if "error" in event:
+            raise docker.errors.APIError(event["error"])
+        layer = event.get("id")
+        detail = event.get("progressDetail") or {}
+        if layer and event.get("status") == "Downloading" and detail.get("total"):
+            layers[layer] = {"current": detail["current"], "total": detail["total"]}
+        elif layer and event.get("status") in ("Download complete", "Already exists"):
+            size = layers.get(layer, {}).get("total", 0)
+            layers[layer] = {"current": size, "total": size}
+
+        if time.monotonic() - last_report >= PROGRESS_INTERVAL and layers:
+            current = sum(layer["current"] for layer in layers.values())
+            total = sum(layer["total"] for layer in layers.values())
+            _log(
+                f"{reference}: {current / 1024**2:.0f} of {total / 1024**2:.0f} MiB "
+                f"in {len(layers)} layer(s)"
+            )
+            last_report = time.monotonic()
+
+
+def prefetch_image(client: docker.DockerClient, docker_image: str) -> str:
+    """Resolve an image to its digest and pull it unless present, returning the pin."""
+    start_time = time.monotonic()
+    pinned = resolve_digest(client, docker_image)
+    if _is_local(client, pinned):
+        _log(f"{docker_image}: up to date ({pinned})")
+        return pinned
+
+    _log(f"{docker_image}: pulling {pinned}")
+    pull_with_progress(client, pinned)
+    _log(f"{docker_image}: pulled in {time.monotonic() - start_time:.1f} s")
+    return pinned
+
+
+def prefetch_images(
+    docker_images: List[str], lock_path: str, parallel: int
+) -> bool:
+    """
+    Pull images concurrently and record their digests in the lockfile.
+
+    Entries of images that are not prefetched are kept, so configurations can
+    be locked a few at a time. Returns False if any image failed.
+    """
+    client = docker.from_env()
+    pinned: Dict[str, str] = {}
+    failed = False
+
+    with ThreadPoolExecutor(max_workers=parallel) as executor:
+        futures = {
+            docker_image: executor.submit(prefetch_image, client, docker_image)
+            for docker_image in docker_images
+        }
+        for docker_image, future in futures.items():
+            try:
+                pinned[docker_image] = future.result()
+            except Exception as e:
+                _log(f"Error: Could not prefetch {docker_image}: {e}")
+                failed = True
+
+    images = read_image_lock(lock_path)
+    images.update(pinned)
+    write_image_lock(lock_path, images)
+    print(f"Pinned {len(pinned)} image(s) in {lock_path}", file=sys.stderr)
+    return not failed
+
+
+def prefetch_main(argv: List[str]) -> None:
+    """Entry point of 'cli2rest-bio prefetch'."""
+    parser = argparse.ArgumentParser(prog="cli2rest-bio.py prefetch")
+    parser.add_argument(
+        "configs",
+        nargs="*",
+        help="Configurations whose images are prefetched. Default: every configuration shipped with the package",
+    )
+    parser.add_argument(
+        "--parallel",
+        type=positive_int,
+        default=DEFAULT_PULL_PARALLELISM,
+        help=f"Number of images pulled at the same time. Default: {DEFAULT_PULL_PARALLELISM}",
+    )
+    parser.add_argument(
+        "--image-lock",
+        type=str,
+        default=DEFAULT_IMAGE_LOCK,
+        help=f"Lockfile to record the pinned digests in. Default: {DEFAULT_IMAGE_LOCK}",
+    )
+    args = parser.parse_args(argv)
+
+    if args.configs:
+        docker_images: List[str] = []
+        for config_path in args.configs:
+            docker_image = load_tool_config(config_path)["docker_image"]
+            if docker_image not in docker_images:
+                docker_images.append(docker_image)
+    else:
+        docker_images = packaged_images()
+
+    if not prefetch_images(docker_images, args.image_lock, args.parallel):
+        sys.exit(1)
@@ -0,0 +1,159 @@
+"""Lazy discovery of input files from arguments, directories and list files."""
+
+import fnmatch
+import os
+import queue
+import sys
+import threading
+from typing import Iterable, Iterator, List, Set, Tuple, TypeVar
+
+DISCOVERY_QUEUE_SIZE = 1024
+
+T = TypeVar("T")
+
+_END = object()
+
+
+def matches_patterns(
+    relative_path: str, include: List[str] | None, exclude: List[str] | None
+) -> bool:
+    """Check a path (relative to its input directory) against glob patterns."""
+    name = os.path.basename(relative_path)
+
+    def matches(pattern: str) -> bool:
+        return fnmatch.fnmatch(name, pattern) or fnmatch.fnmatch(relative_path, pattern)
+
+    if include and not any(matches(pattern) for pattern in include):
+        return False
+    if exclude and any(matches(pattern) for pattern in exclude):
+        return False
+    return True
+
+
+def walk_input_dir(
+    input_dir: str, include: List[str] | None, exclude: List[str] | None
+) -> Iterator[str]:
+    """
+    Recursively yield files under a directory, in sorted order.
+
+    Symbolic links to directories are followed, but every directory is
+    visited once, identified by its device and inode, so a link pointing back
+    to one of its parents cannot make the walk loop forever.
+    """
+    try:
+        root = os.stat(input_dir)
+    except OSError as e:
+        print(f"Error reading directory {input_dir}: {e}", file=sys.stderr)
+        return
+    visited: Set[Tuple[int, int]] = {(root.st_dev, root.st_ino)}
+    pending = [input_dir]
+    while pending:
+        directory = pending.pop()
+        try:
+            with os.scandir(directory) as it:
+                entries = sorted(it, key=lambda entry: entry.name)
+        except OSError as e:
+            print(f"Error reading directory {directory}: {e}", file=sys.stderr)
+            continue
+
+        subdirectories = []
+        for entry in entries:
+            if entry.is_dir():
+                try:
+                    info = entry.stat()
+                except OSError:
+                    continue
+                if (info.st_dev, info.st_ino) in visited:
+                    continue
+                visited.add((info.st_dev, info.st_ino))
+                subdirectories.append(entry.path)
+            elif entry.is_file() and matches_patterns(
+                os.path.relpath(entry.path, input_dir), include, exclude
+            ):
+                yield entry.path
+        # Visit subdirectories in sorted order, depth first
+        pending.extend(reversed(subdirectories))
+
+
+def read_input_list(input_list: str) -> Iterator[str]:
+    """Yield paths listed one per line in a file, or in stdin for '-'."""
+    handle = sys.stdin if input_list == "-" else open(input_list, "r")
+    try:
+        for line in handle:
+            path = line.strip()
+            if path and not path.startswith("#"):
+                yield path
+    finally:
+        if handle is not sys.stdin:
+            handle.close()
+
+
+def iter_input_files(
+    input_files: List[str],
+    input_dirs: List[str] | None = None,
+    include: List[str] | None = None,
+    exclude: List[str] | None = None,
+    input_list: str | None = None,
+) -> Iterator[str]:
+    """Yield input files from positional arguments, directories and a list file."""
+    yield from input_files
+    for input_dir in input_dirs or []:
+        yield from walk_input_dir(input_dir, include, exclude)
+    if input_list:
+        yield from read_input_list(input_list)
+
+
+def input_size(path: str) -> int:
+    """
+    Return the uncompressed size of an input file in bytes, or 0 if unreadable.
+
+    The size of a gzipped file is read from its trailer (modulo 4 GiB) rather
+    than by decompressing it.
+    """
+    try:
+        if not path.endswith(".gz"):
+            return os.path.getsize(path)
+        with open(path, "rb") as f:
+            f.seek(-4, os.SEEK_END)
+            return int.from_bytes(f.read(4), "little")
+    except OSError:
+        return 0
+
+
+def prefetch(iterable: Iterable[T], maxsize: int = DISCOVERY_QUEUE_SIZE) -> Iterator[T]:
+    """
+    Run an iterable in a background thread, buffering up to 'maxsize' items.
+
+    The thread starts right away, not on the first next(), so enumeration
+    overlaps with whatever the caller does before consuming. Items are yielded
+    as soon as they are produced, so consumers can start work while a slow
+    enumeration (e.g. of a network filesystem) is still running. Exceptions
+    raised by the iterable are re-raised in the consumer.
+    """
+    buffer: "queue.Queue[object]" = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+
+    def produce() -> None:
+        try:
+            for item in iterable:
+                if stop.is_set():
+                    return
+                buffer.put(item)
+        except BaseException as e:
+            buffer.put(e)
+        buffer.put(_END)
+
+    def consume() -> Iterator[T]:
+        try:
+            while True:
+                item = buffer.get()
+                if item is _END:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                yield item  # type: ignore[misc]
+        finally:
+            stop.set()
+
+    threading.Thread(target=produce, daemon=True).start()
+    return consume()
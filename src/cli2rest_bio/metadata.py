@@ -0,0 +1,310 @@
+"""Incremental writing of per-input response metadata."""
+
+import json
+import os
+import sys
+import tempfile
+from typing import IO, Any, BinaryIO, Dict, Iterator, TextIO, Tuple
+
+DEFAULT_FSYNC_BATCH = 64
+_SCAN_CHUNK_SIZE = 1024 * 1024
+
+
+def _open_temporary(output_path: str) -> IO[str]:
+    """Create a uniquely named temporary file next to 'output_path'."""
+    return tempfile.NamedTemporaryFile(
+        "w",
+        dir=os.path.dirname(output_path) or ".",
+        prefix=f".{os.path.basename(output_path)}.",
+        suffix=".tmp",
+        delete=False,
+    )
+
+
+def _unlink(path: str) -> None:
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+def write_metadata_file(output_path: str, metadata: Any) -> None:
+    """
+    Write a metadata document to a temporary file and rename it into place.
+
+    Readers, and --resume, never see a partial file, and the temporary file is
+    removed again if writing fails or is interrupted.
+    """
+    handle = _open_temporary(output_path)
+    try:
+        with handle:
+            json.dump(metadata, handle, separators=(",", ":"))
+        os.replace(handle.name, output_path)
+    except BaseException:
+        _unlink(handle.name)
+        raise
+
+
+class MetadataSink:
+    """
+    Count per-input results and write them to disk as they arrive.
+
+    The output keeps the shape of --output-metadata: a single object when there
+    was exactly one input, otherwise an array of objects, each with an
+    'input_file' key. Only the first result is held back, until it is known
+    whether more follow.
+
+    The document is written to a temporary file next to the output and
+    renamed over it on close, so the metadata of a previous run, which
+    --resume relies on, survives until the new one is complete. abort(),
+    e.g. after an interrupt, removes the temporary file instead.
+    """
+
+    def __init__(self, output_path: str | None):
+        self.output_path = output_path
+        self.tmp_path: str | None = None
+        self.count = 0
+        self.failed = 0
+        self._first: Dict[str, Any] | None = None
+        self._handle: TextIO | None = None
+
+    def add(self, input_file: str, result: Dict[str, Any], write: bool = True) -> None:
+        """Record the result of one input file, writing it out unless told not to."""
+        self.count += 1
+        if result.get("status") != "COMPLETED":
+            self.failed += 1
+
+        if not self.output_path or not write:
+            return
+
+        try:
+            self._write({"input_file": input_file, **result})
+        except IOError as e:
+            self._fail(e)
+
+    def close(self) -> None:
+        """Finish the output file."""
+        if not self.output_path:
+            return
+
+        try:
+            self._finish()
+        except IOError as e:
+            self._fail(e)
+        except BaseException:
+            self._discard()
+            raise
+
+    def abort(self) -> None:
+        """Give up on the output file, leaving any previous one in place."""
+        self._discard()
+
+    def _write(self, record: Dict[str, Any]) -> None:
+        if self._first is None and self.count == 1:
+            self._first = record
+            return
+
+        if self._handle is None:
+            self._handle = self._open_temporary()
+            self._handle.write("[")
+            self._dump(self._first)
+        self._handle.write(",")
+        self._dump(record)
+
+    def _finish(self) -> None:
+        if self._handle is not None:
+            self._handle.write("]")
+            self._handle.close()
+            self._handle = None
+        else:
+            with self._open_temporary() as f:
+                if self._first is None:
+                    f.write("[]")
+                else:
+                    # A single input is written as a bare object, which keeps
+                    # its 'input_file' for --resume
+                    json.dump(self._first, f, separators=(",", ":"))
+        os.replace(str(self.tmp_path), str(self.output_path))
+        self.tmp_path = None
+
+    def _open_temporary(self) -> TextIO:
+        handle = _open_temporary(str(self.output_path))
+        self.tmp_path = handle.name
+        return handle  # type: ignore[return-value]
+
+    def _dump(self, record: Dict[str, Any] | None) -> None:
+        assert self._handle is not None
+        json.dump(record, self._handle, separators=(",", ":"))
+
+    def _fail(self, error: Exception) -> None:
+        print(f"Error writing metadata file: {error}", file=sys.stderr)
+        self._discard()
+
+    def _discard(self) -> None:
+        self.output_path = None
+        if self._handle is not None:
+            try:
+                self._handle.close()
+            except OSError:
+                pass
+            self._handle = None
+        if self.tmp_path is not None:
+            _unlink(self.tmp_path)
+            self.tmp_path = None
+
+
+class NdjsonMetadataSink(MetadataSink):
+    """
+    Append one JSON line per input as soon as its result arrives.
+
+    Every line is flushed to the operating system immediately, so a killed
+    process loses nothing, and the file is fsync'ed every 'fsync_batch' records
+    to survive machine crashes without paying for a sync per input.
+    """
+
+    def __init__(
+        self,
+        output_path: str | None,
+        fsync_batch: int = DEFAULT_FSYNC_BATCH,
+        append: bool = False,
+    ):
+        super().__init__(output_path)
+        # Lines are appended to the output itself, never renamed into place
+        self.fsync_batch = fsync_batch
+        self.append = append
+        self._unsynced = 0
+
+    def _write(self, record: Dict[str, Any]) -> None:
+        if self._handle is None:
+            self._open()
+        assert self._handle is not None
+        self._dump(record)
+        self._handle.write("\n")
+        self._handle.flush()
+
+        self._unsynced += 1
+        if self._unsynced >= self.fsync_batch:
+            os.fsync(self._handle.fileno())
+            self._unsynced = 0
+
+    def _finish(self) -> None:
+        if self._handle is None:
+            self._open()
+        assert self._handle is not None
+        self._handle.flush()
+        os.fsync(self._handle.fileno())
+        self._handle.close()
+        self._handle = None
+
+    def abort(self) -> None:
+        """Close the journal, keeping every line written so far."""
+        self.close()
+
+    def _open(self) -> None:
+        self._handle = open(str(self.output_path), "a" if self.append else "w")
+        if self.append and self._handle.tell() > 0:
+            # Terminate a line truncated by a killed run before appending
+            with open(str(self.output_path), "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    self._handle.write("\n")
+
+
+def scan_metadata_records(
+    path: str,
+) -> Iterator[Tuple[int, int, Dict[str, Any]]]:
+    """
+    Yield the per-input records of a previous --output-metadata file.
+
+    Each record comes with its byte offset and length in the file, which is
+    read chunk by chunk or line by line, so only one record is held at a time.
+    Both JSON (object or array) and NDJSON files are accepted. A truncated last
+    NDJSON line, as left behind by a killed run, is ignored.
+    """
+    with open(path, "rb") as f:
+        offset = 0
+        while True:
+            first = f.read(1)
+            if not first.isspace():
+                break
+            offset += 1
+        f.seek(offset)
+        if first == b"[":
+            yield from _scan_array(f, offset + 1)
+            return
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                record = None
+            if isinstance(record, dict):
+                yield offset, len(line), record
+            offset += len(line)
+
+
+def _scan_array(
+    f: BinaryIO, offset: int
+) -> Iterator[Tuple[int, int, Dict[str, Any]]]:
+    # Bytes are decoded as Latin-1, one character each, so positions in the
+    # buffer are byte offsets; records holding other bytes are decoded again
+    decoder = json.JSONDecoder()
+    f.seek(offset)
+    buffer = ""
+    position = 0
+    at_end = False
+    while True:
+        while position < len(buffer) and buffer[position] in " \t\r\n,":
+            position += 1
+        if buffer[position : position + 1] == "]":
+            return
+        try:
+            record, end = decoder.raw_decode(buffer, position)
+        except ValueError:
+            if at_end:
+                return
+            chunk = f.read(_SCAN_CHUNK_SIZE)
+            at_end = not chunk
+            offset += position
+            buffer = buffer[position:] + chunk.decode("latin-1")
+            position = 0
+            continue
+        raw = buffer[position:end].encode("latin-1")
+        if not raw.isascii():
+            record = json.loads(raw)
+        if isinstance(record, dict):
+            yield offset + position, len(raw), record
+        position = end
+
+
+class ResumedResults:
+    """
+    Results of a previous run, by normalized absolute input path.
+
+    Only the location of each record in the previous --output-metadata file is
+    kept in memory; get() reads a record back when its input is skipped. The
+    file is only replaced once the new run's metadata is complete, and NDJSON
+    journals are appended to, so the locations stay valid for the whole run.
+    """
+
+    def __init__(self, path: str, locations: Dict[str, Tuple[int, int]]):
+        self.path = path
+        self.locations = locations
+
+    def __contains__(self, input_file: object) -> bool:
+        return input_file in self.locations
+
+    def __len__(self) -> int:
+        return len(self.locations)
+
+    def get(self, input_file: str) -> Dict[str, Any] | None:
+        """Return the previous result of an input, or None if it has none."""
+        location = self.locations.get(input_file)
+        if location is None:
+            return None
+        offset, length = location
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            record = json.loads(f.read(length))
+        record.pop("input_file", None)
+        return record
+
@@ -0,0 +1,478 @@
+"""Runs of several small inputs through a per-file tool in a single request."""
+
+import argparse
+import io
+import math
+import posixpath
+import shlex
+import sys
+import threading
+from typing import Any, BinaryIO, Callable, Dict, Iterable, Iterator, List, Tuple
+
+import requests
+
+from .balancer import EndpointBalancer, NoHealthyEndpointError
+from .cache import ResultCache, hash_stream
+from .cli2rest_bio import (
+    build_error_metadata,
+    build_form_data,
+    input_timeout,
+    is_complete_result,
+    open_input_file,
+    output_location,
+    output_opener,
+    post_run_command,
+    read_input_features,
+    record_cost,
+    report_result_status,
+    uses_input_timeout,
+)
+from .compression import is_wrapper_failure, unsupported_exit
+from .costmodel import CostStore
+from .inputs import input_size
+from .multipart import DEFAULT_CHUNK_SIZE, parse_multipart_stream
+from .writer import OutputBatch
+
+# Larger inputs gain little from sharing a request and are sent on their own
+MICRO_BATCH_MAX_INPUT_SIZE = 1024 * 1024
+
+_UPLOAD_PREFIX = ".cli2rest-input-"
+_STATUS_FILE = ".cli2rest-status"
+_STDOUT_FILE = ".cli2rest-stdout"
+_STDERR_FILE = ".cli2rest-stderr"
+_RUNNER_FILES = (_STATUS_FILE, _STDOUT_FILE, _STDERR_FILE)
+# Exit code of 'timeout' when the command it ran was out of time
+_TIMEOUT_EXIT_CODE = 124
+# Seconds the runner itself may take per input on top of the input's timeout
+_RUN_OVERHEAD_SECONDS = 1.0
+
+
+class _Capture:
+    """Collect a runner file of the response in memory."""
+
+    def __init__(self) -> None:
+        self.chunks: List[bytes] = []
+
+    def write(self, data: bytes) -> None:
+        self.chunks.append(data)
+
+    def close(self) -> None:
+        pass
+
+    def text(self) -> str:
+        return b"".join(self.chunks).decode("utf-8", errors="replace")
+
+
+class MicroBatching:
+    """
+    An in-container runner executing a tool once per input of a request.
+
+    The inputs are uploaded under private names and moved by a 'sh -c' script
+    into numbered subdirectories, where the configured arguments are run one
+    after another. Each run leaves its outputs, stdout, stderr, exit code and
+    start and end times in its subdirectory, all requested as
+    '{index}/{filename}'.
+
+    Whether the image can run the script is found out on the first request.
+    If it cannot, micro-batching is turned off and inputs are sent one by one.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self.enabled = True
+        self._lock = threading.Lock()
+
+    def group(
+        self,
+        input_files: Iterable[str],
+        max_input_size: int = MICRO_BATCH_MAX_INPUT_SIZE,
+    ) -> Iterator[Tuple[str, ...]]:
+        """
+        Group consecutive inputs into tuples of up to 'size' files, keeping their order.
+
+        Inputs larger than 'max_input_size' (uncompressed) form groups of their
+        own, as do all inputs once micro-batching is turned off.
+        """
+        group: List[str] = []
+        for input_file in input_files:
+            if self.enabled and input_size(input_file) <= max_input_size:
+                group.append(input_file)
+                if len(group) == self.size:
+                    yield tuple(group)
+                    group = []
+                continue
+            if group:
+                yield tuple(group)
+                group = []
+            yield (input_file,)
+        if group:
+            yield tuple(group)
+
+    def runner_arguments(
+        self, arguments: List[str], input_path: str, timeouts: List[float | None]
+    ) -> Tuple[List[str], List[str]]:
+        """
+        Return the upload names of the inputs and the runner command.
+
+        Each input runs under 'timeout' with its own entry of 'timeouts', if
+        set, so a slow input times out alone instead of the whole request.
+        """
+        upload_names = [f"{_UPLOAD_PREFIX}{index}" for index in range(len(timeouts))]
+        lines = []
+        if any(timeout is not None for timeout in timeouts):
+            lines.append(f"command -v timeout >/dev/null 2>&1 || {unsupported_exit()}")
+        for index, upload_name in enumerate(upload_names):
+            target = posixpath.join(str(index), input_path)
+            lines.append(
+                f"mkdir -p {shlex.quote(posixpath.dirname(target))} "
+                f"&& mv -f {shlex.quote(upload_name)} {shlex.quote(target)} "
+                f"|| {unsupported_exit()}"
+            )
+        redirect = f'> "$d/{_STDOUT_FILE}" 2> "$d/{_STDERR_FILE}"'
+        lines.append(
+            'run() { d=$1; t=$2; shift 2; '
+            f'date +%s.%N > "$d/{_STATUS_FILE}"; '
+            'if [ -n "$t" ]; then '
+            f'(cd "$d" && exec timeout "$t" "$@") {redirect}; '
+            f'else (cd "$d" && exec "$@") {redirect}; fi; '
+            "code=$?; "
+            f'date +%s.%N >> "$d/{_STATUS_FILE}"; '
+            f'echo "$code" >> "$d/{_STATUS_FILE}"; }}'
+        )
+        lines.extend(
+            f"run {index} "
+            f"{shlex.quote('' if timeout is None else str(math.ceil(timeout)))} "
+            '"$@"'
+            for index, timeout in enumerate(timeouts)
+        )
+        return upload_names, ["sh", "-c", "\n".join(lines), "sh", *arguments]
+
+    def wire_output_names(self, output_names: List[str], count: int) -> List[str]:
+        """Return the names under which the outputs of all runs are requested."""
+        return [
+            posixpath.join(str(index), name)
+            for index in range(count)
+            for name in (*output_names, *_RUNNER_FILES)
+        ]
+
+    def is_unsupported(self, result: Dict[str, Any]) -> bool:
+        """
+        Check whether the runner failed because of the image.
+
+        If so, micro-batching is turned off for the remaining requests.
+        """
+        if not is_wrapper_failure(result):
+            return False
+        with self._lock:
+            if self.enabled:
+                self.enabled = False
+                print(
+                    "Warning: The tool image cannot run micro-batches, "
+                    "sending inputs one by one",
+                    file=sys.stderr,
+                )
+        return True
+
+
+def _parse_status(text: str) -> Tuple[int, float | None, float | None] | None:
+    """Return the exit code and start and end times of a run, if it finished."""
+    lines = text.split()
+    try:
+        exit_code = int(lines[-1])
+    except (IndexError, ValueError):
+        return None
+    times: List[float | None] = []
+    for line in lines[:-1][:2]:
+        try:
+            times.append(float(line))
+        except ValueError:
+            # 'date' without nanoseconds support
+            times.append(None)
+    times += [None] * (2 - len(times))
+    return exit_code, times[0], times[1]
+
+
+def process_micro_batch(
+    input_files: List[str],
+    config: Dict[str, Any],
+    args: argparse.Namespace,
+    session: requests.Session,
+    balancer: EndpointBalancer,
+    tool_name: str,
+    output_dir_base: str,
+    micro: MicroBatching,
+    process_single: Callable[[int], Dict[str, Any]],
+    cache: ResultCache | None = None,
+    costs: CostStore | None = None,
+    input_data: List[bytes | None] | None = None,
+    output_batches: List[OutputBatch | None] | None = None,
+) -> List[Dict[str, Any]]:
+    """
+    Process several input files in one request and return their results.
+
+    Outputs are saved to the same paths, and metadata built per input, as if
+    every input had been sent on its own. Cached inputs are restored without
+    being sent. Inputs the runner did not finish, e.g. because of an HTTP
+    error or a timeout of the whole request, are passed to
+    'process_single(index)', as are all inputs once the image turns out not
+    to support the runner.
+    """
+    full_arguments = config.get("arguments", [])
+    output_file_names = config.get("output_files", [])
+    input_path = config.get("input_file")
+    if input_data is None:
+        input_data = [None] * len(input_files)
+    if output_batches is None:
+        output_batches = [None] * len(input_files)
+
+    results: List[Dict[str, Any] | None] = [None] * len(input_files)
+    if not full_arguments or not input_path:
+        # Let the single-input path report the configuration error
+        return [process_single(index) for index in range(len(input_files))]
+
+    # Open the inputs, restoring cached results right away
+    pending: List[int] = []
+    file_objects: Dict[int, Any] = {}
+    cache_keys: Dict[int, str] = {}
+    for index, input_file in enumerate(input_files):
+        data = input_data[index]
+        try:
+            file_object = (
+                io.BytesIO(data)
+                if data is not None
+                else open_input_file(input_file, args)
+            )
+        except FileNotFoundError:
+            message = f"Input file {input_file} not found."
+            print(f"Error: {message}", file=sys.stderr)
+            results[index] = build_error_metadata(
+                full_arguments, output_file_names, stderr=message
+            )
+            continue
+        except Exception as e:
+            message = f"Error opening input file {input_file}: {e}"
+            print(message, file=sys.stderr)
+            results[index] = build_error_metadata(
+                full_arguments, output_file_names, stderr=message
+            )
+            continue
+
+        if cache is not None:
+            try:
+                cache_keys[index] = cache.key(hash_stream(file_object))
+                file_object.seek(0)
+            except Exception as e:
+                file_object.close()
+                message = f"Error reading input file {input_file}: {e}"
+                print(message, file=sys.stderr)
+                results[index] = build_error_metadata(
+                    full_arguments, output_file_names, stderr=message
+                )
+                continue
+            effective_output_dir, output_prefix = output_location(
+                input_file, args, tool_name, output_dir_base
+            )
+            cached_result = cache.restore(
+                cache_keys[index], effective_output_dir, output_prefix
+            )
+            if cached_result is not None:
+                file_object.close()
+                print(f"Using cached result for {input_file}", file=sys.stderr)
+                results[index] = cached_result
+                continue
+
+        file_objects[index] = file_object
+        pending.append(index)
+
+    if len(pending) < 2:
+        for file_object in file_objects.values():
+            file_object.close()
+        for index in pending:
+            results[index] = process_single(index)
+        return results  # type: ignore[return-value]
+
+    print(
+        f"Processing {len(pending)} file(s) in one request: "
+        + ", ".join(input_files[index] for index in pending),
+        file=sys.stderr,
+    )
+
+    # Every run enforces its own timeout; the runs are sequential, so the
+    # request only times out once all of them together should have finished
+    features: Dict[int, Dict[str, int]] = {}
+    timeouts: List[float | None] = []
+    for index in pending:
+        timeout = args.timeout
+        if uses_input_timeout(args):
+            try:
+                features[index] = read_input_features(
+                    input_files[index], args, input_data[index]
+                )
+                timeout = input_timeout(features[index], args, costs)
+            except (OSError, EOFError) as e:
+                print(
+                    f"Warning: Using --timeout for {input_files[index]}, "
+                    f"could not measure it: {e}",
+                    file=sys.stderr,
+                )
+        timeouts.append(timeout)
+    total_timeout = (
+        None
+        if None in timeouts
+        else sum(t for t in timeouts if t is not None)
+        + _RUN_OVERHEAD_SECONDS * len(timeouts)
+    )
+
+    upload_names, runner_arguments = micro.runner_arguments(
+        full_arguments, input_path, timeouts
+    )
+    files_to_upload: List[Tuple[str, Tuple[str, BinaryIO]]] = [
+        ("input_files", (upload_name, file_objects[index]))
+        for upload_name, index in zip(upload_names, pending)
+    ]
+    form_data = build_form_data(
+        runner_arguments,
+        micro.wire_output_names(output_file_names, len(pending)),
+        args,
+        total_timeout,
+    )
+
+    try:
+        try:
+            response = post_run_command(session, balancer, form_data, files_to_upload)
+        except (requests.RequestException, NoHealthyEndpointError) as e:
+            print(f"Error processing micro-batch: {e}", file=sys.stderr)
+            response = None
+    finally:
+        for file_object in file_objects.values():
+            file_object.close()
+
+    if response is not None and response.status_code != 200:
+        print(f"Error processing micro-batch: {response.text}", file=sys.stderr)
+        response.close()
+        response = None
+
+    # Route '{index}/{filename}' parts to the paths of the input they belong to
+    captures: List[Dict[str, _Capture]] = [
+        {name: _Capture() for name in _RUNNER_FILES} for _ in pending
+    ]
+    saved_files: List[Dict[str, str]] = [{} for _ in pending]
+    openers = []
+    for position, index in enumerate(pending):
+        effective_output_dir, output_prefix = output_location(
+            input_files[index], args, tool_name, output_dir_base
+        )
+        openers.append(
+            output_opener(
+                effective_output_dir,
+                output_prefix,
+                saved_files[position],
+                output_batches[index],
+            )
+        )
+
+    def open_output(filename: str) -> Any:
+        position, _, name = filename.partition("/")
+        if not position.isdigit() or int(position) >= len(pending):
+            return None
+        if name in _RUNNER_FILES:
+            return captures[int(position)][name]
+        return openers[int(position)](name)
+
+    batch_result: Dict[str, Any] = {}
+    if response is not None:
+        try:
+            batch_result = parse_multipart_stream(
+                response.iter_content(chunk_size=DEFAULT_CHUNK_SIZE),
+                response.headers.get("Content-Type"),
+                open_output,
+            ).metadata
+        except (requests.RequestException, IOError, ValueError) as e:
+            print(f"Error reading multipart response: {e}", file=sys.stderr)
+            batch_result = {}
+        finally:
+            response.close()
+
+    supported = bool(batch_result) and not micro.is_unsupported(batch_result)
+    wire_missing = set(batch_result.get("missing_files") or [])
+    for position, index in enumerate(pending):
+        input_file = input_files[index]
+        status = (
+            _parse_status(captures[position][_STATUS_FILE].text())
+            if supported
+            else None
+        )
+        output_batch = output_batches[index]
+        if status is None:
+            # Not run to the end, send the input on its own
+            if output_batch is not None:
+                output_batch.discard()
+            results[index] = process_single(index)
+            continue
+
+        exit_code, start_time, end_time = status
+        if exit_code == 0:
+            run_status: str = "COMPLETED"
+        elif exit_code == _TIMEOUT_EXIT_CODE and timeouts[position] is not None:
+            # Reported like a timeout of a request of its own
+            run_status, exit_code = "TIMEOUT", None
+        else:
+            run_status = "FAILED"
+        result: Dict[str, Any] = {
+            "status": run_status,
+            "http_code": batch_result.get("http_code"),
+            "http_message": batch_result.get("http_message"),
+            "exit_code": exit_code,
+            "missing_files": [
+                name
+                for name in output_file_names
+                if posixpath.join(str(position), name) in wire_missing
+            ],
+            "execution_stats": {
+                "start_time": start_time,
+                "end_time": end_time,
+                "duration_seconds": (
+                    end_time - start_time
+                    if start_time is not None and end_time is not None
+                    else None
+                ),
+                # Only measured for the request as a whole
+                "max_rss_kb": None,
+                "cpu_user_seconds": None,
+            },
+            "stdout": captures[position][_STDOUT_FILE].text(),
+            "stderr": captures[position][_STDERR_FILE].text(),
+            "command": full_arguments,
+        }
+
+        def store_result(
+            saved: Dict[str, str], result: Dict[str, Any] = result, index: int = index
+        ) -> None:
+            if (
+                cache is not None
+                and index in cache_keys
+                and is_complete_result(result, saved, output_file_names)
+            ):
+                cache.store(cache_keys[index], result, saved)
+
+        if output_batch is None:
+            for path in saved_files[position].values():
+                print(f"Saved output to: {path}", file=sys.stderr)
+            store_result(saved_files[position])
+        else:
+            output_batch.commit(store_result)
+
+        if costs is not None and result["status"] == "COMPLETED":
+            record_cost(
+                costs,
+                input_file,
+                args,
+                result,
+                input_data[index],
+                features.get(index),
+            )
+
+        report_result_status(result, input_file)
+        results[index] = result
+
+    return results  # type: ignore[return-value]
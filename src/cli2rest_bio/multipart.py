@@ -0,0 +1,294 @@
+"""Streaming multipart/form-data request encoder and response decoder."""
+
+import base64
+import json
+import mmap
+import os
+import uuid
+from email.message import Message
+from email.parser import BytesHeaderParser
+from typing import (
+    Any,
+    BinaryIO,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+# Smaller files are cheaper to copy than to map
+MMAP_MIN_SIZE = 256 * 1024
+
+
+def get_boundary(content_type: Optional[str]) -> bytes:
+    """Extract the multipart boundary from a Content-Type header value."""
+    message = Message()
+    message["Content-Type"] = content_type or ""
+    boundary = message.get_boundary()
+    if not boundary:
+        raise ValueError(f"No multipart boundary in Content-Type: {content_type!r}")
+    return boundary.encode("latin-1")
+
+
+class _Base64Writer:
+    """Incrementally decode base64 data into an underlying file object."""
+
+    def __init__(self, target: BinaryIO):
+        self.target = target
+        self.pending = b""
+
+    def write(self, data: bytes) -> None:
+        data = self.pending + b"".join(data.split())
+        usable = len(data) - len(data) % 4
+        self.pending = data[usable:]
+        if usable:
+            self.target.write(base64.b64decode(data[:usable]))
+
+    def close(self) -> None:
+        if self.pending:
+            self.target.write(base64.b64decode(self.pending))
+        self.target.close()
+
+
+class MultipartStreamParser:
+    """
+    Incremental multipart/form-data parser.
+
+    Data is fed in chunks via feed(). The 'metadata' part is buffered and parsed
+    as JSON, every part carrying a filename is written to the file object
+    returned by open_file(filename). At most one chunk plus the delimiter length
+    is held in memory at any time.
+    """
+
+    def __init__(
+        self,
+        boundary: bytes,
+        open_file: Callable[[str], Optional[BinaryIO]],
+    ):
+        self.open_file = open_file
+        self.delimiter = b"\r\n--" + boundary
+        # The first delimiter may appear without the leading CRLF
+        self.buffer = b"\r\n"
+        self.state = "preamble"
+        self.metadata: Dict[str, Any] = {}
+        self.saved_files: List[str] = []
+        self._part_name: Optional[str] = None
+        self._part_filename: Optional[str] = None
+        self._part_target: Any = None
+        self._metadata_chunks: List[bytes] = []
+
+    def feed(self, data: bytes) -> None:
+        """Consume the next chunk of the response body."""
+        self.buffer += data
+        while True:
+            if self.state == "preamble":
+                index = self.buffer.find(self.delimiter)
+                if index < 0:
+                    self.buffer = self.buffer[-len(self.delimiter) :]
+                    return
+                self.buffer = self.buffer[index + len(self.delimiter) :]
+                self.state = "after_delimiter"
+            elif self.state == "after_delimiter":
+                if len(self.buffer) < 2:
+                    return
+                if self.buffer.startswith(b"--"):
+                    self.state = "epilogue"
+                    self.buffer = b""
+                    return
+                line_end = self.buffer.find(b"\r\n")
+                if line_end < 0:
+                    return
+                self.buffer = self.buffer[line_end + 2 :]
+                self.state = "headers"
+            elif self.state == "headers":
+                index = self.buffer.find(b"\r\n\r\n")
+                if index < 0:
+                    if self.buffer.startswith(b"\r\n"):
+                        # Part without any headers
+                        self._start_part(b"")
+                        self.buffer = self.buffer[2:]
+                        self.state = "body"
+                        continue
+                    return
+                self._start_part(self.buffer[:index])
+                self.buffer = self.buffer[index + 4 :]
+                self.state = "body"
+            elif self.state == "body":
+                index = self.buffer.find(self.delimiter)
+                if index < 0:
+                    # Keep enough bytes to detect a delimiter split across chunks
+                    keep = len(self.delimiter) - 1
+                    if len(self.buffer) > keep:
+                        self._write_part(self.buffer[:-keep])
+                        self.buffer = self.buffer[-keep:]
+                    return
+                self._write_part(self.buffer[:index])
+                self._finish_part()
+                self.buffer = self.buffer[index + len(self.delimiter) :]
+                self.state = "after_delimiter"
+            else:
+                self.buffer = b""
+                return
+
+    def close(self) -> None:
+        """Finish parsing; raises ValueError if the body was truncated."""
+        if self.state == "body":
+            self._finish_part()
+        if self.state != "epilogue":
+            raise ValueError("Truncated multipart response")
+
+    def abort(self) -> None:
+        """Close the file object of a partially written part, if any."""
+        if self._part_target is not None:
+            self._part_target.close()
+            self._part_target = None
+
+    def _start_part(self, raw_headers: bytes) -> None:
+        headers = BytesHeaderParser().parsebytes(raw_headers + b"\r\n\r\n")
+        self._part_name = headers.get_param("name", header="content-disposition")
+        self._part_filename = headers.get_filename()
+        self._part_target = None
+        self._metadata_chunks = []
+
+        if self._part_filename is not None:
+            target = self.open_file(self._part_filename)
+            if target is not None:
+                encoding = headers.get("Content-Transfer-Encoding", "").lower()
+                if encoding == "base64":
+                    target = _Base64Writer(target)
+                self._part_target = target
+
+    def _write_part(self, data: bytes) -> None:
+        if not data:
+            return
+        if self._part_target is not None:
+            self._part_target.write(data)
+        elif self._part_filename is None and self._part_name == "metadata":
+            self._metadata_chunks.append(data)
+
+    def _finish_part(self) -> None:
+        if self._part_target is not None:
+            self._part_target.close()
+            self.saved_files.append(str(self._part_filename))
+        elif self._part_filename is None and self._part_name == "metadata":
+            self.metadata = json.loads(b"".join(self._metadata_chunks).decode("utf-8"))
+        self._part_target = None
+        self._metadata_chunks = []
+
+
+def parse_multipart_stream(
+    chunks: Iterable[bytes],
+    content_type: Optional[str],
+    open_file: Callable[[str], Optional[BinaryIO]],
+) -> MultipartStreamParser:
+    """Feed an iterable of body chunks through a MultipartStreamParser."""
+    parser = MultipartStreamParser(get_boundary(content_type), open_file)
+    try:
+        for chunk in chunks:
+            parser.feed(chunk)
+        parser.close()
+    except Exception:
+        parser.abort()
+        raise
+    return parser
+
+
+class MappedFile:
+    """
+    A read-only memory map of an open file, uploaded without copying.
+
+    Its contents are handed to the socket as a memoryview of the mapping, so the
+    kernel reads them straight from the page cache instead of Python reading
+    them into bytes objects first.
+    """
+
+    def __init__(self, file_object: BinaryIO):
+        """Map 'file_object', which must be a regular, non-empty file."""
+        self.file_object = file_object
+        self.size = os.fstat(file_object.fileno()).st_size
+        self.mapping = mmap.mmap(file_object.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def view(self) -> memoryview:
+        """Return a view of the whole file."""
+        return memoryview(self.mapping)
+
+    def seek(self, offset: int) -> None:
+        """Accept rewinds before a retry; the mapping is always read whole."""
+
+    def close(self) -> None:
+        try:
+            self.mapping.close()
+        except BufferError:
+            # A view of an interrupted upload is still alive; the mapping is
+            # released together with it
+            pass
+        self.file_object.close()
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"')
+
+
+class MultipartBody:
+    """
+    A multipart/form-data request body streamed part by part.
+
+    'fields' maps form field names to a string or a sequence of strings, each
+    becoming its own part, like the 'data' argument of requests. 'files' lists
+    (field name, filename, contents) triples. The length is known up front, so
+    the body is sent with a Content-Length, and it can be iterated again when a
+    request is retried.
+    """
+
+    def __init__(
+        self,
+        fields: Dict[str, Any],
+        files: List[Tuple[str, str, Union[bytes, MappedFile]]],
+    ):
+        self.boundary = uuid.uuid4().hex
+        self.content_type = f"multipart/form-data; boundary={self.boundary}"
+        self._parts: List[Tuple[bytes, Union[bytes, MappedFile]]] = []
+        for name, values in fields.items():
+            if isinstance(values, (str, bytes)):
+                values = [values]
+            for value in values:
+                data = value.encode("utf-8") if isinstance(value, str) else value
+                self._parts.append((self._header(name), data))
+        for name, filename, contents in files:
+            self._parts.append((self._header(name, filename), contents))
+        self._trailer = f"--{self.boundary}--\r\n".encode("ascii")
+
+    def _header(self, name: str, filename: str | None = None) -> bytes:
+        disposition = f'form-data; name="{_escape(name)}"'
+        if filename is not None:
+            disposition += f'; filename="{_escape(filename)}"'
+        return (
+            f"--{self.boundary}\r\nContent-Disposition: {disposition}\r\n\r\n"
+        ).encode("utf-8")
+
+    def __len__(self) -> int:
+        total = len(self._trailer)
+        for header, contents in self._parts:
+            size = contents.size if isinstance(contents, MappedFile) else len(contents)
+            total += len(header) + size + 2
+        return total
+
+    def __iter__(self) -> Iterator[Union[bytes, memoryview]]:
+        for header, contents in self._parts:
+            yield header
+            if isinstance(contents, MappedFile):
+                view = contents.view()
+                try:
+                    yield view
+                finally:
+                    # The mapping cannot be closed while a view is exported
+                    view.release()
+            else:
+                yield contents
+            yield b"\r\n"
+        yield self._trailer
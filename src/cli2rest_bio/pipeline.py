@@ -0,0 +1,470 @@
+"""Runs of several tool configurations per input, chained or side by side."""
+
+import argparse
+import functools
+import os
+import shutil
+import sys
+import tempfile
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List
+
+import requests
+
+from .balancer import EndpointBalancer
+from .cli2rest_bio import (
+    ContainerStartError,
+    ToolContainers,
+    create_session,
+    input_cost,
+    load_tool_config,
+    open_input_file,
+    open_result_cache,
+    output_location,
+    process_file,
+    read_api_urls,
+    run_inputs,
+    start_tool_containers,
+    with_startup_time,
+)
+from .costmodel import open_cost_store
+from .metadata import MetadataSink, NdjsonMetadataSink
+
+# Keep intermediate files in memory when a tmpfs is available
+DEFAULT_SCRATCH_DIR = "/dev/shm" if os.access("/dev/shm", os.W_OK) else None
+
+
+class ToolStage:
+    """One tool of a multi-tool run and the endpoints serving it."""
+
+    def __init__(
+        self,
+        config: Dict[str, Any],
+        input_name: str | None,
+        save_outputs: bool,
+        api_urls: List[str] | None,
+    ):
+        self.config = config
+        self.tool_name: str = config["name"]
+        self.input_name = input_name
+        self.save_outputs = save_outputs
+        self.api_urls = api_urls
+        self.balancer: EndpointBalancer | None = None
+        self.cache: Any = None
+        self.costs: Any = None
+
+
+def load_pipeline(pipeline_config: Dict[str, Any]) -> List[ToolStage]:
+    """
+    Load the tool configurations of a pipeline and validate how they connect.
+
+    Each entry of 'stages' names a tool 'config'. Every stage after the first
+    takes as its 'input' one of the 'output_files' of the previous stage; it may
+    be omitted when the previous stage has a single output. A stage may set
+    'save_outputs' to keep its intermediate outputs, and 'api_url' to use a
+    running server instead of a container.
+    """
+    stages: List[ToolStage] = []
+    for index, spec in enumerate(pipeline_config["stages"]):
+        if not isinstance(spec, dict) or "config" not in spec:
+            print(
+                f"Error: Pipeline stage {index + 1} must contain a 'config' field",
+                file=sys.stderr,
+            )
+            sys.exit(1)
+
+        config = load_tool_config(spec["config"])
+        if config.get("input_files"):
+            print(
+                f"Error: Pipeline stage {index + 1} ({config['name']}) is a batch configuration, which cannot be chained",
+                file=sys.stderr,
+            )
+            sys.exit(1)
+
+        input_name = spec.get("input")
+        if stages:
+            previous_outputs = stages[-1].config.get("output_files", [])
+            if input_name is None and len(previous_outputs) == 1:
+                input_name = previous_outputs[0]
+            if input_name not in previous_outputs:
+                print(
+                    f"Error: Pipeline stage {index + 1} ({config['name']}) must take as 'input' one of the outputs of {stages[-1].tool_name}: {', '.join(previous_outputs)}",
+                    file=sys.stderr,
+                )
+                sys.exit(1)
+
+        api_url = spec.get("api_url")
+        stages.append(
+            ToolStage(
+                config,
+                input_name,
+                bool(spec.get("save_outputs", False)),
+                read_api_urls([api_url], None) if api_url else None,
+            )
+        )
+
+    if not stages:
+        print("Error: Pipeline has no stages", file=sys.stderr)
+        sys.exit(1)
+    return stages
+
+
+def process_pipeline_file(
+    input_file: str,
+    stages: List[ToolStage],
+    args: argparse.Namespace,
+    session: requests.Session,
+    scratch_dir: str | None,
+) -> Dict[str, Any]:
+    """
+    Run one input file through every stage of a pipeline.
+
+    A stage is submitted as soon as the previous one returned, with the chosen
+    output of the previous stage as its input. Intermediate outputs are kept in
+    a scratch directory, preferably on a tmpfs, and removed afterwards. Output
+    file names use the name of the original input. The result holds the
+    metadata of every stage that ran and the status of the last one.
+    """
+    input_base = os.path.splitext(os.path.basename(input_file))[0]
+    final_output_dir = args.output_dir or os.path.dirname(os.path.abspath(input_file))
+    work_dir = tempfile.mkdtemp(prefix="cli2rest-bio-", dir=scratch_dir)
+    stage_results: List[Dict[str, Any]] = []
+    result: Dict[str, Any] = {}
+
+    try:
+        current_input = input_file
+        for index, stage in enumerate(stages):
+            is_last = index == len(stages) - 1
+            if is_last or stage.save_outputs:
+                stage_output_dir = final_output_dir
+            else:
+                stage_output_dir = os.path.join(work_dir, str(index))
+
+            assert stage.balancer is not None
+            stage_result = process_file(
+                current_input,
+                stage.config,
+                args,
+                session,
+                stage.balancer,
+                stage.tool_name,
+                stage_output_dir,
+                stage.cache,
+                input_base=input_base,
+                costs=stage.costs,
+            )
+            stage_results.append({"stage": stage.tool_name, **stage_result})
+            result = {"status": stage_result.get("status")}
+            if stage_result.get("status") != "COMPLETED" or is_last:
+                break
+
+            next_input_name = stages[index + 1].input_name
+            _, output_prefix = output_location(
+                current_input, args, stage.tool_name, stage_output_dir, input_base
+            )
+            current_input = os.path.join(
+                stage_output_dir, f"{output_prefix}{next_input_name}"
+            )
+            if not os.path.isfile(current_input):
+                message = f"Stage {stage.tool_name} did not produce {next_input_name}"
+                print(f"Error: {message} for {input_file}", file=sys.stderr)
+                result = {"status": "CLI2REST-FAILED", "stderr": message}
+                break
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {**result, "stages": stage_results}
+
+
+def start_stage_endpoints(
+    stages: List[ToolStage], args: argparse.Namespace
+) -> List[ToolContainers]:
+    """
+    Start or lease containers for every stage without an 'api_url'.
+
+    Images are started concurrently and stages using the same image share its
+    containers. If any image fails to start, the others are released before
+    the error is raised.
+    """
+    images: List[str] = []
+    for stage in stages:
+        if stage.api_urls is None and stage.config["docker_image"] not in images:
+            images.append(stage.config["docker_image"])
+
+    started: Dict[str, ToolContainers] = {}
+    error: Exception | None = None
+    with ThreadPoolExecutor(max_workers=max(len(images), 1)) as executor:
+        futures = {
+            image: executor.submit(start_tool_containers, image, args)
+            for image in images
+        }
+        for image, future in futures.items():
+            try:
+                started[image] = future.result()
+            except Exception as e:
+                error = error or e
+
+    if error is not None:
+        for tool_containers in started.values():
+            tool_containers.release()
+        raise error
+
+    for stage in stages:
+        if stage.api_urls is not None:
+            for base_url in stage.api_urls:
+                print(
+                    f"Using external API at: {base_url} for {stage.tool_name}",
+                    file=sys.stderr,
+                )
+            stage.balancer = EndpointBalancer(stage.api_urls)
+            image_digest = stage.config["docker_image"]
+        else:
+            tool_containers = started[stage.config["docker_image"]]
+            stage.balancer = EndpointBalancer(tool_containers.base_urls)
+            image_digest = tool_containers.image_id or stage.config["docker_image"]
+        stage.cache = open_result_cache(
+            stage.config, args, image_digest, remote=stage.api_urls is not None
+        )
+        stage.costs = open_cost_store(
+            stage.config, None if args.no_cost_model else args.cost_dir
+        )
+
+    return list(started.values())
+
+
+def run_stages(
+    stages: List[ToolStage],
+    input_files: Iterable[str],
+    args: argparse.Namespace,
+    process: Callable[..., Dict[str, Any]],
+) -> int:
+    """
+    Process input files with several tools and return the exit code.
+
+    Endpoints of all stages are set up first. Then process(input_file,
+    stages=..., args=..., session=...) is run for up to --threads inputs at
+    once, and its results are written to --output-metadata.
+    """
+    try:
+        started = start_stage_endpoints(stages, args)
+    except ContainerStartError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    startup_seconds = max(
+        (tool_containers.startup_seconds for tool_containers in started),
+        default=None,
+    )
+
+    session = create_session(
+        pool_size=args.threads or 1,
+        retries=args.retries,
+        backoff=args.retry_backoff,
+        hosts=sum(len(stage.balancer.base_urls) for stage in stages if stage.balancer),
+    )
+    metadata_sink = (
+        NdjsonMetadataSink(args.output_metadata, args.metadata_fsync_batch)
+        if args.metadata_format == "ndjson"
+        else MetadataSink(args.output_metadata)
+    )
+    process_one = functools.partial(process, stages=stages, args=args, session=session)
+
+    try:
+        with ThreadPoolExecutor(max_workers=args.threads) as executor:
+            for input_file, result in run_inputs(
+                executor,
+                process_one,
+                input_files,
+                args,
+                # Later pipeline stages take intermediate files, not the input
+                cost=input_cost(
+                    stage.costs for stage in stages if stage.input_name is None
+                ),
+            ):
+                metadata_sink.add(
+                    input_file, with_startup_time(result, startup_seconds)
+                )
+    finally:
+        metadata_sink.close()
+        session.close()
+        for tool_containers in started:
+            tool_containers.release()
+
+    if metadata_sink.count == 0:
+        print("Error: No input files found", file=sys.stderr)
+        return 1
+    return 1 if metadata_sink.failed else 0
+
+
+def check_multi_tool_arguments(
+    args: argparse.Namespace, allow_api_url: bool = False
+) -> bool:
+    """Reject or warn about options which do not apply to multi-tool runs."""
+    if args.api_url_file or (args.api_url and not allow_api_url):
+        print(
+            "Error: --api-url and --api-url-file cannot be used with a pipeline, set 'api_url' on its stages instead",
+            file=sys.stderr,
+        )
+        return False
+    if args.engine != "threads" or args.resume:
+        print(
+            "Warning: --engine asyncio and --resume are ignored with several tools",
+            file=sys.stderr,
+        )
+    return True
+
+
+def run_pipeline(
+    pipeline_config: Dict[str, Any],
+    input_files: Iterable[str],
+    args: argparse.Namespace,
+) -> int:
+    """
+    Run input files through a pipeline configuration and return the exit code.
+
+    Inputs are processed by up to --threads workers, each taking one input
+    through all stages, so different inputs occupy different stages at once.
+    """
+    if not check_multi_tool_arguments(args):
+        return 1
+
+    stages = load_pipeline(pipeline_config)
+    print(
+        f"Pipeline: {' -> '.join(stage.tool_name for stage in stages)}",
+        file=sys.stderr,
+    )
+    return run_stages(
+        stages,
+        input_files,
+        args,
+        functools.partial(process_pipeline_file, scratch_dir=DEFAULT_SCRATCH_DIR),
+    )
+
+
+def process_fanout_file(
+    input_file: str,
+    stages: List[ToolStage],
+    args: argparse.Namespace,
+    session: requests.Session,
+    tool_executor: Executor,
+) -> Dict[str, Any]:
+    """
+    Run one input file through every tool concurrently.
+
+    The input is read, and decompressed if needed, only once; every tool
+    request uploads the same bytes from memory. The result maps each tool name
+    to its metadata, and its status is COMPLETED only when every tool completed.
+    """
+    try:
+        with open_input_file(input_file, args) as file_object:
+            input_data = file_object.read()
+    except FileNotFoundError:
+        message = f"Input file {input_file} not found."
+        print(f"Error: {message}", file=sys.stderr)
+        return {"status": "CLI2REST-FAILED", "stderr": message, "tools": {}}
+    except Exception as e:
+        message = f"Error reading input file {input_file}: {e}"
+        print(message, file=sys.stderr)
+        return {"status": "CLI2REST-FAILED", "stderr": message, "tools": {}}
+
+    futures = {
+        stage.tool_name: tool_executor.submit(
+            process_file,
+            input_file,
+            stage.config,
+            args,
+            session,
+            stage.balancer,
+            stage.tool_name,
+            args.output_dir,
+            stage.cache,
+            input_data=input_data,
+            costs=stage.costs,
+        )
+        for stage in stages
+    }
+    tools = {tool_name: future.result() for tool_name, future in futures.items()}
+
+    # Report the status of the first tool which did not complete
+    status = next(
+        (
+            result.get("status")
+            for result in tools.values()
+            if result.get("status") != "COMPLETED"
+        ),
+        "COMPLETED",
+    )
+    return {"status": status, "tools": tools}
+
+
+def read_tool_api_urls(
+    api_urls: List[str] | None, tool_names: List[str]
+) -> Dict[str, List[str]] | None:
+    """
+    Map tool names to the endpoints given as --api-url TOOL=URL[,URL...].
+
+    Tools without an endpoint are run in containers. Returns None after
+    printing an error if a value does not name one of the tools.
+    """
+    tool_urls: Dict[str, List[str]] = {}
+    for value in api_urls or []:
+        tool_name, separator, urls = value.partition("=")
+        if not separator or tool_name not in tool_names:
+            print(
+                f"Error: With several tools, --api-url must be given as TOOL=URL where TOOL is one of: {', '.join(tool_names)}",
+                file=sys.stderr,
+            )
+            return None
+        tool_urls.setdefault(tool_name, []).extend(read_api_urls([urls], None))
+    return tool_urls
+
+
+def run_fanout(
+    configs: List[Dict[str, Any]],
+    input_files: Iterable[str],
+    args: argparse.Namespace,
+) -> int:
+    """
+    Run several tool configurations against the same input files.
+
+    Up to --threads inputs are in flight, and each one is sent to all tools at
+    once. Output files keep each tool's own prefix, and every metadata record
+    holds one entry per tool under 'tools'. Tools named in --api-url TOOL=URL
+    use those servers, the others run in containers.
+    """
+    if not check_multi_tool_arguments(args, allow_api_url=True):
+        return 1
+    tool_urls = read_tool_api_urls(
+        args.api_url, [config["name"] for config in configs]
+    )
+    if tool_urls is None:
+        return 1
+
+    stages: List[ToolStage] = []
+    for config in configs:
+        if config.get("input_files") or config.get("stages"):
+            print(
+                f"Error: {config['name']} is a batch or pipeline configuration, which cannot be combined with other tools",
+                file=sys.stderr,
+            )
+            return 1
+        if any(stage.tool_name == config["name"] for stage in stages):
+            print(
+                f"Error: Several configurations are named '{config['name']}', their outputs would collide",
+                file=sys.stderr,
+            )
+            return 1
+        stages.append(ToolStage(config, None, True, tool_urls.get(config["name"])))
+
+    print(
+        f"Running tools: {', '.join(stage.tool_name for stage in stages)}",
+        file=sys.stderr,
+    )
+    with ThreadPoolExecutor(
+        max_workers=(args.threads or 1) * len(stages)
+    ) as tool_executor:
+        return run_stages(
+            stages,
+            input_files,
+            args,
+            functools.partial(process_fanout_file, tool_executor=tool_executor),
+        )
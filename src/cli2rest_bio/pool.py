@@ -0,0 +1,609 @@
+"""Warm pool of tool containers shared across CLI invocations."""
+
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Tuple
+
+import docker
+import docker.errors
+import docker.models.containers
+import requests
+
+from .cache import DEFAULT_CACHE_DIR
+from .cli2rest_bio import (
+    DEFAULT_IMAGE_LOCK,
+    DEFAULT_STARTUP_TIMEOUT,
+    load_tool_config,
+    positive_float,
+    positive_int,
+    pull_docker_image,
+    start_docker_containers,
+    stop_docker_containers,
+)
+from .images import pinned_image
+
+DEFAULT_STATE_FILE = os.path.join(DEFAULT_CACHE_DIR, "pool.json")
+DEFAULT_LOG_FILE = os.path.join(DEFAULT_CACHE_DIR, "pool.log")
+DEFAULT_IDLE_TIMEOUT = 600.0
+POOL_LABEL = "cli2rest-bio.pool"
+STARTUP_TIMEOUT = 30.0
+
+
+def pool_id(state_file: str = DEFAULT_STATE_FILE) -> str:
+    """
+    Identify the pools of this user and state file.
+
+    Containers are labelled with it, so stopping a pool never touches those of
+    another user or of a pool kept in another state file.
+    """
+    key = f"{os.getuid()}:{os.path.abspath(state_file)}"
+    return hashlib.sha256(key.encode()).hexdigest()[:16]
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _manager_alive(container: docker.models.containers.Container) -> bool:
+    try:
+        return _pid_alive(int(container.labels[f"{POOL_LABEL}.pid"]))
+    except (KeyError, ValueError):
+        return True
+
+
+class _PoolEntry:
+    """Warm containers of one Docker image and the leases held on them."""
+
+    def __init__(self, image: str):
+        self.image = image
+        self.image_id: str | None = None
+        self.containers: List[Tuple[docker.models.containers.Container, str]] = []
+        self.leases: Dict[str, int] = {}
+        self.last_used = time.monotonic()
+        # Held while containers are started, so concurrent clients share them
+        self.lock = threading.Lock()
+
+    def base_urls(self) -> List[str]:
+        return [f"http://localhost:{port}" for _, port in self.containers]
+
+
+class ContainerPool:
+    """
+    Keep started containers running between CLI invocations.
+
+    Clients lease the containers of an image for the duration of a run. Once an
+    image has had no leases for 'idle_timeout' seconds its containers are
+    stopped. Leases of client processes which died without releasing them are
+    dropped, so a crashed run does not pin containers forever.
+
+    Images pinned in 'image_lock' are run and keyed by digest, as the CLI
+    does, so a lease by name and one by digest share the same containers.
+    Containers are labelled with 'pool_id' and the manager's process ID.
+    """
+
+    def __init__(
+        self,
+        idle_timeout: float,
+        image_lock: str | None = None,
+        pool_id: str = "",
+    ):
+        self.idle_timeout = idle_timeout
+        self.image_lock = image_lock
+        self.pool_id = pool_id
+        self.entries: Dict[str, _PoolEntry] = {}
+        self._lock = threading.Lock()
+
+    def _entry(self, image: str) -> _PoolEntry:
+        with self._lock:
+            if image not in self.entries:
+                self.entries[image] = _PoolEntry(image)
+            return self.entries[image]
+
+    def acquire(
+        self,
+        image: str,
+        count: int,
+        pid: int,
+        startup_timeout: float = DEFAULT_STARTUP_TIMEOUT,
+    ) -> Dict[str, Any]:
+        """
+        Lease all running containers of an image, starting at least 'count'.
+
+        The reply includes the seconds the containers started for this lease
+        took to become ready, which is zero when warm ones were available.
+        """
+        image = pinned_image(image, self.image_lock)
+        entry = self._entry(image)
+        with entry.lock:
+            running = []
+            for container, port in entry.containers:
+                try:
+                    container.reload()
+                except docker.errors.NotFound:
+                    continue
+                if container.status == "running":
+                    running.append((container, port))
+                else:
+                    stop_docker_containers([container])
+            entry.containers = running
+
+            startup_seconds = 0.0
+            if len(entry.containers) < count:
+                labels = {
+                    POOL_LABEL: "1",
+                    f"{POOL_LABEL}.id": self.pool_id,
+                    f"{POOL_LABEL}.pid": str(os.getpid()),
+                    f"{POOL_LABEL}.image": image,
+                }
+                started = start_docker_containers(
+                    image, count - len(entry.containers), labels, startup_timeout
+                )
+                for container, port, ready_seconds in started:
+                    entry.containers.append((container, port))
+                    startup_seconds = max(startup_seconds, ready_seconds)
+                entry.image_id = str(entry.containers[0][0].image.id)
+
+            lease = uuid.uuid4().hex
+            entry.leases[lease] = pid
+            entry.last_used = time.monotonic()
+            return {
+                "image": image,
+                "lease": lease,
+                "base_urls": entry.base_urls(),
+                "image_id": entry.image_id,
+                "startup_seconds": startup_seconds,
+            }
+
+    def release(self, image: str, lease: str) -> None:
+        """Return a lease, starting the idle timer once none are left."""
+        with self._lock:
+            entry = self.entries.get(image)
+        if entry is None:
+            return
+        with entry.lock:
+            entry.leases.pop(lease, None)
+            entry.last_used = time.monotonic()
+
+    def evict_idle(self) -> None:
+        """Stop the containers of images that were idle for too long."""
+        with self._lock:
+            entries = list(self.entries.values())
+
+        for entry in entries:
+            if not entry.lock.acquire(blocking=False):
+                continue  # Containers are being started
+            try:
+                for lease, pid in list(entry.leases.items()):
+                    if not _pid_alive(pid):
+                        del entry.leases[lease]
+                        entry.last_used = time.monotonic()
+                idle = time.monotonic() - entry.last_used
+                if entry.leases or not entry.containers or idle < self.idle_timeout:
+                    continue
+                print(
+                    f"Evicting {len(entry.containers)} idle container(s) of {entry.image}",
+                    file=sys.stderr,
+                )
+                stop_docker_containers([container for container, _ in entry.containers])
+                entry.containers = []
+            finally:
+                entry.lock.release()
+
+    def status(self) -> Dict[str, Any]:
+        """Describe the pooled containers of every image."""
+        with self._lock:
+            entries = list(self.entries.values())
+        now = time.monotonic()
+        return {
+            "pid": os.getpid(),
+            "idle_timeout": self.idle_timeout,
+            "images": [
+                {
+                    "image": entry.image,
+                    "image_id": entry.image_id,
+                    "base_urls": entry.base_urls(),
+                    "leases": len(entry.leases),
+                    "idle_seconds": 0.0 if entry.leases else now - entry.last_used,
+                }
+                for entry in entries
+                if entry.containers
+            ],
+        }
+
+    def shutdown(self) -> None:
+        """Stop every pooled container."""
+        with self._lock:
+            entries = list(self.entries.values())
+            self.entries = {}
+        stop_docker_containers(
+            [container for entry in entries for container, _ in entry.containers]
+        )
+
+
+def _auth_headers(token: str) -> Dict[str, str]:
+    return {"Authorization": f"Bearer {token}"}
+
+
+def _make_handler(pool: ContainerPool, server_stop: threading.Event, token: str):
+    expected = f"Bearer {token}".encode("utf-8")
+
+    class PoolRequestHandler(BaseHTTPRequestHandler):
+        def _authorized(self) -> bool:
+            # Any local user can connect, only those able to read the state
+            # file know the token
+            given = (self.headers.get("Authorization") or "").encode("utf-8")
+            if hmac.compare_digest(given, expected):
+                return True
+            self._reply(401, {"error": "Unauthorized"})
+            return False
+
+        def _reply(self, status: int, body: Dict[str, Any]) -> None:
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self) -> None:
+            if not self._authorized():
+                return
+            if self.path == "/status":
+                self._reply(200, pool.status())
+            else:
+                self._reply(404, {"error": "Not found"})
+
+        def do_POST(self) -> None:
+            if not self._authorized():
+                return
+            length = int(self.headers.get("Content-Length") or 0)
+            try:
+                body = json.loads(self.rfile.read(length) or b"{}")
+                if self.path == "/acquire":
+                    self._reply(
+                        200,
+                        pool.acquire(
+                            body["image"],
+                            int(body.get("count", 1)),
+                            int(body["pid"]),
+                            float(
+                                body.get("startup_timeout", DEFAULT_STARTUP_TIMEOUT)
+                            ),
+                        ),
+                    )
+                elif self.path == "/release":
+                    pool.release(body["image"], body["lease"])
+                    self._reply(200, {})
+                elif self.path == "/shutdown":
+                    self._reply(200, {})
+                    server_stop.set()
+                else:
+                    self._reply(404, {"error": "Not found"})
+            except (ValueError, KeyError) as e:
+                self._reply(400, {"error": f"Invalid request: {e}"})
+            except Exception as e:
+                self._reply(500, {"error": str(e)})
+
+        def log_message(self, format: str, *args: Any) -> None:
+            pass
+
+    return PoolRequestHandler
+
+
+def serve(
+    idle_timeout: float,
+    image_lock: str | None = DEFAULT_IMAGE_LOCK,
+    state_file: str = DEFAULT_STATE_FILE,
+) -> None:
+    """Run the pool manager in the foreground until it is told to stop."""
+    pool = ContainerPool(idle_timeout, image_lock, pool_id(state_file))
+    server_stop = threading.Event()
+    token = secrets.token_hex(16)
+    server = ThreadingHTTPServer(
+        ("127.0.0.1", 0), _make_handler(pool, server_stop, token)
+    )
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    # Publish the address and token atomically, clients poll for this file.
+    # Only the owner may read it and so talk to the pool.
+    os.makedirs(os.path.dirname(state_file), exist_ok=True)
+    tmp_state_file = f"{state_file}.{os.getpid()}.tmp"
+    fd = os.open(tmp_state_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        json.dump(
+            {
+                "pid": os.getpid(),
+                "url": f"http://127.0.0.1:{server.server_port}",
+                "token": token,
+            },
+            f,
+        )
+    os.replace(tmp_state_file, state_file)
+    print(f"Pool manager listening on port {server.server_port}", file=sys.stderr)
+
+    try:
+        while not server_stop.wait(min(idle_timeout / 4, 30.0)):
+            pool.evict_idle()
+    finally:
+        server.shutdown()
+        pool.shutdown()
+        try:
+            os.remove(state_file)
+        except OSError:
+            pass
+        print("Pool manager stopped", file=sys.stderr)
+
+
+def find_pool(state_file: str = DEFAULT_STATE_FILE) -> Tuple[str, str] | None:
+    """
+    Return the URL and access token of the running pool manager, or None if
+    there is none.
+    """
+    try:
+        with open(state_file, "r") as f:
+            state = json.load(f)
+        if _pid_alive(int(state["pid"])):
+            return str(state["url"]), str(state["token"])
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    return None
+
+
+class PoolLease:
+    """Containers of one image leased from the pool manager for a run."""
+
+    def __init__(
+        self, pool_url: str, token: str, image: str, reply: Dict[str, Any]
+    ):
+        self.pool_url = pool_url
+        self.token = token
+        # The pool may have resolved the image to its pinned digest
+        self.image = reply.get("image", image)
+        self.lease = reply["lease"]
+        self.base_urls: List[str] = list(reply["base_urls"])
+        self.image_id: str | None = reply.get("image_id")
+        self.startup_seconds: float = reply.get("startup_seconds", 0.0)
+
+    def release(self) -> None:
+        """Hand the containers back to the pool, which keeps them running."""
+        try:
+            requests.post(
+                f"{self.pool_url}/release",
+                json={"image": self.image, "lease": self.lease},
+                headers=_auth_headers(self.token),
+                timeout=5,
+            )
+        except requests.RequestException as e:
+            print(f"Warning: Could not release pooled containers: {e}", file=sys.stderr)
+
+
+def attach(
+    docker_image: str,
+    count: int,
+    startup_timeout: float = DEFAULT_STARTUP_TIMEOUT,
+) -> PoolLease | None:
+    """
+    Lease warm containers from a running pool manager.
+
+    Returns None when no pool is running or it cannot provide containers, in
+    which case the caller starts its own.
+    """
+    pool = find_pool()
+    if pool is None:
+        return None
+    pool_url, token = pool
+
+    print(f"Attaching to container pool at {pool_url}...", file=sys.stderr)
+    try:
+        # Starting cold containers may take a while, only bound the connect
+        response = requests.post(
+            f"{pool_url}/acquire",
+            json={
+                "image": docker_image,
+                "count": count,
+                "pid": os.getpid(),
+                "startup_timeout": startup_timeout,
+            },
+            headers=_auth_headers(token),
+            timeout=(5, None),
+        )
+        reply = response.json()
+        if response.status_code != 200:
+            raise RuntimeError(reply.get("error"))
+        lease = PoolLease(pool_url, token, docker_image, reply)
+    except (requests.RequestException, ValueError, KeyError, RuntimeError) as e:
+        print(f"Warning: Container pool unavailable: {e}", file=sys.stderr)
+        return None
+
+    for base_url in lease.base_urls:
+        print(f"Using pooled container at: {base_url}", file=sys.stderr)
+    return lease
+
+
+def start_pool(
+    idle_timeout: float,
+    warm: List[str],
+    count: int,
+    image_lock: str = DEFAULT_IMAGE_LOCK,
+) -> None:
+    """
+    Start the pool manager in the background and optionally warm it up.
+
+    Warmed images are resolved through 'image_lock' like those of a run, so
+    the run finds the containers under the same key.
+    """
+    if find_pool() is not None:
+        print("Pool manager is already running", file=sys.stderr)
+    else:
+        os.makedirs(os.path.dirname(DEFAULT_LOG_FILE), exist_ok=True)
+        with open(DEFAULT_LOG_FILE, "a") as log:
+            subprocess.Popen(
+                [
+                    sys.executable,
+                    "-m",
+                    "cli2rest_bio.pool",
+                    "serve",
+                    "--idle-timeout",
+                    str(idle_timeout),
+                    "--image-lock",
+                    image_lock,
+                ],
+                stdin=subprocess.DEVNULL,
+                stdout=log,
+                stderr=log,
+                start_new_session=True,
+            )
+
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while find_pool() is None:
+            if time.monotonic() > deadline:
+                print(
+                    f"Error: Pool manager did not start, see {DEFAULT_LOG_FILE}",
+                    file=sys.stderr,
+                )
+                sys.exit(1)
+            time.sleep(0.05)
+        print(f"Pool manager started (log: {DEFAULT_LOG_FILE})", file=sys.stderr)
+
+    for config_path in warm:
+        docker_image = pinned_image(
+            load_tool_config(config_path)["docker_image"], image_lock
+        )
+        pull_docker_image(docker.from_env(), docker_image)
+        lease = attach(docker_image, count)
+        if lease is None:
+            sys.exit(1)
+        lease.release()
+
+
+def stop_pool() -> None:
+    """Stop the pool manager and every pooled container."""
+    pool = find_pool()
+    if pool is not None:
+        pool_url, token = pool
+        try:
+            requests.post(
+                f"{pool_url}/shutdown", headers=_auth_headers(token), timeout=5
+            )
+        except requests.RequestException as e:
+            print(f"Warning: Could not reach pool manager: {e}", file=sys.stderr)
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while find_pool() is not None and time.monotonic() < deadline:
+            time.sleep(0.1)
+        print("Pool manager stopped", file=sys.stderr)
+    else:
+        print("Pool manager is not running", file=sys.stderr)
+
+    # Remove containers left behind by a manager of this pool that was killed,
+    # but none of another pool or of a manager that is still running
+    leftovers = [
+        container
+        for container in docker.from_env().containers.list(
+            all=True,
+            filters={"label": [POOL_LABEL, f"{POOL_LABEL}.id={pool_id()}"]},
+        )
+        if not _manager_alive(container)
+    ]
+    if leftovers:
+        print(f"Removing {len(leftovers)} orphaned pool container(s)", file=sys.stderr)
+        stop_docker_containers(leftovers)
+
+
+def print_status() -> None:
+    """Print the pooled containers of every image."""
+    pool = find_pool()
+    if pool is None:
+        print("Pool manager is not running")
+        return
+    pool_url, token = pool
+    try:
+        status = requests.get(
+            f"{pool_url}/status", headers=_auth_headers(token), timeout=5
+        ).json()
+    except (requests.RequestException, ValueError) as e:
+        print(f"Error: Could not reach pool manager: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    print(
+        f"Pool manager running (pid {status['pid']}, "
+        f"idle timeout {status['idle_timeout']:g} s)"
+    )
+    for image in status["images"]:
+        print(
+            f"{image['image']}: {len(image['base_urls'])} container(s), "
+            f"{image['leases']} lease(s), idle {image['idle_seconds']:.0f} s"
+        )
+        for base_url in image["base_urls"]:
+            print(f"  {base_url}")
+
+
+def pool_main(argv: List[str]) -> None:
+    """Entry point of 'cli2rest-bio pool'."""
+    parser = argparse.ArgumentParser(prog="cli2rest-bio.py pool")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    start_parser = commands.add_parser(
+        "start", help="Start the pool manager in the background"
+    )
+    serve_parser = commands.add_parser(
+        "serve", help="Run the pool manager in the foreground"
+    )
+    for command_parser in (start_parser, serve_parser):
+        command_parser.add_argument(
+            "--idle-timeout",
+            type=positive_float,
+            default=DEFAULT_IDLE_TIMEOUT,
+            help=f"Seconds after the last run before an image's containers are stopped. Default: {DEFAULT_IDLE_TIMEOUT:g}",
+        )
+        command_parser.add_argument(
+            "--image-lock",
+            type=str,
+            default=DEFAULT_IMAGE_LOCK,
+            help=f"Lockfile written by 'cli2rest-bio prefetch'. Images listed there are run by their pinned digest, as in a run with the same --image-lock. Default: {DEFAULT_IMAGE_LOCK}",
+        )
+    start_parser.add_argument(
+        "--warm",
+        type=str,
+        action="append",
+        default=[],
+        help="Config whose containers are started right away. May be repeated.",
+    )
+    start_parser.add_argument(
+        "--containers",
+        type=positive_int,
+        default=1,
+        help="Number of containers to warm per --warm config. Default: 1",
+    )
+    commands.add_parser("stop", help="Stop the pool manager and its containers")
+    commands.add_parser("status", help="Show the pooled containers")
+
+    args = parser.parse_args(argv)
+    if args.command == "start":
+        start_pool(args.idle_timeout, args.warm, args.containers, args.image_lock)
+    elif args.command == "serve":
+        serve(args.idle_timeout, args.image_lock)
+    elif args.command == "stop":
+        stop_pool()
+    else:
+        print_status()
+
+
+if __name__ == "__main__":
+    pool_main(sys.argv[1:])
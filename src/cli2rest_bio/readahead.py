@@ -0,0 +1,140 @@
+"""Preparation of upcoming inputs while earlier ones are being uploaded."""
+
+import gzip
+import os
+import threading
+from collections import deque
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, Tuple
+
+from .inputs import input_size
+
+DEFAULT_READ_AHEAD = 8
+DEFAULT_READ_AHEAD_MEMORY = 512 * 1024**2
+
+
+class ReadAhead:
+    """
+    A bounded stage decompressing inputs before their upload starts.
+
+    Inputs are announced with schedule() in the order they are submitted to
+    the upload workers. Up to 'depth' of them are prepared at once on a
+    separate thread pool: gzipped inputs are decompressed into memory, as
+    long as their uncompressed sizes fit 'memory_budget' together, and plain
+    files are read into the page cache by the kernel. A worker collects the
+    prepared bytes with take() and frees its share of the budget with
+    release() once the upload is done. Inputs which were not prepared, or are
+    larger than the whole budget, are left to the worker as before.
+    """
+
+    def __init__(
+        self,
+        depth: int,
+        memory_budget: int,
+        threads: int,
+        decompress: bool = True,
+    ):
+        self.depth = depth
+        self.memory_budget = memory_budget
+        self.decompress = decompress
+        self._pool = ThreadPoolExecutor(
+            max_workers=threads, thread_name_prefix="read-ahead"
+        )
+        self._waiting: Deque[str] = deque()
+        self._jobs: Dict[str, Deque[Tuple[Future, int]]] = {}
+        self._started = 0
+        self._reserved = 0
+        self._lock = threading.Lock()
+
+    def schedule(self, input_file: str) -> None:
+        """Queue an input for preparation."""
+        with self._lock:
+            self._waiting.append(input_file)
+            self._start_more()
+
+    def take(self, input_file: str) -> bytes | None:
+        """
+        Wait for an input to be prepared and return its decompressed bytes.
+
+        Returns None when the worker should read the input itself.
+        """
+        with self._lock:
+            jobs = self._jobs.get(input_file)
+            if not jobs:
+                # Not started yet, the worker is faster reading it directly
+                if input_file in self._waiting:
+                    self._waiting.remove(input_file)
+                return None
+            future, _ = jobs[0]
+        try:
+            return future.result()
+        except (OSError, EOFError):
+            # Reading again in the worker reports the error as usual
+            return None
+
+    def release(self, input_file: str) -> None:
+        """Forget a prepared input, making room for the next ones."""
+        with self._lock:
+            jobs = self._jobs.get(input_file)
+            if not jobs:
+                if input_file in self._waiting:
+                    self._waiting.remove(input_file)
+                return
+            _, size = jobs.popleft()
+            if not jobs:
+                del self._jobs[input_file]
+            self._started -= 1
+            self._reserved -= size
+            self._start_more()
+
+    def shutdown(self) -> None:
+        """Stop preparing inputs."""
+        with self._lock:
+            self._waiting.clear()
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def _start_more(self) -> None:
+        while self._waiting and self._started < self.depth:
+            input_file = self._waiting[0]
+            gzipped = self.decompress and input_file.endswith(".gz")
+            size = input_size(input_file) if gzipped else 0
+            if size > self.memory_budget:
+                self._waiting.popleft()
+                continue
+            if self._reserved + size > self.memory_budget:
+                return
+            self._waiting.popleft()
+            self._started += 1
+            self._reserved += size
+            future = self._pool.submit(self._prepare, input_file, gzipped)
+            self._jobs.setdefault(input_file, deque()).append((future, size))
+
+    @staticmethod
+    def _prepare(input_file: str, gzipped: bool) -> bytes | None:
+        if gzipped:
+            with gzip.open(input_file, "rb") as f:
+                return f.read()
+        if hasattr(os, "posix_fadvise"):
+            fd = os.open(input_file, os.O_RDONLY)
+            try:
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+            finally:
+                os.close(fd)
+        return None
+
+
+class ReadAheadExecutor(Executor):
+    """An executor announcing the inputs of every submitted group to a ReadAhead."""
+
+    def __init__(self, executor: Executor, read_ahead: ReadAhead):
+        self.executor = executor
+        self.read_ahead = read_ahead
+
+    def submit(self, fn: Callable[..., Any], /, *args: Any, **kwargs: Any) -> Future:
+        for input_file in args[0]:
+            self.read_ahead.schedule(input_file)
+        return self.executor.submit(fn, *args, **kwargs)
+
+    def shutdown(self, wait: bool = True, *, cancel_futures: bool = False) -> None:
+        self.executor.shutdown(wait=wait, cancel_futures=cancel_futures)
+
@@ -0,0 +1,137 @@
+"""Scheduling of per-file tasks onto an executor."""
+
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Executor, Future, wait
+from typing import Any, Callable, Deque, Dict, Iterable, Iterator, List, Tuple, TypeVar
+
+T = TypeVar("T")
+
+
+def run_windowed(
+    executor: Executor,
+    func: Callable[[T], Any],
+    items: Iterable[T],
+    window: int,
+    ordered: bool = True,
+) -> Iterator[Tuple[T, Any]]:
+    """
+    Submit func(item) for each item, keeping at most 'window' tasks pending.
+
+    Yields (item, result) pairs in submission order, or in completion order when
+    'ordered' is False so that one slow task does not hold finished results back.
+    Items are pulled from the iterable only when a slot frees up, so neither the
+    inputs nor their futures are ever fully materialized.
+    """
+    iterator = iter(items)
+    if ordered:
+        return _run_ordered(executor, func, iterator, window)
+    return _run_unordered(executor, func, iterator, window)
+
+
+def _run_ordered(
+    executor: Executor,
+    func: Callable[[T], Any],
+    iterator: Iterator[T],
+    window: int,
+) -> Iterator[Tuple[T, Any]]:
+    pending: Deque[Tuple[T, Future]] = deque()
+    exhausted = False
+
+    while True:
+        while not exhausted and len(pending) < window:
+            try:
+                item = next(iterator)
+            except StopIteration:
+                exhausted = True
+                break
+            pending.append((item, executor.submit(func, item)))
+
+        if not pending:
+            return
+
+        item, future = pending.popleft()
+        yield item, future.result()
+
+
+def _run_unordered(
+    executor: Executor,
+    func: Callable[[T], Any],
+    iterator: Iterator[T],
+    window: int,
+) -> Iterator[Tuple[T, Any]]:
+    pending: Dict[Future, T] = {}
+    exhausted = False
+
+    while True:
+        while not exhausted and len(pending) < window:
+            try:
+                item = next(iterator)
+            except StopIteration:
+                exhausted = True
+                break
+            pending[executor.submit(func, item)] = item
+
+        if not pending:
+            return
+
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield pending.pop(future), future.result()
+
+
+def run_scheduled(
+    executor: Executor,
+    func: Callable[[T], Any],
+    items: Iterable[T],
+    cost: Callable[[T], float],
+    window: int,
+    ordered: bool = True,
+    largest_first: bool = True,
+) -> Iterator[Tuple[T, Any]]:
+    """
+    Submit func(item) in order of cost, keeping at most 'window' tasks pending.
+
+    With 'largest_first' the most expensive items start first, so that a few
+    large inputs do not end up as a long tail after everything else finished
+    (longest processing time first). Items of equal cost keep their order.
+    Results are still yielded in the order of 'items' when 'ordered' is True,
+    holding back those which finish early; otherwise in completion order.
+    All items are collected and costed before the first one is submitted.
+    """
+    indexed = list(enumerate(items))
+    costs = [cost(item) for _, item in indexed]
+    schedule = iter(
+        sorted(indexed, key=lambda pair: costs[pair[0]], reverse=largest_first)
+    )
+
+    pending: Dict[Future, Tuple[int, T]] = {}
+    finished: Dict[int, Tuple[T, Any]] = {}
+    next_index = 0
+    exhausted = False
+
+    while True:
+        while not exhausted and len(pending) < window:
+            try:
+                index, item = next(schedule)
+            except StopIteration:
+                exhausted = True
+                break
+            pending[executor.submit(func, item)] = (index, item)
+
+        if not pending:
+            return
+
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        completed: List[Tuple[int, T, Any]] = []
+        for future in done:
+            index, item = pending.pop(future)
+            completed.append((index, item, future.result()))
+
+        for index, item, result in sorted(completed, key=lambda entry: entry[0]):
+            if not ordered:
+                yield item, result
+                continue
+            finished[index] = (item, result)
+            while next_index in finished:
+                yield finished.pop(next_index)
+                next_index += 1
@@ -0,0 +1,221 @@
+"""Writing of received outputs on a separate thread pool."""
+
+import io
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import BinaryIO, Callable, Dict, Set, Tuple
+
+DEFAULT_OUTPUT_WRITERS = 4
+# Larger outputs are spooled to a local temporary file until they are written
+SPOOL_MAX_SIZE = 4 * 1024**2
+_COPY_CHUNK_SIZE = 1024 * 1024
+
+
+class _ReceivedOutput:
+    """
+    An output file received from the server, not yet written to its path.
+
+    It is kept in memory, or in a file in the local temporary directory once
+    larger than SPOOL_MAX_SIZE, so receiving it never touches the output
+    filesystem.
+    """
+
+    def __init__(self) -> None:
+        self.data = bytearray()
+        self.spool_path: str | None = None
+        self._spool: BinaryIO | None = None
+
+    def write(self, data: bytes) -> None:
+        if self._spool is None and len(self.data) + len(data) > SPOOL_MAX_SIZE:
+            fd, self.spool_path = tempfile.mkstemp(
+                prefix="cli2rest-bio-", suffix=".out"
+            )
+            self._spool = os.fdopen(fd, "wb")
+            self._spool.write(self.data)
+            self.data = bytearray()
+        if self._spool is not None:
+            self._spool.write(data)
+        else:
+            self.data += data
+
+    def close(self) -> None:
+        """Mark the output as received; it is written once committed."""
+        if self._spool is not None:
+            self._spool.close()
+            self._spool = None
+
+    def reader(self) -> BinaryIO:
+        """Open the received content for reading."""
+        if self.spool_path is not None:
+            return open(self.spool_path, "rb")
+        return io.BytesIO(self.data)
+
+    def discard(self) -> None:
+        """Drop the received content."""
+        self.close()
+        self.data = bytearray()
+        if self.spool_path is not None:
+            try:
+                os.unlink(self.spool_path)
+            except OSError:
+                pass
+            self.spool_path = None
+
+
+class OutputBatch:
+    """
+    The outputs of one response, written together once it has been parsed.
+
+    Outputs are opened with open() while the response is parsed and are kept
+    in memory, or in a local temporary file when large. commit() hands them to
+    the writer pool and returns immediately; discard() drops them, e.g. after a
+    truncated response, so no partial file ever reaches the output directory.
+    """
+
+    def __init__(self, writer: "OutputWriter"):
+        self.writer = writer
+        self.saved_paths: Dict[str, str] = {}
+        self._outputs: Dict[str, Tuple[str, _ReceivedOutput]] = {}
+        self._written = threading.Event()
+        self._written.set()
+
+    def open(self, filename: str, path: str) -> _ReceivedOutput:
+        """Return a file object receiving the output to be written to 'path'."""
+        previous = self._outputs.pop(filename, None)
+        if previous is not None:
+            previous[1].discard()
+        output = _ReceivedOutput()
+        self._outputs[filename] = (path, output)
+        return output
+
+    def commit(
+        self, on_written: Callable[[Dict[str, str]], None] | None = None
+    ) -> None:
+        """
+        Write the received outputs in the background.
+
+        Once all of them are written, 'on_written' is called on a writer
+        thread with the map from filename to path of those that succeeded.
+        """
+        outputs, self._outputs = self._outputs, {}
+        self._written.clear()
+        remaining = [len(outputs)]
+        lock = threading.Lock()
+
+        def finish() -> None:
+            try:
+                if on_written is not None:
+                    on_written(dict(self.saved_paths))
+            finally:
+                self._written.set()
+
+        def written(filename: str, path: str, future: Future) -> None:
+            error = future.exception()
+            if error is None:
+                print(f"Saved output to: {path}", file=sys.stderr)
+            else:
+                print(f"Error writing output file {path}: {error}", file=sys.stderr)
+            with lock:
+                if error is None:
+                    self.saved_paths[filename] = path
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last:
+                finish()
+
+        if not outputs:
+            finish()
+            return
+        for filename, (path, output) in outputs.items():
+            future = self.writer.submit(path, output)
+            future.add_done_callback(
+                lambda future, filename=filename, path=path: written(
+                    filename, path, future
+                )
+            )
+
+    def discard(self) -> None:
+        """Drop the outputs received so far."""
+        for _, output in self._outputs.values():
+            output.discard()
+        self._outputs = {}
+
+    def wait(self) -> Dict[str, str]:
+        """Wait for committed outputs to be written and return their paths."""
+        self._written.wait()
+        return self.saved_paths
+
+
+class OutputWriter:
+    """
+    A pool of threads writing outputs to their final paths.
+
+    All work on the output filesystem, which may be a slow network one, is
+    done here: creating the directory, writing a temporary file next to the
+    final path and renaming it into place once complete, so readers never see
+    a partial file. Directories known to exist are remembered, saving a
+    makedirs() call per output.
+    """
+
+    def __init__(self, threads: int = DEFAULT_OUTPUT_WRITERS):
+        self._pool = ThreadPoolExecutor(
+            max_workers=threads, thread_name_prefix="output-writer"
+        )
+        self._directories: Set[str] = set()
+        self._lock = threading.Lock()
+
+    def batch(self) -> OutputBatch:
+        """Start collecting the outputs of a response."""
+        return OutputBatch(self)
+
+    def submit(self, path: str, output: _ReceivedOutput) -> Future:
+        """Write a received output to 'path' on the pool."""
+        return self._pool.submit(self._write, path, output)
+
+    def shutdown(self) -> None:
+        """Wait for all pending outputs to be written."""
+        self._pool.shutdown(wait=True)
+
+    def _make_directory(self, directory: str) -> None:
+        with self._lock:
+            if directory in self._directories:
+                return
+        os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            self._directories.add(directory)
+
+    def _open_temporary(self, path: str) -> Tuple[str, BinaryIO]:
+        directory = os.path.dirname(path) or "."
+        tmp_path = os.path.join(
+            directory, f".{os.path.basename(path)}.{uuid.uuid4().hex[:8]}.tmp"
+        )
+        self._make_directory(directory)
+        try:
+            return tmp_path, open(tmp_path, "wb")
+        except FileNotFoundError:
+            # The directory was removed behind our back, create it again
+            with self._lock:
+                self._directories.discard(directory)
+            self._make_directory(directory)
+            return tmp_path, open(tmp_path, "wb")
+
+    def _write(self, path: str, output: _ReceivedOutput) -> None:
+        try:
+            tmp_path, handle = self._open_temporary(path)
+            try:
+                with handle, output.reader() as source:
+                    shutil.copyfileobj(source, handle, _COPY_CHUNK_SIZE)
+                os.replace(tmp_path, path)
+            except BaseException:
+                try:
+                    os.unlink(tmp_path)
+                except OSError:
+                    pass
+                raise
+        finally:
+            output.discard()